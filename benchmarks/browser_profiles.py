@@ -0,0 +1,110 @@
+"""
+Compares the browser profiles by loading pages from the stand-in site in a real browser, the same way the scraper
+does: search pages are read for their listing cards, and listing pages are checked for availability and read for their
+details. Pages carry images, fonts, styles and tracking scripts, like the real ones.
+
+For each profile, reports how long pages took to load and read, how many bytes the browser downloaded, how many
+requests reached the site, and how much memory Chrome was using at the end. Needs Chrome, but nothing leaves the
+machine. Run with `uv run python benchmarks/browser_profiles.py`.
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Dict, List
+from urllib.request import urlopen
+
+import stand_in_site
+
+# Bytes the browser downloaded for the current page, from the Resource Timing API. Blocked requests aren't included.
+TRANSFERRED = """
+return performance.getEntriesByType("navigation").concat(performance.getEntriesByType("resource"))
+    .reduce((total, entry) => total + entry.transferSize, 0);
+"""
+
+
+def served(url: str) -> Dict[str, int]:
+    with urlopen(f"{url}/__stats") as response:
+        return json.load(response)
+
+
+def percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(len(ordered) * percent / 100) - 1))]
+
+
+def run_profile(name: str, url: str, listing_ids: List[str], pages: int, headless: bool) -> Dict:
+    from rent_scraper.browser_pool import PROFILES, BrowserPool, PooledBrowser
+    from rent_scraper.model import Query, SimpleListing
+    from rent_scraper.parsing import parse
+    from rent_scraper.sites.domain import SEARCH_PAGE, Domain
+    from rent_scraper.util import new_browser
+
+    domain = Domain(http_first=False)
+
+    def read_search(page: int) -> None:
+        domain._cards_from_soup(parse(domain._load(domain._get_search_link(Query(), page), browser), SEARCH_PAGE))
+
+    def read_listing(listing_id: str) -> None:
+        if domain.listing_available(SimpleListing(id=listing_id), browser):
+            domain.details_from_page(browser)
+
+    browser = new_browser(headless)
+    results = {}
+    try:
+        browser.use(PROFILES[name])
+        for kind, read, keys in [("search", read_search, range(1, pages + 1)), ("listing", read_listing, listing_ids)]:
+            times = []
+            transferred = 0
+            before = served(url)
+            for key in keys:
+                start = time.perf_counter()
+                read(key)
+                times.append(time.perf_counter() - start)
+                transferred += browser.execute_script(TRANSFERRED)
+            after = served(url)
+            results[kind] = {
+                "times": times,
+                "kb_per_page": transferred / 1024 / len(times),
+                "requests_per_page": (sum(after.values()) - sum(before.values())) / len(times),
+            }
+        rss = BrowserPool._rss_mb(PooledBrowser(browser))
+    finally:
+        browser.quit()
+    return {"pages": results, "rss_mb": rss}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=10, help="Number of search pages to load with each profile")
+    parser.add_argument("--listing-pages", type=int, default=40, help="Number of listing pages to load")
+    parser.add_argument("--latency", type=float, default=0, help="Average seconds the site takes to respond")
+    parser.add_argument("--headed", action="store_true", help="Show the browser instead of running it headless")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    listings = stand_in_site.generate(args.pages * stand_in_site.PAGE_SIZE, args.seed)
+    site, url = stand_in_site.start(listings=len(listings), seed=args.seed, latency=args.latency, assets=True)
+    # Read when the scraper is imported, so set first
+    os.environ.update({"DOMAIN_URL": url, "RATE_LIMIT": "10000", "RATE_LIMIT_MAX": "10000"})
+    os.environ.pop("PAGE_CACHE_DIR", None)
+    from rent_scraper.browser_pool import PROFILES
+
+    listing_ids = list(listings)[: args.listing_pages]
+    try:
+        print(f"  {'profile':<10}{'page':<10}{'p50 ms':>10}{'p99 ms':>10}{'KB/page':>10}{'requests':>10}{'RSS MB':>10}")
+        for name in PROFILES:
+            result = run_profile(name, url, listing_ids, args.pages, not args.headed)
+            for page, stats in result["pages"].items():
+                times = stats["times"]
+                print(
+                    f"  {name:<10}{page:<10}{percentile(times, 50) * 1000:>10.0f}{percentile(times, 99) * 1000:>10.0f}"
+                    f"{stats['kb_per_page']:>10.0f}{stats['requests_per_page']:>10.1f}{result['rss_mb']:>10.0f}"
+                )
+    finally:
+        site.terminate()
+
+
+if __name__ == "__main__":
+    main()
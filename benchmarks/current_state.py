@@ -0,0 +1,124 @@
+"""
+Compares reading the current listing state with ROW_NUMBER() over the history tables (the original views) against
+reading it from the maintained state tables.
+
+Synthetic data is generated in a scratch "benchmark" schema which is dropped afterwards, so this can be run against
+any database. Run with `uv run --env-file .env python benchmarks/current_state.py`.
+"""
+
+import argparse
+import statistics
+import time
+
+from rent_scraper.model import db, init_db
+
+SETUP = """
+DROP SCHEMA IF EXISTS benchmark CASCADE;
+CREATE SCHEMA benchmark;
+SET search_path TO benchmark;
+
+CREATE TABLE address (id INTEGER PRIMARY KEY, address TEXT);
+CREATE TABLE addresshistory (address_id INTEGER, beds INTEGER, baths INTEGER, cars INTEGER, valid_from TIMESTAMP);
+CREATE TABLE listing (id TEXT PRIMARY KEY, address_id INTEGER);
+CREATE TABLE listinghistory (listing_id TEXT, price INTEGER, valid_from TIMESTAMP, valid_until TIMESTAMP);
+
+INSERT INTO address SELECT i, 'Address ' || i FROM generate_series(1, %(addresses)s) i;
+INSERT INTO addresshistory
+SELECT i, 1 + (i + h) %% 5, 1 + i %% 3, i %% 3, NOW() - (h || ' days')::INTERVAL
+FROM generate_series(1, %(addresses)s) i, generate_series(1, 2) h;
+INSERT INTO listing SELECT i::TEXT, 1 + i %% %(addresses)s FROM generate_series(1, %(listings)s) i;
+INSERT INTO listinghistory
+SELECT i::TEXT,
+       100 + (i * 7 + h * 13) %% 2000,
+       NOW() - (h || ' days')::INTERVAL,
+       CASE WHEN h > 1 OR i %% 3 = 0 THEN NOW() - ((h - 1) || ' days')::INTERVAL END
+FROM generate_series(1, %(listings)s) i, generate_series(1, %(history)s) h;
+
+CREATE INDEX ON addresshistory (address_id, valid_from DESC);
+CREATE INDEX ON listinghistory (listing_id, valid_from DESC);
+
+CREATE TABLE listingstate AS
+SELECT DISTINCT ON (listing_id) listing_id, price, valid_until IS NULL AS available
+FROM listinghistory ORDER BY listing_id, valid_from DESC;
+ALTER TABLE listingstate ADD PRIMARY KEY (listing_id);
+CREATE INDEX ON listingstate (available, price) INCLUDE (listing_id);
+
+CREATE TABLE addressstate AS
+SELECT DISTINCT ON (address_id) address_id, beds, baths, cars
+FROM addresshistory ORDER BY address_id, valid_from DESC;
+ALTER TABLE addressstate ADD PRIMARY KEY (address_id);
+CREATE INDEX ON addressstate (beds) INCLUDE (address_id);
+
+ANALYZE;
+"""
+
+ROW_NUMBER_RANGE = """
+SELECT l.id
+FROM listing l
+         JOIN (SELECT listing_id, price, valid_until,
+                      ROW_NUMBER() OVER (PARTITION BY listing_id ORDER BY valid_from DESC) AS rn
+               FROM listinghistory) lh ON lh.listing_id = l.id AND lh.rn = 1
+         JOIN (SELECT address_id, beds,
+                      ROW_NUMBER() OVER (PARTITION BY address_id ORDER BY valid_from DESC) AS rn
+               FROM addresshistory) ah ON ah.address_id = l.address_id AND ah.rn = 1
+WHERE lh.price > 500 AND lh.price < 600 AND ah.beds = 2 AND lh.valid_until IS NULL
+"""
+
+STATE_RANGE = """
+SELECT l.id
+FROM listing l
+         JOIN listingstate ls ON ls.listing_id = l.id
+         JOIN addressstate ads ON ads.address_id = l.address_id
+WHERE ls.price > 500 AND ls.price < 600 AND ads.beds = 2 AND ls.available
+"""
+
+ROW_NUMBER_LOOKUP = """
+SELECT l.id, lh.price, lh.valid_until IS NULL
+FROM listing l
+         JOIN (SELECT listing_id, price, valid_until,
+                      ROW_NUMBER() OVER (PARTITION BY listing_id ORDER BY valid_from DESC) AS rn
+               FROM listinghistory) lh ON lh.listing_id = l.id AND lh.rn = 1
+WHERE l.id = '12345'
+"""
+
+STATE_LOOKUP = """
+SELECT l.id, ls.price, ls.available
+FROM listing l
+         JOIN listingstate ls ON ls.listing_id = l.id
+WHERE l.id = '12345'
+"""
+
+
+def time_query(sql: str, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        db.execute_sql(sql).fetchall()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--listings", type=int, default=1_000_000)
+    parser.add_argument("--history", type=int, default=3, help="History rows per listing")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    init_db()
+    print(f"Generating {args.listings * args.history} history rows...")
+    db.execute_sql(SETUP, {"listings": args.listings, "history": args.history, "addresses": args.listings // 2})
+    try:
+        for name, old, new in [
+            ("Range search", ROW_NUMBER_RANGE, STATE_RANGE),
+            ("Single listing lookup", ROW_NUMBER_LOOKUP, STATE_LOOKUP),
+        ]:
+            old_time = time_query(old, args.repeat)
+            new_time = time_query(new, args.repeat)
+            print(f"{name}: ROW_NUMBER {old_time:.1f}ms, state tables {new_time:.1f}ms ({old_time / new_time:.0f}x)")
+    finally:
+        db.execute_sql("DROP SCHEMA benchmark CASCADE")
+
+
+if __name__ == "__main__":
+    main()
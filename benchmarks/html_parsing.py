@@ -0,0 +1,150 @@
+"""
+Compares the HTML parsers that search pages can be read with, timing how long each takes to read the listing cards from
+a page, and checks that every parser finds the same cards as parsing the whole page with html.parser does.
+
+Pages are recorded search pages from a page cache, or synthetic ones from the stand-in site, padded out with the kind
+of markup real pages carry around the cards. Parsing is also run across a thread pool and a process pool, to show
+whether large pages are worth sending to PARSE_PROCESSES. Parsers that aren't installed are skipped. Run with
+`uv run --extra fast-parse python benchmarks/html_parsing.py`.
+"""
+
+import argparse
+import json
+import random
+import sqlite3
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Dict, List
+
+import stand_in_site
+
+# Each backend along with reading the whole page, which is how pages were parsed before the backends were added
+BASELINE = "html.parser (whole page)"
+
+
+def recorded_pages(directory: str, limit: int) -> List[str]:
+    from rent_scraper.page_cache import PageCache
+
+    cache = PageCache(directory, replay=True)
+    index = sqlite3.connect(Path(directory) / "index.sqlite")
+    urls = [
+        url for (url,) in index.execute("SELECT DISTINCT url FROM page WHERE url_class = 'search' AND status = 200")
+    ]
+    index.close()
+    return [page.text for url in urls[:limit] if (page := cache.get(url)) is not None]
+
+
+def synthetic_pages(count: int, padding_kb: int, seed: int) -> List[str]:
+    site = stand_in_site.StandInSite(stand_in_site.generate(count * stand_in_site.PAGE_SIZE, seed))
+    rng = random.Random(seed)
+    pages = []
+    for number in range(1, count + 1):
+        page = site.search({"page": str(number)})
+        # Real pages embed the whole result set as JSON and wrap the cards in a lot of layout
+        data = json.dumps(
+            [{"id": rng.getrandbits(64), "text": "x" * rng.randint(20, 200)} for _ in range(padding_kb * 4)]
+        )
+        layout = "".join(
+            f'<div class="css-{rng.getrandbits(24):x}"><a href="/link/{i}"><span>Link {i}</span></a></div>'
+            for i in range(padding_kb * 8)
+        )
+        page = page.replace("</head>", f'<script id="__NEXT_DATA__" type="application/json">{data}</script></head>')
+        pages.append(
+            page.replace("<body>", f"<body><nav>{layout}</nav>").replace("</body>", f"<footer>{layout}</footer></body>")
+        )
+    return pages
+
+
+def read_cards(backend: str, html: str):
+    from bs4 import BeautifulSoup
+
+    from rent_scraper.parsing import parse
+    from rent_scraper.sites.domain import SEARCH_PAGE, Domain
+
+    if backend == BASELINE:
+        soup = BeautifulSoup(html, "html.parser")
+    else:
+        soup = parse(html, SEARCH_PAGE, backend)
+    return Domain._count_from_soup(soup), Domain(http_first=True)._cards_from_soup(soup)
+
+
+def read_all(backend: str, pages: List[str]) -> List:
+    return [read_cards(backend, page) for page in pages]
+
+
+def time_backend(backend: str, pages: List[str], repeats: int) -> Dict[str, float]:
+    times = []
+    for _ in range(repeats):
+        for page in pages:
+            start = time.perf_counter()
+            read_cards(backend, page)
+            times.append(time.perf_counter() - start)
+    times.sort()
+    return {
+        "mean_ms": sum(times) / len(times) * 1000,
+        "p50_ms": times[len(times) // 2] * 1000,
+        "p99_ms": times[min(len(times) - 1, round(len(times) * 0.99))] * 1000,
+    }
+
+
+def time_pool(executor: Executor, backend: str, pages: List[str], workers: int) -> float:
+    # Warmed up first, so that starting the workers isn't counted
+    list(executor.map(read_cards, [backend] * workers, pages[:workers]))
+    start = time.perf_counter()
+    list(executor.map(read_cards, [backend] * len(pages), pages))
+    return len(pages) / (time.perf_counter() - start)
+
+
+def main() -> None:
+    from rent_scraper.parsing import available_backends
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recorded", help="Page cache directory to read recorded search pages from")
+    parser.add_argument("--pages", type=int, default=20, help="Number of pages to parse")
+    parser.add_argument("--padding-kb", type=int, default=256, help="Rough size of the markup added to synthetic pages")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=4, help="Threads and processes to compare parsing across")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.recorded:
+        pages = recorded_pages(args.recorded, args.pages)
+        if not pages:
+            raise SystemExit(f"No search pages recorded in {args.recorded}")
+    else:
+        pages = synthetic_pages(args.pages, args.padding_kb, args.seed)
+    size = sum(len(page) for page in pages) / len(pages) / 1024
+    print(f"{len(pages)} pages, {size:.0f} KB on average")
+
+    expected = read_all(BASELINE, pages)
+    backends = [BASELINE] + available_backends()
+    print(f"  {'parser':<28}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'speedup':>10}")
+    baseline = None
+    for backend in backends:
+        if read_all(backend, pages) != expected:
+            print(f"  {backend:<28} read different cards to the whole page, skipping")
+            continue
+        times = time_backend(backend, pages, args.repeats)
+        baseline = baseline or times["mean_ms"]
+        print(
+            f"  {backend:<28}{times['mean_ms']:>10.2f}{times['p50_ms']:>10.2f}{times['p99_ms']:>10.2f}"
+            f"{baseline / times['mean_ms']:>9.1f}x"
+        )
+
+    print(f"Pages per second across {args.workers} workers")
+    print(f"  {'parser':<28}{'threads':>10}{'processes':>10}")
+    with (
+        ThreadPoolExecutor(args.workers) as threads,
+        ProcessPoolExecutor(args.workers, mp_context=get_context("spawn")) as processes,
+    ):
+        for backend in backends:
+            print(
+                f"  {backend:<28}{time_pool(threads, backend, pages, args.workers):>10.1f}"
+                f"{time_pool(processes, backend, pages, args.workers):>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Checks that the entry points that don't scrape can be imported quickly, without a database or browser being available.
+
+Run with `uv run python benchmarks/import_time.py`. Exits with a non-zero status if any module is over budget.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+MODULES = ["rent_scraper.model", "rent_scraper.migrate"]
+# Shown for reference, as most of the import time is spent importing these
+DEPENDENCIES = ["peewee"]
+
+SCRIPT = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+
+def time_import(module: str) -> float:
+    # Each import needs a fresh interpreter, otherwise it will already be cached in sys.modules
+    result = subprocess.run(
+        [sys.executable, "-c", SCRIPT.format(module=module)], capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--budget", type=float, default=100, help="Maximum median import time in milliseconds")
+    parser.add_argument("--repeat", type=int, default=10, help="Number of times to import each module")
+    args = parser.parse_args()
+
+    for module in DEPENDENCIES:
+        times = [time_import(module) * 1000 for _ in range(args.repeat)]
+        print(f"{module}: median {statistics.median(times):.1f}ms (dependency)")
+
+    over_budget = False
+    for module in MODULES:
+        times = [time_import(module) * 1000 for _ in range(args.repeat)]
+        median = statistics.median(times)
+        status = "OK" if median <= args.budget else "OVER BUDGET"
+        print(f"{module}: median {median:.1f}ms, max {max(times):.1f}ms - {status}")
+        over_budget |= median > args.budget
+
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""
+Runs the whole search against the stand-in site and a scratch database, and reports how fast it went: pages and
+listings per second, database queries per listing, latency of each stage and peak memory.
+
+The first run starts from an empty database, so every listing is new. Each run after it sees the site a generation
+later, with some listings let, repriced or added, and the database a few days older, so listings come due for a refresh
+as they would between real runs. Nothing leaves the machine, so this can be run on CI with only PostgreSQL available.
+
+Functions can be line profiled with `--profile rent_scraper.sites.domain:Domain.details_from_card`, using the
+line-profiler from the dev dependencies. Run with `uv run --env-file .env python benchmarks/search_throughput.py`.
+"""
+
+import argparse
+import csv
+import functools
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+from queue import Empty
+from threading import Lock
+from typing import Dict, List
+from urllib.request import urlopen
+
+import stand_in_site
+
+DATABASE = "rent_finder_benchmark"
+
+
+class Stages:
+    """
+    Collects how long each call to the functions being timed took.
+    """
+
+    def __init__(self) -> None:
+        self.times: Dict[str, List[float]] = {}
+        self._lock = Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.times.setdefault(stage, []).append(seconds)
+
+    def timed(self, stage: str, function):
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+
+        else:
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+
+        return wrapper
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            stage: {
+                "calls": len(times),
+                "p50_ms": percentile(times, 50) * 1000,
+                "p99_ms": percentile(times, 99) * 1000,
+                "total_s": sum(times),
+            }
+            for stage, times in self.times.items()
+        }
+
+
+class QueryCounter(logging.Handler):
+    """
+    Counts the queries peewee runs, which it logs at debug level.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(logging.DEBUG)
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # The connection pool logs to a child logger, which isn't a query
+        if record.name == "peewee":
+            self.count += 1
+
+
+def percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(len(ordered) * percent / 100) - 1))]
+
+
+def patch(owner, name: str, wrap) -> None:
+    """
+    Replaces a function with a wrapped version of itself, keeping it static if it was.
+    """
+    original = inspect.getattr_static(owner, name)
+    if isinstance(original, (staticmethod, classmethod)):
+        setattr(owner, name, type(original)(wrap(original.__func__)))
+    else:
+        setattr(owner, name, wrap(original))
+
+
+def resolve(target: str):
+    """
+    :param target: A function as "module:attribute.path", e.g. "rent_scraper.sites.domain:Domain.details_from_card".
+    :return: The object the function belongs to, and its name.
+    """
+    module_name, _, path = target.partition(":")
+    owner = __import__(module_name, fromlist=["_"])
+    *parents, name = path.split(".")
+    for parent in parents:
+        owner = getattr(owner, parent)
+    return owner, name
+
+
+def run_search(workdir: str, profile: List[str], profile_output: str | None, results: multiprocessing.Queue) -> None:
+    """
+    Runs one search, timing each stage. Runs in its own process so each run starts cold, as it would for real, and
+    so peak memory is per run.
+    """
+    from rent_scraper import search
+    from rent_scraper.range_planner import RangePlanner
+    from rent_scraper.sites import domain
+
+    os.chdir(workdir)
+    stages = Stages()
+    swept = []
+
+    def count_swept(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            listings = function(*args, **kwargs)
+            swept.append(len(listings))
+            return listings
+
+        return wrapper
+
+    profiler = None
+    if profile:
+        from line_profiler import LineProfiler
+
+        profiler = LineProfiler()
+        for target in profile:
+            patch(*resolve(target), profiler)
+
+    patch(RangePlanner, "plan", lambda f: stages.timed("plan ranges", f))
+    patch(domain.Domain, "count_listings", lambda f: stages.timed("count range", f))
+    patch(domain.Domain, "get_page_async", lambda f: stages.timed("search page", f))
+    patch(domain.Domain, "_listing_details_async", lambda f: stages.timed("listing page", f))
+    patch(domain.Domain, "update_listing_async", lambda f: stages.timed("refresh listing", f))
+    patch(domain, "save_listings", lambda f: stages.timed("save listings", f))
+    patch(search, "populate_coordinates", lambda f: stages.timed("geocode", f))
+    patch(search, "sweep_range", lambda f: count_swept(stages.timed("sweep range", f)))
+
+    queries = QueryCounter()
+    peewee = logging.getLogger("peewee")
+    peewee.setLevel(logging.DEBUG)
+    peewee.propagate = False
+    peewee.addHandler(queries)
+
+    start = time.perf_counter()
+    search.search()
+    elapsed = time.perf_counter() - start
+
+    if profiler is not None:
+        profiler.print_stats(output_unit=1e-3, stripzeros=True)
+        if profile_output:
+            profiler.dump_stats(profile_output)
+
+    results.put(
+        {
+            "seconds": elapsed,
+            "listings": sum(swept),
+            "queries": queries.count,
+            # Kilobytes on Linux
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "stages": stages.summary(),
+        }
+    )
+
+
+def administer(statement: str) -> None:
+    """
+    Runs a statement outside of any transaction on the server's default database, as creating and dropping databases
+    has to be.
+    """
+    import psycopg2
+
+    connection = psycopg2.connect(
+        dbname="postgres", user=os.getenv("DB_USER"), password=os.getenv("DB_PASS"), host=os.getenv("DB_HOST")
+    )
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute(statement)
+    connection.close()
+
+
+def create_database() -> None:
+    from rent_scraper.migrate import run_migrations
+    from rent_scraper.model import db, init_db
+
+    drop_database()
+    administer(f'CREATE DATABASE "{DATABASE}"')
+    logging.getLogger("rent-scraper").setLevel(logging.WARNING)
+    init_db()
+    run_migrations()
+    db.close()
+
+
+def drop_database() -> None:
+    # Forced, in case a run that was interrupted left connections open
+    administer(f'DROP DATABASE IF EXISTS "{DATABASE}" WITH (FORCE)')
+
+
+def age_database(hours: float) -> None:
+    """
+    Moves everything the next run checks the age of back in time, as if the runs were further apart.
+    """
+    from rent_scraper.model import db, init_db
+
+    init_db()
+    interval = f"{hours} hours"
+    db.execute_sql("UPDATE listingcheck SET next_check = next_check - %s::INTERVAL", (interval,))
+    db.execute_sql("UPDATE query SET counted_at = counted_at - %s::INTERVAL", (interval,))
+    db.close()
+
+
+def wait_for(process: multiprocessing.Process, queue: multiprocessing.Queue) -> Dict:
+    while True:
+        try:
+            result = queue.get(timeout=1)
+        except Empty:
+            if not process.is_alive():
+                raise RuntimeError(f"Search exited with {process.exitcode} without finishing")
+            continue
+        process.join()
+        return result
+
+
+def report(run: int, result: Dict) -> None:
+    served = result["requests"]
+    pages = served.get("search", 0) + served.get("listing", 0) + served.get("missing", 0)
+    listings = max(result["listings"], 1)
+    print(
+        f"Run {run}: {result['seconds']:.1f}s, {pages} pages ({pages / result['seconds']:.1f}/s), "
+        f"{result['listings']} listings ({result['listings'] / result['seconds']:.1f}/s), "
+        f"{result['queries'] / listings:.2f} queries/listing, peak RSS {result['peak_rss_mb']:.0f} MB"
+    )
+    print(f"  Requests served: {served}")
+    print(f"  {'stage':<16}{'calls':>8}{'p50 ms':>10}{'p99 ms':>10}{'total s':>10}")
+    for stage, times in sorted(result["stages"].items()):
+        print(
+            f"  {stage:<16}{times['calls']:>8}{times['p50_ms']:>10.1f}{times['p99_ms']:>10.1f}{times['total_s']:>10.1f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--listings", type=int, default=5000, help="Number of listings on the site at the start")
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument("--churn", type=float, default=0.05, help="Fraction of listings that change between runs")
+    parser.add_argument("--hours-between", type=float, default=72, help="How far apart the runs are made to look")
+    parser.add_argument("--latency", type=float, default=0, help="Average seconds the site takes to respond")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests the site answers with a 500")
+    parser.add_argument("--recorded", help="Page cache directory to serve recorded pages from, instead of synthetic")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--profile", action="append", default=[], help="Function to line profile, can be repeated")
+    parser.add_argument("--profile-output", help="File to save the line profile to, for `python -m line_profiler`")
+    parser.add_argument("--json", help="File to write the results to")
+    parser.add_argument("--keep", action="store_true", help=f"Keep the {DATABASE} database afterwards")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="search-benchmark-")
+    gazetteer = os.path.join(workdir, "gazetteer.csv")
+    with open(gazetteer, "w", newline="") as f:
+        writer = csv.DictWriter(f, ["suburb", "state", "postcode", "latitude", "longitude"])
+        writer.writeheader()
+        writer.writerows(stand_in_site.gazetteer_rows())
+
+    # Inherited by the processes the runs are spawned in
+    os.environ.update(
+        {
+            "DB_NAME": DATABASE,
+            "THREADS": str(args.threads),
+            "GAZETTEER_FILE": gazetteer,
+            # The stand-in can take far more than the real site, so don't hold back
+            "RATE_LIMIT": "10000",
+            "RATE_LIMIT_MAX": "10000",
+            "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+        }
+    )
+    os.environ.pop("PAGE_CACHE_DIR", None)
+    create_database()
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    try:
+        for run in range(1, args.runs + 1):
+            if run > 1:
+                age_database(args.hours_between)
+            site, url = stand_in_site.start(
+                listings=args.listings,
+                seed=args.seed,
+                generation=run - 1,
+                churn=args.churn,
+                latency=args.latency,
+                error_rate=args.error_rate,
+                recorded=args.recorded,
+            )
+            os.environ["DOMAIN_URL"] = url
+            queue = context.Queue()
+            process = context.Process(target=run_search, args=(workdir, args.profile, args.profile_output, queue))
+            process.start()
+            result = wait_for(process, queue)
+            with urlopen(f"{url}/__stats") as response:
+                result["requests"] = json.load(response)
+            site.terminate()
+
+            report(run, result)
+            results.append(result)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        if not args.keep:
+            drop_database()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
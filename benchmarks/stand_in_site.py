@@ -0,0 +1,380 @@
+"""
+A local stand-in for domain.com.au, serving search results, listing pages and result counts for a synthetic set of
+listings, or pages recorded in a page cache, so the scraper can be run without touching the real site.
+
+Synthetic listings are generated from a seed, so every run sees the same site. Each generation after the first lets,
+reprices and adds a fraction of the listings, as would happen between two real runs. Latency and errors can be added
+to every response, and pages can carry the images, fonts, styles and tracking scripts real pages do, for comparing
+browser profiles. Point the scraper at it with `DOMAIN_URL`, and run it on its own with
+`uv run python benchmarks/stand_in_site.py --port 8000`.
+"""
+
+import argparse
+import html
+import json
+import math
+import multiprocessing
+import random
+import re
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+# Name, state, postcode, latitude and longitude
+SUBURBS = [
+    ("Carlton", "VIC", "3053", -37.8001, 144.9671),
+    ("Fitzroy", "VIC", "3065", -37.7984, 144.9780),
+    ("Newtown", "NSW", "2042", -33.8970, 151.1793),
+    ("Surry Hills", "NSW", "2010", -33.8859, 151.2111),
+    ("Fortitude Valley", "QLD", "4006", -27.4570, 153.0345),
+    ("Glenelg", "SA", "5045", -34.9800, 138.5150),
+    ("Fremantle", "WA", "6160", -32.0569, 115.7439),
+    ("Battery Point", "TAS", "7004", -42.8910, 147.3320),
+    ("Braddon", "ACT", "2612", -35.2710, 149.1350),
+    ("Parap", "NT", "0820", -12.4320, 130.8430),
+]
+STREETS = ["Smith Street", "High Street", "Station Road", "Park Avenue", "Church Street", "King Street", "Beach Road"]
+
+PAGE_SIZE = 20
+# The real site won't page past this many results
+RESULT_CAP = 1000
+FIRST_ID = 2019000000
+# Fraction of cards missing their price, so the listing page has to be loaded
+INCOMPLETE_CARDS = 0.05
+# Where recorded pages were fetched from
+RECORDED_ORIGIN = "https://www.domain.com.au"
+
+# Photos on each card and on each listing page, when pages carry assets
+CARD_PHOTOS = 2
+LISTING_PHOTOS = 12
+# Content type and size in bytes of each kind of asset, roughly as big as the real ones
+ASSET_TYPES = {
+    ".jpg": ("image/jpeg", 120_000),
+    ".woff2": ("font/woff2", 40_000),
+    ".css": ("text/css", 60_000),
+    ".js": ("application/javascript", 90_000),
+}
+STYLESHEET = "@font-face { font-family: Site; src: url(/static/site.woff2); } body { font-family: Site; }"
+# Keeps the main thread busy for a while, as tracking scripts do
+SCRIPT = "(function () { var total = 0; for (var i = 0; i < 5e6; i++) { total += i; } })();"
+ASSETS_HEAD = (
+    '<link rel="stylesheet" href="/static/site.css">'
+    '<script async src="/gtm.js"></script><script async src="/analytics.js"></script>'
+)
+
+
+@dataclass
+class SiteListing:
+    id: str
+    address: str
+    price: int
+    beds: int
+    baths: int
+    cars: int
+    updated: int
+    complete: bool
+
+
+def generate(count: int, seed: int = 0, generation: int = 0, churn: float = 0.05) -> Dict[str, SiteListing]:
+    """
+    :param count: Number of listings to start with.
+    :param seed: Seed for the listings, which are the same for the same seed.
+    :param generation: Number of times the listings have changed since the first generation.
+    :param churn: Fraction of listings that are let, repriced or added each generation.
+    :return: The listings on the site, by ID.
+    """
+    rng = random.Random(seed)
+    listings = {}
+    next_id = FIRST_ID
+
+    def add(updated: int) -> None:
+        nonlocal next_id
+        suburb, state, postcode, _, _ = rng.choice(SUBURBS)
+        number = rng.randint(1, 250)
+        street = f"{number} {rng.choice(STREETS)}"
+        if rng.random() < 0.4:
+            street = f"{rng.randint(1, 30)}/{street}"
+        address = f"{street}, {suburb} {state} {postcode}"
+        beds = min(rng.choices(range(7), weights=[5, 25, 35, 20, 10, 4, 1])[0], 6)
+        price = max(100, round((250 + beds * 150 + rng.gauss(0, 120)) * math.exp(rng.gauss(0, 0.25)) / 5) * 5)
+        slug = re.sub(r"[^a-z0-9]+", "-", address.lower()).strip("-")
+        listings[f"{slug}-{next_id}"] = SiteListing(
+            id=f"{slug}-{next_id}",
+            address=address,
+            price=price,
+            beds=beds,
+            baths=max(1, beds - rng.randint(0, 2)),
+            cars=rng.randint(0, 2),
+            updated=updated,
+            complete=rng.random() >= INCOMPLETE_CARDS,
+        )
+        next_id += 1
+
+    for i in range(count):
+        add(i)
+    for g in range(1, generation + 1):
+        updated = count * (g + 1)
+        for listing in list(listings.values()):
+            roll = rng.random()
+            if roll < churn / 2:
+                del listings[listing.id]
+            elif roll < churn:
+                listing.price = max(100, listing.price + rng.choice([-50, -20, 20, 50]))
+                listing.updated = updated + rng.randint(0, count)
+        for _ in range(int(count * churn / 2)):
+            add(updated + rng.randint(0, count))
+    return listings
+
+
+class StandInSite:
+    """
+    Renders the pages of the site for a set of listings, in the same shape as the real pages where the scraper reads
+    them.
+    """
+
+    def __init__(self, listings: Dict[str, SiteListing], assets: bool = False) -> None:
+        self.listings = listings
+        self.assets = assets
+        # Newest first, as the scraper sorts by when listings were updated
+        self.ordered = sorted(listings.values(), key=lambda listing: (-listing.updated, listing.id))
+
+    def search(self, query: Dict[str, str]) -> str:
+        lower, upper = 0, math.inf
+        if "price" in query:
+            lower, _, upper = query["price"].partition("-")
+            lower, upper = int(lower or 0), int(upper) if upper.isdigit() else math.inf
+        beds = query.get("bedrooms")
+        matches = [
+            listing
+            for listing in self.ordered
+            if lower <= listing.price <= upper and (beds is None or self._beds_match(listing.beds, beds))
+        ]
+        page = int(query.get("page", 1))
+        start = (page - 1) * PAGE_SIZE
+        shown = matches[start : min(start + PAGE_SIZE, RESULT_CAP)] if start < RESULT_CAP else []
+        cards = "\n".join(self._card(listing) for listing in shown)
+        return (
+            f"<html><head><title>Rental Properties | Domain</title>{self._head()}</head><body>"
+            f'<h1 data-testid="summary"><strong>{len(matches)} Properties</strong> for rent</h1>'
+            f'<ul data-testid="results">{cards}</ul></body></html>'
+        )
+
+    def listing(self, listing_id: str) -> Tuple[int, str]:
+        if (listing := self.listings.get(listing_id)) is None:
+            return 404, (
+                "<html><head><title>Page not found | Domain</title></head>"
+                "<body><h1>Sorry, we couldn't find that page</h1></body></html>"
+            )
+        address = html.escape(listing.address)
+        return 200, (
+            f"<html><head><title>{address} - Apartment for Rent | Domain</title>{self._head()}</head><body>"
+            f"<h1>{address}</h1>{self._photos(listing, LISTING_PHOTOS)}"
+            f'<div data-testid="listing-details__listing-summary-title-name">{self._price(listing)}</div>'
+            f'<div data-testid="property-features-wrapper">{self._features(listing)}</div>'
+            f"</body></html>"
+        )
+
+    def _card(self, listing: SiteListing) -> str:
+        street, _, locality = listing.address.rpartition(", ")
+        price = self._price(listing) if listing.complete else "Contact agent"
+        return (
+            f'<li data-testid="listing-{listing.id}">{self._photos(listing, CARD_PHOTOS)}'
+            f'<div data-testid="listing-card-wrapper-premiumplus">'
+            f'<p data-testid="listing-card-price">{price}</p>'
+            f'<h2 data-testid="address-wrapper"><span>{html.escape(street)},</span> '
+            f"<span>{html.escape(locality)}</span></h2>"
+            f'<div data-testid="property-features">{self._features(listing)}</div>'
+            f"</div></li>"
+        )
+
+    def _head(self) -> str:
+        return ASSETS_HEAD if self.assets else ""
+
+    def _photos(self, listing: SiteListing, count: int) -> str:
+        if not self.assets:
+            return ""
+        return "".join(f'<img src="/static/photos/{listing.id}-{number}.jpg" alt="">' for number in range(count))
+
+    @staticmethod
+    def _features(listing: SiteListing) -> str:
+        features = [(listing.beds, "Beds"), (listing.baths, "Baths"), (listing.cars or "−", "Parking")]
+        return "".join(
+            f'<span data-testid="property-features-feature"><span>{count}</span> <span>{label}</span></span>'
+            for count, label in features
+        )
+
+    @staticmethod
+    def _price(listing: SiteListing) -> str:
+        return f"${listing.price:,} per week"
+
+    @staticmethod
+    def _beds_match(beds: int, query: str) -> bool:
+        if query.endswith("-any"):
+            return beds >= int(query[:-4])
+        return beds == int(query)
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Set on the subclass made by serve()
+    site: StandInSite | None
+    recorded = None
+    latency: float
+    error_rate: float
+    stats: Dict[str, int]
+    stats_lock: Lock
+
+    def do_GET(self) -> None:
+        parts = urlsplit(self.path)
+        if parts.path == "/__stats":
+            with self.stats_lock:
+                return self._send(200, json.dumps(self.stats), "application/json")
+
+        if self.latency:
+            time.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if random.random() < self.error_rate:
+            self._count("error")
+            return self._send(500, "Internal Server Error")
+
+        if (asset := self._asset(parts.path)) is not None:
+            self._count("asset")
+            return self._send(200, *asset)
+
+        kind = "search" if parts.path.startswith("/rent/") else "listing"
+        if self.recorded is not None:
+            page = self.recorded.get(RECORDED_ORIGIN + self.path)
+            status, body = (page.status, page.text) if page is not None else (404, "Not recorded")
+        elif kind == "search":
+            status, body = 200, self.site.search({key: values[0] for key, values in parse_qs(parts.query).items()})
+        else:
+            status, body = self.site.listing(parts.path.strip("/"))
+        self._count(kind if status == 200 else "missing")
+        self._send(status, body)
+
+    def _count(self, kind: str) -> None:
+        with self.stats_lock:
+            self.stats[kind] = self.stats.get(kind, 0) + 1
+
+    @staticmethod
+    def _asset(path: str) -> Tuple[bytes, str] | None:
+        """
+        :return: The body and content type of the asset at the path, or None if it isn't one.
+        """
+        extension = path[path.rfind(".") :]
+        if extension not in ASSET_TYPES or not (path.startswith("/static/") or extension == ".js"):
+            return None
+        content_type, size = ASSET_TYPES[extension]
+        text = {".css": STYLESHEET, ".js": SCRIPT}.get(extension, "")
+        # Padded out with a comment, or zeros for binary files, which the browser downloads but can't decode
+        if text:
+            padding = size - len(text) - 4
+            return f"{text}/*{' ' * padding}*/".encode(), content_type
+        return bytes(size), content_type
+
+    def _send(self, status: int, body: str | bytes, content_type: str = "text/html") -> None:
+        encoded = body.encode() if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def serve(
+    port: int = 0,
+    listings: int = 5000,
+    seed: int = 0,
+    generation: int = 0,
+    churn: float = 0.05,
+    latency: float = 0,
+    error_rate: float = 0,
+    recorded: str | None = None,
+    assets: bool = False,
+    bound=None,
+) -> None:
+    """
+    Serves the site until the process is stopped.
+
+    :param port: Port to listen on, or 0 for any free port.
+    :param latency: Average seconds added to every response.
+    :param error_rate: Fraction of requests answered with a 500.
+    :param recorded: Page cache directory to serve recorded pages from, instead of synthetic ones.
+    :param assets: Whether synthetic pages refer to images, fonts, styles and tracking scripts.
+    :param bound: Queue to put the port on once the server is listening.
+    """
+    if recorded is not None:
+        from rent_scraper.page_cache import PageCache
+
+        recorded = PageCache(recorded, replay=True)
+    handler = type(
+        "StandInHandler",
+        (Handler,),
+        {
+            "site": None if recorded else StandInSite(generate(listings, seed, generation, churn), assets),
+            "recorded": recorded,
+            "latency": latency,
+            "error_rate": error_rate,
+            "stats": {},
+            "stats_lock": Lock(),
+        },
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    if bound is not None:
+        bound.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start(**kwargs) -> Tuple[multiprocessing.Process, str]:
+    """
+    Starts the site in its own process, so that serving it doesn't compete with the scraper for the GIL.
+
+    :param kwargs: Passed on to serve().
+    :return: The process and the URL of the site.
+    """
+    context = multiprocessing.get_context("spawn")
+    bound = context.Queue()
+    process = context.Process(target=serve, kwargs={**kwargs, "bound": bound}, daemon=True)
+    process.start()
+    return process, f"http://127.0.0.1:{bound.get(timeout=60)}"
+
+
+def gazetteer_rows() -> List[Dict[str, str]]:
+    """
+    :return: The centroid of every suburb the synthetic listings are in, in the format of GAZETTEER_FILE.
+    """
+    return [
+        {"suburb": suburb, "state": state, "postcode": postcode, "latitude": str(lat), "longitude": str(lon)}
+        for suburb, state, postcode, lat, lon in SUBURBS
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--listings", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--generation", type=int, default=0)
+    parser.add_argument("--churn", type=float, default=0.05)
+    parser.add_argument("--latency", type=float, default=0, help="Average seconds added to each response")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests answered with a 500")
+    parser.add_argument("--recorded", help="Page cache directory to serve recorded pages from")
+    parser.add_argument("--assets", action="store_true", help="Add images, fonts, styles and scripts to pages")
+    args = parser.parse_args()
+    print(f"Serving on http://127.0.0.1:{args.port}")
+    serve(
+        args.port,
+        args.listings,
+        args.seed,
+        args.generation,
+        args.churn,
+        args.latency,
+        args.error_rate,
+        args.recorded,
+        args.assets,
+    )
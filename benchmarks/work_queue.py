@@ -0,0 +1,103 @@
+"""
+Runs several worker processes against the job queue of a real database, to check that jobs are shared out without any
+being done twice and to see how throughput scales with the number of processes.
+
+Each job just sleeps, standing in for a page load. One of the processes can be made to die while holding jobs, which
+the others should take over once the lease expires. Jobs are queued under their own kind and deleted afterwards, so
+this can be run against any database that has been migrated. Run with
+`uv run --env-file .env python benchmarks/work_queue.py`.
+"""
+
+import argparse
+import collections
+import multiprocessing
+import os
+import time
+
+KIND = "benchmark"
+
+
+def work(job_time: float, crash: bool, ready: multiprocessing.Queue, go, done: multiprocessing.Queue) -> None:
+    from rent_scraper import work_queue
+    from rent_scraper.model import init_db
+
+    init_db()
+    # Start together once every process has imported everything, so start up isn't timed
+    ready.put(None)
+    go.wait()
+    while True:
+        jobs = work_queue.claim(KIND)
+        if not jobs:
+            if not work_queue.unfinished(KIND):
+                return
+            # Wait for jobs held by other processes, in case their leases expire
+            time.sleep(0.1)
+            continue
+        if crash:
+            # Die holding the job, leaving it to be taken over once the lease expires
+            os._exit(1)
+        time.sleep(job_time)
+        for job in jobs:
+            work_queue.complete(job)
+            done.put(job.key)
+
+
+def run(processes: int, jobs: int, job_time: float, crash: bool) -> float:
+    from rent_scraper import work_queue
+    from rent_scraper.model import Job
+
+    Job.delete().where(Job.kind == KIND).execute()
+    work_queue.enqueue(KIND, range(jobs))
+
+    # Spawned rather than forked, so the processes don't share the parent's database connection
+    context = multiprocessing.get_context("spawn")
+    ready, go, done = context.Queue(), context.Event(), context.Queue()
+    workers = [
+        context.Process(target=work, args=(job_time, crash and i == 0, ready, go, done)) for i in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    for _ in workers:
+        ready.get()
+    start = time.perf_counter()
+    go.set()
+    completed = [done.get() for _ in range(jobs)]
+    elapsed = time.perf_counter() - start
+    for worker in workers:
+        worker.join()
+
+    duplicates = [key for key, count in collections.Counter(completed).items() if count > 1]
+    assert not duplicates, f"Jobs done more than once: {duplicates}"
+    Job.delete().where(Job.kind == KIND).execute()
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--job-time", type=float, default=0.05, help="Seconds each job takes")
+    parser.add_argument("--crash", action="store_true", help="Kill the first process while it holds a job")
+    args = parser.parse_args()
+
+    if args.crash:
+        # Keep the wait for the crashed process's lease short
+        os.environ.setdefault("LEASE_SECONDS", "2")
+        if min(args.processes) < 2:
+            parser.error("--crash needs at least 2 processes")
+
+    from rent_scraper.model import init_db
+
+    init_db()
+    baseline = None
+    for processes in args.processes:
+        elapsed = run(processes, args.jobs, args.job_time, args.crash)
+        baseline = baseline or elapsed * processes
+        print(
+            f"{processes} processes: {elapsed:.2f}s, {args.jobs / elapsed:.0f} jobs/s, "
+            f"{baseline / processes / elapsed:.0%} of linear scaling"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+import os
+import time
+from dataclasses import dataclass, field
+from threading import Condition
+from typing import Callable, Dict, List, Tuple
+
+from selenium import webdriver
+from selenium.common import WebDriverException
+from selenium.webdriver.support.wait import WebDriverWait
+
+from rent_scraper.logger import logger
+from rent_scraper.metrics import metrics
+from rent_scraper.page_cache import page_cache
+from rent_scraper.rate_limit import rate_limiter
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Requests that are never needed to read a page: images, media, fonts, and analytics and ad scripts. Patterns are
+# matched against the whole URL, with * as a wildcard.
+BLOCKED_URLS = (
+    *(f"*.{extension}*" for extension in ["jpg", "jpeg", "png", "gif", "webp", "avif", "svg", "ico"]),
+    *(f"*.{extension}*" for extension in ["mp4", "webm", "m3u8", "mp3"]),
+    *(f"*.{extension}*" for extension in ["woff", "woff2", "ttf", "otf", "eot"]),
+    "*googletagmanager.com*",
+    "*google-analytics.com*",
+    "*doubleclick.net*",
+    "*googlesyndication.com*",
+    "*facebook.net*",
+    "*hotjar.com*",
+    "*nr-data.net*",
+    "*newrelic.com*",
+    "*adnxs.com*",
+    "*bat.bing.com*",
+    "*analytics.tiktok.com*",
+    # The same scripts when they are served from the site itself
+    "*/gtm.js*",
+    "*/analytics.js*",
+    "*/fbevents.js*",
+)
+
+
+class ReplayMiss(WebDriverException):
+    """
+    Raised instead of loading a page that isn't in the page cache while it is being replayed. Nothing is wrong with the
+    browser, so it isn't restarted.
+    """
+
+
+def check_replay(url: str) -> None:
+    """
+    Raises ReplayMiss if the page cache is being replayed and doesn't have the page, so that it can be checked before a
+    browser is checked out to load it.
+    """
+    if page_cache is not None and page_cache.replay and page_cache.get(url) is None:
+        raise ReplayMiss(f"{url} is not in the page cache")
+
+
+@dataclass(frozen=True)
+class BrowserProfile:
+    """
+    What a browser loads for each page. A browser can switch profile between checkouts, so each task can use the one
+    that suits it.
+    """
+
+    name: str
+    blocked_urls: Tuple[str, ...] = ()
+    # Whether loading a page waits for everything on it, or only until the document has been parsed. Either way,
+    # anything read from the page should be waited for, as it may not be there yet.
+    wait_for_load: bool = True
+
+
+FULL = BrowserProfile("full")
+LEAN = BrowserProfile("lean", BLOCKED_URLS, wait_for_load=False)
+PROFILES: Dict[str, BrowserProfile] = {profile.name: profile for profile in [FULL, LEAN]}
+
+
+class Browser(webdriver.Chrome):
+    """
+    Chrome driver that keeps track of how many pages it has loaded, so the pool knows when to recycle it. Page loads go
+    through the rate limiter for their host, the same as plain HTTP requests. Pages aren't stored in the page cache
+    here, as they may not have finished rendering, so that is left to whatever reads them once it has waited for them.
+
+    Browsers must be started with the "eager" page load strategy, so that the profile decides whether to wait for the
+    rest of the page.
+    """
+
+    page_loads: int = 0
+    profile: BrowserProfile = FULL
+
+    def use(self, profile: BrowserProfile) -> None:
+        """
+        Switches the browser to a profile, for the pages it loads from now on.
+        """
+        if profile == self.profile:
+            return
+        # Blocking requests needs the network domain, which is left on once enabled
+        self.execute_cdp_cmd("Network.enable", {})
+        self.execute_cdp_cmd("Network.setBlockedURLs", {"urls": list(profile.blocked_urls)})
+        self.profile = profile
+
+    def get(self, url: str) -> None:
+        if page_cache is not None and page_cache.replay:
+            raise ReplayMiss(f"{url} is not in the page cache")
+        self.page_loads += 1
+        rate_limiter.wait(url)
+        start = time.monotonic()
+        try:
+            with metrics.timer("browser.load"):
+                super().get(url)
+                if self.profile.wait_for_load:
+                    WebDriverWait(self, self.timeouts.page_load).until(
+                        lambda browser: browser.execute_script("return document.readyState") == "complete"
+                    )
+        except WebDriverException:
+            rate_limiter.record(url, None, time.monotonic() - start, client="browser")
+            raise
+        # The browser doesn't expose the status, so any page that loads counts as a success
+        rate_limiter.record(url, 200, time.monotonic() - start, client="browser")
+
+
+@dataclass
+class PooledBrowser:
+    browser: Browser
+    created: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+    # Number of pages the browser had loaded when its memory was last checked
+    rss_checked_at: int = 0
+
+
+@dataclass
+class PoolStats:
+    size: int = 0
+    idle: int = 0
+    checkouts: int = 0
+    created: int = 0
+    restarts: int = 0
+    wait_time: float = 0.0
+    max_wait_time: float = 0.0
+
+    def __str__(self):
+        average_wait = self.wait_time / self.checkouts if self.checkouts else 0
+        return (
+            f"{self.size} browsers ({self.idle} idle), {self.checkouts} checkouts, {self.created} created, "
+            f"{self.restarts} restarts, {average_wait:.2f}s average wait, {self.max_wait_time:.2f}s max wait"
+        )
+
+
+class BrowserPool:
+    """
+    Pool of browsers that are only started when they are needed.
+
+    Browsers are checked for liveness before being handed out, and are restarted once they have loaded too many pages
+    or are using too much memory. Memory is only checked every so many page loads, as it means reading every process's
+    stats. Browsers that have sat idle for too long are shut down, down to the minimum size.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Browser],
+        max_size: int,
+        min_size: int = 0,
+        idle_timeout: float = 300,
+        max_page_loads: int = 500,
+        max_rss_mb: int = 1024,
+        rss_check_loads: int = 20,
+    ) -> None:
+        self.factory = factory
+        self.max_size = max_size
+        self.min_size = min_size
+        self.idle_timeout = idle_timeout
+        self.max_page_loads = max_page_loads
+        self.max_rss_mb = max_rss_mb
+        self.rss_check_loads = rss_check_loads
+
+        self._idle: List[PooledBrowser] = []
+        self._size = 0
+        self._condition = Condition()
+        self._stats = PoolStats()
+
+    def checkout(self) -> PooledBrowser:
+        """
+        Takes a browser from the pool, starting a new one if none are idle and the pool isn't full. Blocks until a
+        browser is available.
+
+        :return: A browser that has passed a liveness check.
+        """
+        start = time.monotonic()
+        pooled = None
+        evicted = []
+        with self._condition:
+            while True:
+                evicted.extend(self._evict_idle())
+                if self._idle:
+                    # Take the most recently used browser so the others can go idle and be evicted
+                    pooled = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # Reserve a spot for the new browser, which is started outside the lock
+                    self._size += 1
+                    break
+                self._condition.wait()
+
+        for idle in evicted:
+            logger.debug("Browser pool: Shutting down idle browser")
+            self._quit(idle)
+
+        if pooled is not None and not self._is_alive(pooled):
+            logger.warning("Browser pool: Browser failed liveness check, restarting")
+            self._quit(pooled)
+            with self._condition:
+                self._stats.restarts += 1
+            pooled = None
+        if pooled is None:
+            pooled = self._create()
+
+        waited = time.monotonic() - start
+        with self._condition:
+            self._stats.checkouts += 1
+            self._stats.wait_time += waited
+            self._stats.max_wait_time = max(self._stats.max_wait_time, waited)
+        return pooled
+
+    def checkin(self, pooled: PooledBrowser, healthy: bool = True) -> None:
+        """
+        Returns a browser to the pool, shutting it down instead if it is unhealthy or due to be recycled.
+
+        :param pooled: Browser that was checked out.
+        :param healthy: False if the browser is known to be broken.
+        """
+        reason = None
+        if not healthy or not self._is_alive(pooled):
+            reason = "failed liveness check"
+        elif pooled.browser.page_loads >= self.max_page_loads:
+            reason = f"loaded {pooled.browser.page_loads} pages"
+        elif pooled.browser.page_loads - pooled.rss_checked_at >= self.rss_check_loads:
+            pooled.rss_checked_at = pooled.browser.page_loads
+            if (rss := self._rss_mb(pooled)) > self.max_rss_mb:
+                reason = f"using {rss:.0f}MB"
+
+        if reason is not None:
+            logger.debug(f"Browser pool: Restarting browser that {reason}")
+            self._quit(pooled)
+
+        with self._condition:
+            if reason is None:
+                pooled.last_used = time.monotonic()
+                self._idle.append(pooled)
+            else:
+                self._size -= 1
+                self._stats.restarts += 1
+            # Otherwise idle browsers are only shut down when another is checked out, which may not happen for a while
+            evicted = self._evict_idle()
+            # Each browser shut down frees a spot for a new one
+            self._condition.notify(1 + len(evicted))
+
+        for idle in evicted:
+            logger.debug("Browser pool: Shutting down idle browser")
+            self._quit(idle)
+
+    def stats(self) -> PoolStats:
+        with self._condition:
+            self._stats.size = self._size
+            self._stats.idle = len(self._idle)
+            return PoolStats(**self._stats.__dict__)
+
+    def close(self) -> None:
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for pooled in idle:
+            self._quit(pooled)
+
+    def _create(self) -> PooledBrowser:
+        try:
+            pooled = PooledBrowser(self.factory())
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._stats.created += 1
+        return pooled
+
+    def _evict_idle(self) -> List[PooledBrowser]:
+        # Must be called while holding the lock. The evicted browsers are returned to be shut down outside of it.
+        now = time.monotonic()
+        evicted = []
+        while self._size > self.min_size and self._idle and now - self._idle[0].last_used > self.idle_timeout:
+            evicted.append(self._idle.pop(0))
+            self._size -= 1
+        return evicted
+
+    @staticmethod
+    def _is_alive(pooled: PooledBrowser) -> bool:
+        try:
+            pooled.browser.execute_script("return 1")
+            return True
+        except WebDriverException:
+            return False
+
+    @staticmethod
+    def _quit(pooled: PooledBrowser) -> None:
+        try:
+            pooled.browser.quit()
+        except Exception as e:
+            logger.debug(f"Browser pool: Error shutting down browser: {type(e).__name__}: {e}")
+
+    @staticmethod
+    def _rss_mb(pooled: PooledBrowser) -> float:
+        """
+        Memory used by the driver and all the Chrome processes underneath it. Only available on Linux, otherwise 0.
+        """
+        try:
+            root = pooled.browser.service.process.pid
+        except AttributeError:
+            return 0
+
+        children = {}
+        try:
+            for pid in filter(str.isdigit, os.listdir("/proc")):
+                try:
+                    with open(f"/proc/{pid}/stat") as f:
+                        # The command name is in brackets and can contain spaces, so split after it
+                        parent = int(f.read().rsplit(")", 1)[1].split()[1])
+                except (OSError, IndexError, ValueError):
+                    continue
+                children.setdefault(parent, []).append(int(pid))
+        except OSError:
+            return 0
+
+        total = 0
+        stack = [root]
+        while stack:
+            pid = stack.pop()
+            stack.extend(children.get(pid, []))
+            try:
+                with open(f"/proc/{pid}/statm") as f:
+                    total += int(f.read().split()[1]) * PAGE_SIZE
+            except (OSError, IndexError, ValueError):
+                continue
+        return total / 1024 / 1024
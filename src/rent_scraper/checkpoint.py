@@ -0,0 +1,117 @@
+import datetime
+import os
+from typing import Iterable, Set, Tuple
+
+from rent_scraper.logger import logger
+from rent_scraper.metrics import metrics
+from rent_scraper.model import db, PendingRefresh, Query, RangeProgress, RangeSeen, SearchRun
+from rent_scraper.refresh import RefreshScheduler
+
+# How old in hours an unfinished run can be for the next run to resume it. Older runs are abandoned.
+RESUME_MAX_AGE_HOURS = float(os.getenv("RESUME_MAX_AGE_HOURS", 48))
+
+
+class Checkpoint:
+    """
+    Progress of a search run, kept in the database so that a run that is interrupted, by a crash or a restart, is
+    resumed by the next run rather than started again.
+
+    Each range records the last page it saved and the listings on the pages so far, and is marked done once it has been
+    swept. The listings planned to be checked for changes are kept until their changes are saved. A page is only
+    recorded once everything on it has been saved, so a page that was half done when the run stopped is swept again,
+    which is harmless as saving the same page twice changes nothing.
+    """
+
+    def __init__(self, run: SearchRun, resumed: bool) -> None:
+        self.run = run
+        self.resumed = resumed
+
+    @classmethod
+    def start(cls) -> "Checkpoint":
+        """
+        :return: The checkpoint of the last run if it didn't finish, otherwise of a new run.
+        """
+        now = datetime.datetime.now()
+        cutoff = now - datetime.timedelta(hours=RESUME_MAX_AGE_HOURS)
+        resume = None
+        with db.atomic():
+            for run in SearchRun.select().where(SearchRun.finished_at.is_null()).order_by(SearchRun.started_at.desc()):
+                if resume is None and run.started_at >= cutoff:
+                    resume = run
+                else:
+                    logger.info(f"Checkpoint: Abandoning the run started at {run.started_at}")
+                    run.delete_instance()
+        if resume is not None:
+            logger.info(f"Checkpoint: Resuming the run started at {resume.started_at}")
+            return cls(resume, True)
+        return cls(SearchRun.create(started_at=now), False)
+
+    def plan_refresh(self, scheduler: RefreshScheduler) -> None:
+        """
+        Plans the listings to check for changes this run, or when resuming, picks up the ones that weren't saved.
+        """
+        if self.resumed:
+            pending = PendingRefresh.select(PendingRefresh.listing).where(PendingRefresh.run == self.run)
+            scheduler.restore({listing_id for listing_id, in pending.tuples()})
+            return
+        planned = scheduler.plan()
+        with db.atomic():
+            PendingRefresh.insert_many(
+                [{"run": self.run, "listing": listing_id} for listing_id in planned]
+            ).on_conflict_ignore().execute()
+
+    def refreshed(self, listing_ids: Iterable[str]) -> None:
+        if listing_ids := list(listing_ids):
+            PendingRefresh.delete().where(
+                PendingRefresh.run == self.run, PendingRefresh.listing << listing_ids
+            ).execute()
+
+    def done(self) -> Set[int]:
+        """
+        :return: The IDs of the ranges that are done.
+        """
+        done = RangeProgress.select(RangeProgress.query).where(RangeProgress.run == self.run, RangeProgress.done)
+        return {query_id for query_id, in done.tuples()}
+
+    def progress(self, query: Query) -> Tuple[int, Set[str]]:
+        """
+        :return: The last page of the range that was saved, or 0 if none were, and the listings on the pages up to it.
+        """
+        progress = RangeProgress.get_or_none(RangeProgress.run == self.run, RangeProgress.query == query)
+        if progress is None:
+            return 0, set()
+        seen = RangeSeen.select(RangeSeen.listing).where(RangeSeen.run == self.run, RangeSeen.query == query)
+        return progress.page, {listing_id for listing_id, in seen.tuples()}
+
+    def seen(self) -> Set[str]:
+        """
+        :return: The listings on every page saved this run, across all ranges.
+        """
+        seen = RangeSeen.select(RangeSeen.listing.distinct()).where(RangeSeen.run == self.run)
+        return {listing_id for listing_id, in seen.tuples()}
+
+    def save_page(self, query: Query, page: int, listing_ids: Iterable[str]) -> None:
+        with metrics.timer("db.checkpoint"), db.atomic():
+            RangeProgress.insert(run=self.run, query=query, page=page).on_conflict(
+                conflict_target=[RangeProgress.run, RangeProgress.query], update={RangeProgress.page: page}
+            ).execute()
+            if rows := [{"run": self.run, "query": query, "listing": listing_id} for listing_id in listing_ids]:
+                RangeSeen.insert_many(rows).on_conflict_ignore().execute()
+
+    def range_done(self, query: Query) -> None:
+        # The listings seen are kept until the run finishes, as listings are only closed once they are missing from
+        # every range
+        RangeProgress.insert(run=self.run, query=query, done=True).on_conflict(
+            conflict_target=[RangeProgress.run, RangeProgress.query], update={RangeProgress.done: True}
+        ).execute()
+
+    def finish(self) -> None:
+        """
+        Marks the run as finished, so the next run starts from the beginning. Its progress is no longer needed.
+        """
+        with db.atomic():
+            RangeProgress.delete().where(RangeProgress.run == self.run).execute()
+            RangeSeen.delete().where(RangeSeen.run == self.run).execute()
+            PendingRefresh.delete().where(PendingRefresh.run == self.run).execute()
+            self.run.finished_at = datetime.datetime.now()
+            self.run.save()
@@ -0,0 +1,95 @@
+from typing import Dict, Tuple
+
+from peewee import ValuesList
+
+from rent_scraper.geocoding import address_key
+from rent_scraper.logger import logger, configure_logging
+from rent_scraper.metrics import metrics
+from rent_scraper.model import db, init_db, Address, AddressHistory, Listing
+from rent_scraper.persistence import ADDRESS_LOCK, address_ids
+
+
+def dedupe_addresses() -> Tuple[int, int]:
+    """
+    Gives every address its key, merging addresses that have the same key into the oldest of them. The listings and
+    history of the duplicates are moved to the address they're merged into, along with their coordinates if it has
+    none. Safe to run again, e.g. after a change to address_key.
+
+    Should be run while nothing is scraping, as scrapers keep the IDs of addresses they've seen in memory.
+
+    :return: The number of addresses given a new key, and the number merged into another.
+    """
+    keepers: Dict[str, int] = {}
+    # Duplicate ID to the ID of the address it's merged into
+    merges: Dict[int, int] = {}
+    rekeyed: Dict[int, str] = {}
+    coordinates: Dict[int, Tuple[float, float]] = {}
+    missing_coordinates = set()
+
+    with metrics.timer("db.dedupe_addresses"), db.atomic():
+        # Stops addresses being created while they're being merged
+        db.execute_sql("SELECT pg_advisory_xact_lock(%s)", (ADDRESS_LOCK,))
+        rows = Address.select(Address.id, Address.address, Address.key, Address.latitude, Address.longitude)
+        for address_id, address, current, latitude, longitude in rows.order_by(Address.id).tuples().iterator():
+            key = address_key(address)
+            keeper = keepers.setdefault(key, address_id)
+            has_coordinates = latitude is not None and longitude is not None
+            if keeper == address_id:
+                if current != key:
+                    rekeyed[address_id] = key
+                if not has_coordinates:
+                    missing_coordinates.add(address_id)
+                continue
+            merges[address_id] = keeper
+            if has_coordinates and keeper in missing_coordinates:
+                coordinates[keeper] = (latitude, longitude)
+                missing_coordinates.discard(keeper)
+
+        if merges:
+            merged = ValuesList(list(merges.items()), columns=("duplicate", "keeper"), alias="m")
+            Listing.update(address=merged.c.keeper).from_(merged).where(Listing.address == merged.c.duplicate).execute()
+            # History at the same time as the address's own can't be kept, as it would clash
+            history = AddressHistory.select(
+                merged.c.keeper,
+                AddressHistory.beds,
+                AddressHistory.baths,
+                AddressHistory.cars,
+                AddressHistory.valid_from,
+            ).join(merged, on=(AddressHistory.address == merged.c.duplicate))
+            AddressHistory.insert_from(
+                history,
+                [
+                    AddressHistory.address,
+                    AddressHistory.beds,
+                    AddressHistory.baths,
+                    AddressHistory.cars,
+                    AddressHistory.valid_from,
+                ],
+            ).on_conflict_ignore().execute()
+            if coordinates:
+                found = ValuesList(
+                    [(address_id, *point) for address_id, point in coordinates.items()],
+                    columns=("id", "latitude", "longitude"),
+                    alias="c",
+                )
+                Address.update(latitude=found.c.latitude, longitude=found.c.longitude).from_(found).where(
+                    Address.id == found.c.id
+                ).execute()
+            # Their listings have been moved, so the delete trigger only removes their own history
+            Address.delete().where(Address.id << list(merges)).execute()
+
+        if rekeyed:
+            # Cleared first, as a key can move from one address to another
+            Address.update(key=None).where(Address.id << list(rekeyed)).execute()
+            keys = ValuesList(list(rekeyed.items()), columns=("id", "key"), alias="k")
+            Address.update(key=keys.c.key).from_(keys).where(Address.id == keys.c.id).execute()
+
+    address_ids.clear()
+    logger.info(f"Addresses: Gave {len(rekeyed)} addresses a new key and merged {len(merges)} duplicates")
+    return len(rekeyed), len(merges)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    init_db()
+    dedupe_addresses()
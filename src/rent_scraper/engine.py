@@ -0,0 +1,163 @@
+import asyncio
+import contextvars
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Thread
+from typing import Any, Awaitable, Callable, Iterable, List
+
+import aiohttp
+from tqdm import tqdm
+
+from rent_scraper.logger import logger
+from rent_scraper.metrics import metrics
+from rent_scraper.page_cache import page_cache
+from rent_scraper.rate_limit import HTTP_RETRIES, RETRY_STATUSES, backoff, rate_limiter
+from rent_scraper.util import HTTP_TIMEOUT, HEADERS, Page
+
+# Total number of requests that can be in flight at once
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", 200))
+# Number of connections that can be open to a single host at once
+HOST_CONNECTIONS = int(os.getenv("HOST_CONNECTIONS", 16))
+# Parsing is CPU bound, so there's no point having more workers than cores
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", min(4, os.cpu_count() or 1)))
+# Processes to parse large pages in, so that they aren't held up by the GIL. Off by default, as pages have to be copied
+# to and from the processes, which only pays off for big pages.
+PARSE_PROCESSES = int(os.getenv("PARSE_PROCESSES", 0))
+# Pages smaller than this many kilobytes are still parsed on the thread pool
+PARSE_PROCESS_MIN_KB = int(os.getenv("PARSE_PROCESS_MIN_KB", 256))
+
+
+class AsyncEngine:
+    """
+    Runs HTTP fetches concurrently on a single event loop, which lives on its own thread so that the synchronous parts of
+    the scraper can hand it work with run().
+
+    Connections are kept alive and reused, with the number of connections to any one host capped. Parsing is pushed
+    onto a small thread pool so it doesn't hold up the event loop, or a pool of processes for large pages.
+    """
+
+    loop: asyncio.AbstractEventLoop
+    session: aiohttp.ClientSession
+    parse_executor: ThreadPoolExecutor
+    parse_processes: ProcessPoolExecutor | None
+
+    def __init__(
+        self,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        host_connections: int = HOST_CONNECTIONS,
+        parse_workers=PARSE_WORKERS,
+        parse_processes=PARSE_PROCESSES,
+    ) -> None:
+        self.max_in_flight = max_in_flight
+        self.host_connections = host_connections
+        self.parse_executor = ThreadPoolExecutor(max_workers=parse_workers, thread_name_prefix="parse")
+        # Spawned rather than forked, as forking with the engine's threads running can deadlock
+        self.parse_processes = (
+            ProcessPoolExecutor(max_workers=parse_processes, mp_context=multiprocessing.get_context("spawn"))
+            if parse_processes > 0
+            else None
+        )
+
+        self.loop = asyncio.new_event_loop()
+        Thread(target=self.loop.run_forever, name="engine", daemon=True).start()
+        self.session = self.run(self._new_session())
+
+    async def _new_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, limit_per_host=self.host_connections)
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+            headers=HEADERS,
+        )
+
+    def run(self, coroutine: Awaitable) -> Any:
+        """
+        Runs a coroutine on the engine's event loop and waits for the result.
+
+        :param coroutine: Coroutine to run.
+        :return: The result of the coroutine.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def fetch(self, url: str) -> Page | None:
+        """
+        Fetches a page over HTTP, retrying failures with backoff. Pages are served from the page cache when it has a
+        fresh enough copy.
+
+        :param url: URL of the page to fetch.
+        :return: The page, or None if the request could not be completed.
+        """
+        if page_cache is not None and (
+            (page := await asyncio.to_thread(page_cache.get, url)) is not None or page_cache.replay
+        ):
+            metrics.increment("page_cache.hits" if page is not None else "page_cache.misses")
+            return page
+        for attempt in range(HTTP_RETRIES + 1):
+            await rate_limiter.wait_async(url)
+            start = time.monotonic()
+            try:
+                with metrics.timer("http.fetch"):
+                    async with self.session.get(url) as response:
+                        page = Page(response.status, str(response.url), await response.text())
+                        retry_after = response.headers.get("Retry-After")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                rate_limiter.record(url, None, time.monotonic() - start)
+                logger.debug(f"{url} - HTTP fetch failed: {type(e).__name__}: {e}")
+            else:
+                rate_limiter.record(url, page.status, time.monotonic() - start, retry_after)
+                if page.status not in RETRY_STATUSES or attempt == HTTP_RETRIES:
+                    if page_cache is not None:
+                        await asyncio.to_thread(page_cache.put, url, page)
+                    return page
+                logger.debug(f"{url} - HTTP fetch got {page.status}, retrying")
+            if attempt < HTTP_RETRIES:
+                await asyncio.sleep(backoff(attempt))
+        return None
+
+    async def parse(self, function: Callable, *args) -> Any:
+        """
+        Runs a parsing function on the parse executor, or in the process pool if any of the pages it's given are large.
+
+        :param function: Function to run. Must be picklable if it could be run in the process pool.
+        :param args: Arguments to the function.
+        :return: The result of the function.
+        """
+        if self.parse_processes is not None and self._page_size(args) >= PARSE_PROCESS_MIN_KB * 1024:
+            # Anything the function records is lost with the process, so time it from here instead
+            with metrics.timer("parse.offloaded"):
+                return await self.loop.run_in_executor(self.parse_processes, function, *args)
+        # Run in the caller's context, so the parse is counted against the range being swept
+        context = contextvars.copy_context()
+        return await self.loop.run_in_executor(self.parse_executor, context.run, function, *args)
+
+    @staticmethod
+    def _page_size(args: tuple) -> int:
+        return sum(len(arg.text) for arg in args if isinstance(arg, Page))
+
+    async def map(self, function: Callable[[Any], Awaitable], items: Iterable, desc: str = "") -> List:
+        """
+        Runs an async function over every item at once, leaving the connection limits to decide how many actually run
+        concurrently.
+
+        :param function: Async function to call with each item.
+        :param items: Items to pass to the function.
+        :param desc: Description for the progress bar.
+        :return: The results, in no particular order.
+        """
+        tasks = [asyncio.ensure_future(function(item)) for item in items]
+        results = []
+        for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc=desc, leave=False):
+            try:
+                results.append(await task)
+            except Exception as e:
+                logger.error(f"{desc}: {type(e).__name__}: {e}")
+        return results
+
+    def close(self) -> None:
+        self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.parse_executor.shutdown()
+        if self.parse_processes is not None:
+            self.parse_processes.shutdown()
@@ -1,35 +1,23 @@
+import json
 import os
-import re
-from datetime import datetime, timedelta
-from time import sleep
-
-import requests
 
+from rent_scraper.geocoding import without_unit
 from rent_scraper.logger import logger
-from rent_scraper.model import GeocodeFails
+from rent_scraper.rate_limit import RETRY_STATUSES
+from rent_scraper.util import fetch
 
 
 class StatusException(Exception):
     pass
 
 
-def clean_address(address: str) -> str:
-    if "/" in address:
-        address = address[address.index("/") + 1 :]
-    elif re.match(r"^\d+ \d", address):
-        address = address[address.index(" ") + 1 :]
-    return address
-
-
 class GeocodeClient:
     """
-    Client to forward geocode addresses to coordinates using https://geocode.maps.co/.
+    Client to forward geocode addresses to coordinates using https://geocode.maps.co/. Failed lookups aren't remembered
+    here, so this is meant to be used as the remote lookup of a geocoding.Geocoder, which caches them.
     """
 
     api_key: str
-    rate_limit_start: datetime
-    last_request: datetime
-    lookup_fails: set
 
     def __init__(self) -> None:
         key = os.getenv("GEOCODE_API_KEY")
@@ -37,9 +25,6 @@ class GeocodeClient:
             raise RuntimeError("GEOCODE_API_KEY not set")
 
         self.api_key = key
-        self.rate_limit_start = datetime.min
-        self.last_request = datetime.min
-        self.lookup_fails = {x.address for x in GeocodeFails.select()}
 
     def get_coordinate(self, address: str) -> tuple[None, None] | tuple[float, float]:
         """
@@ -47,43 +32,19 @@ class GeocodeClient:
 
         :param address: A standard street address.
         :return: Returns a tuple (lat, lon) of the coordinate or (None, None) if no coordinates found.
+        :raises StatusException: If the service couldn't be reached, so the lookup should be tried again later.
         """
-        address = clean_address(address)
-
-        if address in self.lookup_fails:
-            logger.debug(f"{address} - Geocode: Lookup previously failed")
-            return None, None
-
-        if self.rate_limit_start > datetime.now() - timedelta(hours=12):
-            # If it has been less than 12 hours since we hit a rate limit, make sure we respect limits
-            try:
-                microseconds_since = (self.last_request - datetime.now()).microseconds
-                # Ensure we don't try to sleep for less than 0.01
-                sleep_time = max(1.5 - (microseconds_since / 1e6), 0.01)
-                sleep(sleep_time)
-            except OverflowError as e:
-                logger.error(f"Geocode: Overflow error: {e} - {self.last_request}")
-                sleep(1.5)
-
-        response = None
-        while response is None:
-            self.last_request = datetime.now()
-            response = requests.get(f"https://geocode.maps.co/search?q={address}&api_key={self.api_key}")
-
-            if response.status_code == 429:
-                logger.warning("Geocode: Rate limit reached")
-                self.rate_limit_start = datetime.now()
-                sleep(1.5)
-                response = None
-            elif response.status_code in [503, 502]:
-                logger.warning("Geocode: Service unavailable, retrying")
-                sleep(5)
-                response = None
-            elif response.status_code != 200:
-                logger.error(f"{response.status_code}: {response.text}")
-                response = []
-            else:
-                response = response.json()
+        address = without_unit(address)
+
+        # Retries, and the rate limit for the host, are handled by fetch
+        page = fetch(f"https://geocode.maps.co/search?q={address}&api_key={self.api_key}")
+        if page is None or page.status in RETRY_STATUSES:
+            raise StatusException(f"Geocode: Lookup failed for {address}")
+        if page.status != 200:
+            logger.error(f"{page.status}: {page.text}")
+            response = []
+        else:
+            response = json.loads(page.text)
 
         if len(response) == 0:
             logger.warning(f"{address} - Geocode: No results found")
@@ -96,10 +57,6 @@ class GeocodeClient:
             if lat is None or long is None:
                 logger.warning(f"{address} - Geocode: Could not resolve duplicate coordinates")
 
-        if lat is None or long is None:
-            GeocodeFails.create(address=address)
-            self.lookup_fails.add(address)
-
         return lat, long
 
     def _resolve_duplicates(self, locations, address: str) -> tuple[float, float] | tuple[None, None]:
@@ -0,0 +1,319 @@
+import csv
+import datetime
+import os
+import re
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict, Tuple
+
+from rent_scraper.logger import logger
+from rent_scraper.metrics import metrics
+from rent_scraper.model import connection, GeocodeCache
+
+# CSV of known coordinates, checked before any remote lookup. See the README for the format.
+GAZETTEER_FILE = os.getenv("GAZETTEER_FILE")
+# Whether an address can be given the coordinates of its suburb or postcode when its street isn't in the gazetteer
+GEOCODE_SUBURB_CENTROIDS = os.getenv("GEOCODE_SUBURB_CENTROIDS", "1") != "0"
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", 10000))
+GEOCODE_TTL_DAYS = int(os.getenv("GEOCODE_TTL_DAYS", 180))
+# Failed lookups are retried sooner, as the failure may have been on the remote end
+GEOCODE_NEGATIVE_TTL_DAYS = int(os.getenv("GEOCODE_NEGATIVE_TTL_DAYS", 14))
+
+STATES = ["NSW", "VIC", "QLD", "SA", "WA", "TAS", "NT", "ACT"]
+LOCALITY_PATTERN = re.compile(rf"^(?P<suburb>.+?)\s+(?P<state>{'|'.join(STATES)})\s+(?P<postcode>\d{{4}})$")
+STREET_TYPES = {
+    "street": "st",
+    "road": "rd",
+    "avenue": "ave",
+    "drive": "dr",
+    "place": "pl",
+    "court": "ct",
+    "crescent": "cres",
+    "parade": "pde",
+    "highway": "hwy",
+    "lane": "ln",
+    "terrace": "tce",
+    "close": "cl",
+    "boulevard": "bvd",
+    "circuit": "cct",
+    "grove": "gr",
+    "square": "sq",
+}
+
+# Words that can come before the number of a home, which are dropped, e.g. "Unit 3/12 Smith Street"
+UNIT_WORDS = re.compile(r"^(unit|apartment|apt|flat|suite|villa|townhouse)\s+(?=\d)", re.IGNORECASE)
+# Words that can come before the number of something that isn't a home, which are kept so that e.g. "Shop 2/15 Main
+# Street" isn't the same address as "2/15 Main Street"
+KEPT_UNIT_WORDS = re.compile(r"^(shop|level)\s+(?=\d)", re.IGNORECASE)
+# Units written with a slash, e.g. "3/12 Smith Street" or "G02/12 Smith Street"
+SLASHED_UNIT = re.compile(r"^([^\s/]+)/")
+# Units written without a slash, e.g. "3 12 Smith Street" or "3, 12 Smith Street". The unit has to be followed by a
+# whole street number and then the street name, as otherwise it is the street number of a numbered street, e.g.
+# "12 3rd Avenue"
+SPACED_UNIT = re.compile(r"^(\d+[a-z]?),?\s+(?=\d+[a-z]?(-\d+[a-z]?)?\s+[a-z])", re.IGNORECASE)
+# Units written without a slash after a unit word, where any number that follows is the street number, e.g.
+# "Unit 3 5 10th Street"
+WORD_UNIT = re.compile(r"^(\d+[a-z]?),?\s+(?=\d)", re.IGNORECASE)
+
+Coordinates = Tuple[float | None, float | None]
+
+
+def split_unit(street: str) -> Tuple[str, str]:
+    """
+    Separates the unit from the street part of an address.
+
+    e.g. "Unit 3, 15 Smith Street" gives ("3", "15 Smith Street") and "Shop 2 15 Main Street" gives
+    ("Shop 2", "15 Main Street")
+
+    :param street: The part of an address before the suburb.
+    :return: The unit, or "" if there isn't one, and the rest of the street.
+    """
+    street = re.sub(r"\s*/\s*", "/", street.strip())
+    prefix = ""
+    if (word := UNIT_WORDS.match(street)) is not None:
+        street = street[word.end() :]
+    elif (word := KEPT_UNIT_WORDS.match(street)) is not None:
+        prefix, street = street[: word.end()], street[word.end() :]
+    for pattern in [SLASHED_UNIT, WORD_UNIT if word else SPACED_UNIT]:
+        if (match := pattern.match(street)) is not None:
+            return prefix + match[1], street[match.end() :]
+    return "", prefix + street
+
+
+def without_unit(address: str) -> str:
+    """
+    :param address: A standard street address.
+    :return: The address as written, without its unit, e.g. "Unit 3, 15 Smith Street, Carlton VIC 3053" becomes
+    "15 Smith Street, Carlton VIC 3053".
+    """
+    street, separator, locality = address.strip().rpartition(",")
+    return f"{split_unit(street)[1]}{separator}{locality}" if street else address.strip()
+
+
+def normalise_address(address: str) -> str:
+    """
+    Same as address_key, but without the unit, as units share the coordinates of their building. Used as the key for
+    geocoding.
+
+    e.g. "2/15 Smith Street, Carlton VIC 3053" and "3 15 Smith St, Carlton VIC 3053" both become
+    "15 smith st, carlton vic 3053"
+
+    :param address: A standard street address.
+    :return: The normalised address.
+    """
+    street, _, locality = address.lower().rpartition(",")
+    return _key(split_unit(street)[1], locality)
+
+
+def address_key(address: str) -> str:
+    """
+    Reduces an address to a form that is the same however it was written, so that the same address is only stored
+    once. Units are kept, but written the same way.
+
+    e.g. "Unit 3/15 Smith Street, Carlton VIC 3053" and "3 15 Smith St, Carlton VIC 3053" both become
+    "3/15 smith st, carlton vic 3053", while "Shop 3 15 Smith Street, Carlton VIC 3053" becomes
+    "shop 3/15 smith st, carlton vic 3053"
+
+    :param address: A standard street address.
+    :return: The key for the address.
+    """
+    street, _, locality = address.lower().rpartition(",")
+    unit, street = split_unit(street)
+    return _key(f"{unit}/{street}" if unit else street, locality)
+
+
+def _key(street: str, locality: str) -> str:
+    street = " ".join(STREET_TYPES.get(word, word) for word in re.sub(r"[^\w\s/-]", " ", street).split())
+    locality = " ".join(re.sub(r"[^\w\s-]", " ", locality).split())
+    return f"{street}, {locality}" if street else locality
+
+
+def split_locality(address: str) -> Tuple[str, str, str] | None:
+    """
+    :param address: A standard or normalised street address.
+    :return: The suburb, state and postcode of the address, in lower case, or None if it doesn't end with them.
+    """
+    match = LOCALITY_PATTERN.match(address.rpartition(",")[2].strip().upper())
+    if match is None:
+        return None
+    return match["suburb"].lower(), match["state"].lower(), match["postcode"]
+
+
+def in_australia(latitude: float, longitude: float) -> bool:
+    return 110 <= longitude <= 155 and -45 <= latitude <= -10
+
+
+class Gazetteer:
+    """
+    Coordinates from a local CSV file, loaded into memory the first time it is used.
+
+    Rows with an "address" column are indexed by the normalised address, and rows without one are taken as the
+    centroid of their suburb ("suburb" or "locality"), state and postcode.
+    """
+
+    def __init__(self, path: str | None = GAZETTEER_FILE) -> None:
+        self.path = path
+        self._addresses: Dict[str, Tuple[float, float]] = {}
+        self._localities: Dict[Tuple[str, ...], Tuple[float, float]] = {}
+        self._loaded = False
+        self._lock = Lock()
+
+    def lookup(self, address: str) -> Tuple[float, float, str] | None:
+        """
+        :param address: A normalised address.
+        :return: The latitude, longitude and which index they came from, or None if the address isn't covered.
+        """
+        self._load()
+        if (coordinates := self._addresses.get(address)) is not None:
+            return *coordinates, "gazetteer"
+        if not GEOCODE_SUBURB_CENTROIDS or (locality := split_locality(address)) is None:
+            return None
+        suburb, state, postcode = locality
+        # From the most to least precise
+        for key in [(suburb, state, postcode), (suburb, state), (postcode,)]:
+            if (coordinates := self._localities.get(key)) is not None:
+                return *coordinates, "suburb"
+        return None
+
+    def _load(self) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if self.path is None:
+                return
+            try:
+                with open(self.path, newline="") as f:
+                    for row in csv.DictReader(f):
+                        self._add(row)
+            except OSError as e:
+                logger.error(f"Gazetteer: Could not load {self.path}: {e}")
+                return
+        logger.info(f"Gazetteer: Loaded {len(self._addresses)} addresses and {len(self._localities)} localities")
+
+    def _add(self, row: Dict[str, str]) -> None:
+        row = {key.strip().lower(): value.strip() for key, value in row.items() if key is not None and value}
+        latitude = row.get("latitude", row.get("lat"))
+        longitude = row.get("longitude", row.get("lon", row.get("long")))
+        try:
+            coordinates = float(latitude), float(longitude)
+        except (TypeError, ValueError):
+            return
+        if not in_australia(*coordinates):
+            return
+
+        if "address" in row:
+            self._addresses[normalise_address(row["address"])] = coordinates
+            return
+        suburb = (row.get("suburb") or row.get("locality") or "").lower()
+        state = row.get("state", "").lower()
+        postcode = row["postcode"].zfill(4) if "postcode" in row else ""
+        if suburb and state and postcode:
+            self._localities.setdefault((suburb, state, postcode), coordinates)
+        if suburb and state:
+            self._localities.setdefault((suburb, state), coordinates)
+        if postcode:
+            self._localities.setdefault((postcode,), coordinates)
+
+
+class Geocoder:
+    """
+    Turns addresses into coordinates, checking an in-memory LRU cache, then the database cache, then the gazetteer,
+    before finally falling back to a remote lookup. Failed lookups are cached too, along with the reason, so bad
+    addresses aren't looked up every run. A database connection is only held while the database cache is used, not
+    during the remote lookup.
+    """
+
+    def __init__(self, gazetteer: Gazetteer | None = None, cache_size: int = GEOCODE_CACHE_SIZE) -> None:
+        self.gazetteer = gazetteer or Gazetteer()
+        self.cache_size = cache_size
+        self._cache: OrderedDict[str, GeocodeCache] = OrderedDict()
+        self._lock = Lock()
+
+    def lookup(self, address: str, remote: Callable[[str], Coordinates], source: str = "remote") -> Coordinates:
+        """
+        :param address: A standard street address.
+        :param remote: Called with the address, without its unit, when it can't be found locally. Exceptions are passed
+        on and not cached, as they're taken to mean the lookup should be tried again.
+        :param source: Name of the remote lookup, recorded in the cache.
+        :return: The latitude and longitude, or (None, None) if the address couldn't be found.
+        """
+        with metrics.timer("geocode"):
+            return self._lookup(address, remote, source)
+
+    def _lookup(self, address: str, remote: Callable[[str], Coordinates], source: str) -> Coordinates:
+        key = normalise_address(address)
+        now = datetime.datetime.now()
+
+        found_in = "memory"
+        entry = self._get_memory(key, now)
+        if entry is None:
+            found_in = "cache"
+            with connection():
+                entry = GeocodeCache.get_or_none(GeocodeCache.address == key, GeocodeCache.expires_at > now)
+        if entry is None and (found := self.gazetteer.lookup(key)) is not None:
+            latitude, longitude, found_in = found
+            entry = self._save(key, latitude, longitude, found_in, None, now)
+        if entry is None:
+            found_in = "remote"
+            with metrics.timer("geocode.remote"):
+                latitude, longitude = remote(without_unit(address))
+            reason = None
+            if latitude is None or longitude is None:
+                latitude, longitude, reason = None, None, "Not found"
+            elif not in_australia(latitude, longitude):
+                latitude, longitude, reason = None, None, "Outside Australia"
+            entry = self._save(key, latitude, longitude, source, reason, now)
+        elif entry.reason is not None:
+            logger.debug(f"{address} - Geocode: Lookup previously failed: {entry.reason}")
+
+        metrics.increment(f"geocode.{found_in}")
+        self._put_memory(key, entry)
+        return entry.latitude, entry.longitude
+
+    def _get_memory(self, key: str, now: datetime.datetime) -> GeocodeCache | None:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= now:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return entry
+
+    def _put_memory(self, key: str, entry: GeocodeCache) -> None:
+        with self._lock:
+            self._cache[key] = entry
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    @staticmethod
+    @connection()
+    def _save(
+        key: str, latitude: float | None, longitude: float | None, source: str, reason: str | None, now
+    ) -> GeocodeCache:
+        ttl = GEOCODE_NEGATIVE_TTL_DAYS if reason else GEOCODE_TTL_DAYS
+        entry = GeocodeCache(
+            address=key,
+            latitude=latitude,
+            longitude=longitude,
+            source=source,
+            reason=reason,
+            expires_at=now + datetime.timedelta(days=ttl),
+        )
+        GeocodeCache.insert(**entry.__data__).on_conflict(
+            conflict_target=[GeocodeCache.address],
+            preserve=[
+                GeocodeCache.latitude,
+                GeocodeCache.longitude,
+                GeocodeCache.source,
+                GeocodeCache.reason,
+                GeocodeCache.expires_at,
+            ],
+        ).execute()
+        return entry
+
+
+geocoder = Geocoder()
@@ -0,0 +1,126 @@
+import datetime
+from threading import Lock
+from typing import Dict, NamedTuple
+
+from rent_scraper.logger import logger
+from rent_scraper.model import db, Query, SimpleAddress, SimpleListing
+
+# Seconds before the last load that changes are read from, to cover transactions that were still open then
+CHANGES_OVERLAP = 300
+
+# Listings whose price, availability or address's beds have changed since a time. Split in two, so each half can use
+# the index on when its state table was updated.
+CHANGED_LISTINGS = """
+SELECT l.id, ls.price, ads.beds, ls.available
+FROM listing l
+         JOIN listingstate ls ON ls.listing_id = l.id
+         JOIN addressstate ads ON ads.address_id = l.address_id
+WHERE ls.updated_at > %s
+UNION
+SELECT l.id, ls.price, ads.beds, ls.available
+FROM addressstate ads
+         JOIN listing l ON l.address_id = ads.address_id
+         JOIN listingstate ls ON ls.listing_id = l.id
+WHERE ads.updated_at > %s
+"""
+
+
+class KnownListing(NamedTuple):
+    price: int
+    beds: int
+    available: bool
+
+
+class KnownListings:
+    """
+    In-memory index of every listing in the database, loaded once per run, so that listings which haven't changed can
+    be recognised without a query each.
+
+    Anything that changes a listing is expected to update the index as well. Changes made by other processes aren't
+    seen until load_changes is called.
+    """
+
+    def __init__(self) -> None:
+        self._listings: Dict[str, KnownListing] = {}
+        # Database time the last load or update started, or None if the index hasn't been loaded
+        self._loaded_at: datetime.datetime | None = None
+        self._lock = Lock()
+
+    def load(self) -> None:
+        """
+        Loads every listing from the database. Does nothing if the index has already been loaded.
+        """
+        with self._lock:
+            if self._loaded_at is not None:
+                return
+            self._loaded_at = self._now()
+            query = (
+                SimpleListing.select(SimpleListing.id, SimpleListing.price, SimpleAddress.beds, SimpleListing.available)
+                .join(SimpleAddress)
+                .tuples()
+            )
+            self._listings = {listing_id: KnownListing(*state) for listing_id, *state in query.iterator()}
+        logger.info(f"Loaded {len(self._listings)} known listings")
+
+    def load_changes(self) -> None:
+        """
+        Reads the listings that have changed since the index was last loaded, including by other processes. Loads
+        every listing if the index hasn't been loaded yet.
+        """
+        if self._loaded_at is None:
+            self.load()
+            return
+        with self._lock:
+            # A change made in a transaction that started before the last load may only have been committed since, so
+            # the changes are read from a little before it
+            since = self._loaded_at - datetime.timedelta(seconds=CHANGES_OVERLAP)
+            self._loaded_at = self._now()
+            cursor = db.execute_sql(CHANGED_LISTINGS, (since, since))
+            changed = {listing_id: KnownListing(*state) for listing_id, *state in cursor.fetchall()}
+            self._listings.update(changed)
+        logger.debug(f"Loaded {len(changed)} changed known listings")
+
+    @staticmethod
+    def _now() -> datetime.datetime:
+        # From the database's clock, as that is what the state tables are stamped with
+        return db.execute_sql("SELECT clock_timestamp()::timestamp").fetchone()[0]
+
+    def get(self, listing_id: str) -> KnownListing | None:
+        return self._listings.get(listing_id)
+
+    def is_unchanged(self, listing_id: str, price: int) -> bool:
+        """
+        :return: True if the listing is known, available and still has the same price.
+        """
+        known = self._listings.get(listing_id)
+        return known is not None and known.available and known.price == price
+
+    def update(self, listing_id: str, price: int, beds: int, available: bool) -> None:
+        with self._lock:
+            self._listings[listing_id] = KnownListing(price, beds, available)
+
+    def set_unavailable(self, listing_id: str) -> None:
+        with self._lock:
+            if (known := self._listings.get(listing_id)) is not None:
+                self._listings[listing_id] = known._replace(available=False)
+
+    def in_range(self, query: Query) -> Dict[str, int]:
+        """
+        Same as the query from search.get_query_function, but answered from the index.
+
+        :param query: Range to find listings in.
+        :return: The price of each available listing in the range, keyed by ID.
+        """
+        if query.beds == "5-any":
+            bed_match = lambda beds: beds >= 5
+        else:
+            bed_match = lambda beds: beds == int(query.beds)
+        with self._lock:
+            return {
+                listing_id: known.price
+                for listing_id, known in self._listings.items()
+                if known.available and query.lower_price < known.price < query.upper_price and bed_match(known.beds)
+            }
+
+
+known_listings = KnownListings()
@@ -0,0 +1,221 @@
+import bisect
+import datetime
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterator, List
+
+from rent_scraper.logger import logger
+
+# Directory the metrics of each run are written to. Nothing is collected unless this is set.
+METRICS_DIR = os.getenv("METRICS_DIR")
+
+# Upper bounds in seconds of the histogram buckets each timing is counted in
+BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300]
+PROMETHEUS_FILE = "rent_scraper.prom"
+
+# The range being swept, so that timings can be broken down by range. Context variables follow work onto the engine's
+# event loop and into asyncio.to_thread, but have to be passed on by hand to other executors.
+current_query: ContextVar[str | None] = ContextVar("current_query", default=None)
+
+# Returned by Metrics.timer when metrics are disabled, so that timing something costs next to nothing
+DISABLED = nullcontext()
+
+
+@dataclass
+class Timing:
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    buckets: List[int] = field(default_factory=lambda: [0] * (len(BUCKETS) + 1))
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def percentile(self, percent: float) -> float:
+        """
+        :return: The upper bound of the bucket the percentile falls in, or the longest time if it's past the last one.
+        """
+        target = self.count * percent / 100
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "total_seconds": round(self.total, 4),
+            "mean_seconds": round(self.total / self.count, 4) if self.count else 0,
+            "p50_seconds": round(self.percentile(50), 4),
+            "p99_seconds": round(self.percentile(99), 4),
+            "max_seconds": round(self.max, 4),
+        }
+
+
+class Timer:
+    def __init__(self, metrics: "Metrics", stage: str) -> None:
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+
+
+class Metrics:
+    """
+    Timers and counters for each stage of scraping, such as loading pages, parsing them and writing to the database.
+
+    Everything recorded while a range is being swept is also recorded against that range, so slow ranges stand out.
+    At the end of a run, the totals are written to a Prometheus text file, for the node exporter's textfile collector
+    to pick up, along with a JSON summary of the run.
+    """
+
+    def __init__(self, directory: str | None = METRICS_DIR) -> None:
+        self.directory = Path(directory) if directory else None
+        self.enabled = directory is not None
+        self.started = datetime.datetime.now()
+        self._timings: Dict[str, Timing] = {}
+        self._counters: Dict[str, float] = {}
+        # The same again for each range
+        self._query_timings: Dict[str, Dict[str, Timing]] = {}
+        self._query_counters: Dict[str, Dict[str, float]] = {}
+        self._lock = Lock()
+
+    def timer(self, stage: str) -> Timer | nullcontext:
+        """
+        :param stage: Name of what is being timed e.g. "browser.load".
+        :return: A context manager that records how long its body took.
+        """
+        if not self.enabled:
+            return DISABLED
+        return Timer(self, stage)
+
+    def observe(self, stage: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        query = current_query.get()
+        with self._lock:
+            self._timings.setdefault(stage, Timing()).add(seconds)
+            if query is not None:
+                self._query_timings.setdefault(query, {}).setdefault(stage, Timing()).add(seconds)
+
+    def increment(self, counter: str, amount: float = 1) -> None:
+        if not self.enabled:
+            return
+        query = current_query.get()
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+            if query is not None:
+                counters = self._query_counters.setdefault(query, {})
+                counters[counter] = counters.get(counter, 0) + amount
+
+    @contextmanager
+    def query(self, query) -> Iterator[None]:
+        """
+        Records everything done within the block against a range, as well as overall.
+        """
+        token = current_query.set(str(query))
+        try:
+            yield
+        finally:
+            current_query.reset(token)
+
+    def summary(self, extra: Dict | None = None) -> Dict:
+        """
+        :param extra: Anything else to include, such as the browser pool stats.
+        :return: Everything recorded so far, overall and for each range. Ranges are ordered slowest first.
+        """
+        with self._lock:
+            queries = {
+                query: {
+                    "stages": {stage: timing.summary() for stage, timing in sorted(timings.items())},
+                    "counters": dict(sorted(self._query_counters.get(query, {}).items())),
+                }
+                for query, timings in self._query_timings.items()
+            }
+            summary = {
+                "started": self.started.isoformat(timespec="seconds"),
+                "duration_seconds": round((datetime.datetime.now() - self.started).total_seconds(), 1),
+                "stages": {stage: timing.summary() for stage, timing in sorted(self._timings.items())},
+                "counters": dict(sorted(self._counters.items())),
+            }
+
+        def sweep_time(item) -> float:
+            return item[1]["stages"].get("sweep", {}).get("total_seconds", 0)
+
+        return {**summary, "queries": dict(sorted(queries.items(), key=sweep_time, reverse=True)), **(extra or {})}
+
+    def prometheus(self) -> str:
+        """
+        :return: The overall totals in the Prometheus text format. Ranges are left out, as there are too many of them
+        to be labels.
+        """
+        with self._lock:
+            timings = sorted(self._timings.items())
+            counters = sorted(self._counters.items())
+
+        lines = [
+            "# HELP rent_scraper_stage_seconds Time spent in each stage of scraping during the last run.",
+            "# TYPE rent_scraper_stage_seconds histogram",
+        ]
+        for stage, timing in timings:
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ["+Inf"], timing.buckets):
+                cumulative += count
+                lines.append(f'rent_scraper_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'rent_scraper_stage_seconds_sum{{stage="{stage}"}} {timing.total}')
+            lines.append(f'rent_scraper_stage_seconds_count{{stage="{stage}"}} {timing.count}')
+        lines += [
+            "# HELP rent_scraper_events Number of times each event happened during the last run.",
+            "# TYPE rent_scraper_events gauge",
+        ]
+        lines += [f'rent_scraper_events{{event="{counter}"}} {value}' for counter, value in counters]
+        lines += [
+            "# HELP rent_scraper_run_duration_seconds How long the last run took.",
+            "# TYPE rent_scraper_run_duration_seconds gauge",
+            f"rent_scraper_run_duration_seconds {(datetime.datetime.now() - self.started).total_seconds()}",
+            "# HELP rent_scraper_run_finished_timestamp_seconds When the last run finished.",
+            "# TYPE rent_scraper_run_finished_timestamp_seconds gauge",
+            f"rent_scraper_run_finished_timestamp_seconds {time.time()}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write(self, extra: Dict | None = None) -> None:
+        """
+        Writes the Prometheus file and a JSON summary of the run to the metrics directory.
+
+        :param extra: Anything else to include in the summary.
+        """
+        if not self.enabled:
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Replaced in one go, so the collector never reads half a file
+            temporary = self.directory / f".{PROMETHEUS_FILE}.{os.getpid()}"
+            temporary.write_text(self.prometheus())
+            temporary.replace(self.directory / PROMETHEUS_FILE)
+
+            summary = self.directory / f"run-{self.started:%Y%m%d-%H%M%S}-{os.getpid()}.json"
+            summary.write_text(json.dumps(self.summary(extra), indent=2, default=str))
+        except OSError as e:
+            logger.error(f"Metrics: Could not write to {self.directory}: {e}")
+            return
+        logger.info(f"Metrics: Written to {summary}")
+
+
+metrics = Metrics()
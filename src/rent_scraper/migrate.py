@@ -0,0 +1,85 @@
+import datetime
+from pathlib import Path
+
+from rent_scraper.logger import logger, configure_logging
+from rent_scraper.model import (
+    db,
+    init_db,
+    Address,
+    AddressHistory,
+    Listing,
+    ListingHistory,
+    ListingCheck,
+    Job,
+    GeocodeCache,
+    Query,
+    SearchRun,
+    RangeProgress,
+    RangeSeen,
+    PendingRefresh,
+    SchemaMigration,
+)
+
+RESOURCES = Path(__file__).parent / "resources"
+# Migrations are applied in filename order, so they should be prefixed with a number e.g. "001_add_index.sql"
+MIGRATIONS = RESOURCES / "migrations"
+
+TABLES = [
+    Address,
+    AddressHistory,
+    Listing,
+    ListingHistory,
+    ListingCheck,
+    Query,
+    Job,
+    GeocodeCache,
+    SearchRun,
+    RangeProgress,
+    RangeSeen,
+    PendingRefresh,
+    SchemaMigration,
+]
+
+
+def migrate():
+    """
+    Creates any missing tables, runs the first time setup if it hasn't been run yet and applies any new migrations.
+    """
+    configure_logging()
+    init_db()
+    run_migrations()
+
+
+def run_migrations() -> None:
+    db.create_tables(TABLES, safe=True)
+
+    # The views are created by the setup script, so if they exist it has already been run
+    if "simpleaddressview" not in [view.name for view in db.get_views()]:
+        logger.info("Running first time setup")
+        with db.atomic():
+            _execute_file(RESOURCES / "first_time_setup.sql")
+
+    applied = {migration.name for migration in SchemaMigration.select()}
+    for path in sorted(MIGRATIONS.glob("*.sql")):
+        if path.stem in applied:
+            continue
+        logger.info(f"Applying migration {path.stem}")
+        with db.atomic():
+            _execute_file(path)
+            SchemaMigration.create(name=path.stem, applied_at=datetime.datetime.now())
+
+    if Address.select().where(Address.key.is_null()).exists():
+        # Imported here as it pulls in the scraping modules, which migrating shouldn't need otherwise
+        from rent_scraper.dedupe_addresses import dedupe_addresses
+
+        dedupe_addresses()
+
+
+def _execute_file(path: Path) -> None:
+    with open(path) as f:
+        command = f.read()
+    db.execute_sql(command)
+
+
+if __name__ == "__main__":
+    migrate()
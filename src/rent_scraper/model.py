@@ -1,9 +1,14 @@
 import os
-from pathlib import Path
+import re
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
 
 from peewee import (
+    DatabaseProxy,
+    InterfaceError,
     Model,
-    PostgresqlDatabase,
+    OperationalError,
     TextField,
     IntegerField,
     AutoField,
@@ -12,26 +17,139 @@ from peewee import (
     DateTimeField,
     BooleanField,
     CompositeKey,
-    ProgrammingError,
 )
+from playhouse.pool import PooledPostgresqlDatabase
 
-db = PostgresqlDatabase(
-    "rent-finder",
-    user=os.getenv("DB_USER"),
-    password=os.getenv("DB_PASS"),
-    host=os.getenv("DB_HOST"),
+from rent_scraper.logger import logger
+from rent_scraper.metrics import metrics
+
+# Threads that can use the database at once: the main thread, the range workers (or worker threads), the geocoding
+# threads, and the threads asyncio.to_thread runs the engine's blocking calls on, which Python sizes from the number of
+# cores. The parse threads and the range planner's counting threads don't use the database.
+DB_THREADS = (
+    1
+    + int(os.getenv("RANGE_WORKERS", os.getenv("THREADS", 1)))
+    + int(os.getenv("THREADS", 1))
+    + min(32, (os.cpu_count() or 1) + 4)
 )
-db.connect()
+# Most connections open at once. Every thread that uses the database holds one while it does, so by default there is
+# one for each of them.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", DB_THREADS))
+# Seconds to wait for a connection once they're all in use, before giving up
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+# Seconds a connection is kept open for before it's replaced with a new one
+DB_STALE_SECONDS = int(os.getenv("DB_STALE_SECONDS", 300))
+# Statements that take longer than this many milliseconds are logged
+DB_SLOW_MS = int(os.getenv("DB_SLOW_MS", 1000))
+
+VERB = re.compile(r"\s*([A-Za-z]+)")
+
+# Bound to a real database by init_db, so that importing the models doesn't need a database to be available
+db = DatabaseProxy()
+
+
+class Database(PooledPostgresqlDatabase):
+    """
+    Pool of connections, with each thread checking out its own when it first uses the database. Connections go back to
+    the pool when the thread closes them, which connection() takes care of.
+
+    Every statement is timed. A statement that fails because its connection was dropped, such as when PostgreSQL is
+    restarted, is retried once on a new connection, unless it was part of a transaction.
+    """
+
+    def execute_sql(self, sql, params=None, commit=None):
+        verb = match.group(1).lower() if (match := VERB.match(sql)) else "other"
+        start = time.perf_counter()
+        with metrics.timer(f"db.{verb}"):
+            try:
+                cursor = super().execute_sql(sql, params)
+            except (OperationalError, InterfaceError) as e:
+                if self.in_transaction() or not self._connection_lost():
+                    raise
+                logger.warning(
+                    f"Database: Connection lost ({type(e).__name__}: {str(e).splitlines()[0]}), reconnecting"
+                )
+                self._reconnect()
+                cursor = super().execute_sql(sql, params)
+        if (elapsed := (time.perf_counter() - start) * 1000) > DB_SLOW_MS:
+            connection = self.connection().info.backend_pid
+            logger.warning(f"Database: Slow {verb} on connection {connection} took {elapsed:.0f} ms: {sql[:200]}")
+        return cursor
+
+    def _connection_lost(self) -> bool:
+        return not self.is_closed() and self._state.conn.closed != 0
+
+    def _reconnect(self) -> None:
+        # A dropped connection isn't put back in the pool
+        self.close()
+        # Whatever dropped this connection most likely dropped the idle ones too
+        self.close_idle()
+        self.connect()
+
+    def stats(self) -> Dict[str, int]:
+        with self._pool_lock:
+            return {"max": self._max_connections, "in_use": len(self._in_use), "idle": len(self._connections)}
+
+
+def init_db(
+    name: str | None = None,
+    user: str | None = None,
+    password: str | None = None,
+    host: str | None = None,
+) -> Database:
+    """
+    Binds the models to a database. Connections are only opened once the database is first used.
+
+    :param name: Defaults to the DB_NAME environment variable, or "rent-finder".
+    :param user: Defaults to the DB_USER environment variable.
+    :param password: Defaults to the DB_PASS environment variable.
+    :param host: Defaults to the DB_HOST environment variable.
+    :return: The database the models are now bound to.
+    """
+    database = Database(
+        name or os.getenv("DB_NAME", "rent-finder"),
+        max_connections=DB_POOL_SIZE,
+        stale_timeout=DB_STALE_SECONDS,
+        timeout=DB_POOL_TIMEOUT,
+        user=user or os.getenv("DB_USER"),
+        password=password or os.getenv("DB_PASS"),
+        host=host or os.getenv("DB_HOST"),
+    )
+    db.initialize(database)
+    return database
+
+
+@contextmanager
+def connection() -> Iterator[None]:
+    """
+    Checks a connection out of the pool for the current thread, and puts it back at the end of the block. If the thread
+    already has one, that is used instead and left open. Can also be used as a decorator.
+
+    Threads that only use the database now and then, like those running asyncio.to_thread, should use this so they
+    don't each keep a connection for as long as they live.
+    """
+    opened = db.connect(reuse_if_open=True)
+    try:
+        yield
+    finally:
+        if opened:
+            db.close()
 
 
 class BaseModel(Model):
     class Meta:
         database = db
 
+    def save(self, *args, **kwargs):
+        with metrics.timer(f"db.save.{self._meta.table_name}"):
+            return super().save(*args, **kwargs)
+
 
 class Address(BaseModel):
     id = AutoField(primary_key=True)
     address = TextField()
+    # The address as given by geocoding.address_key, which is unique
+    key = TextField(null=True)
     latitude = FloatField(null=True)
     longitude = FloatField(null=True)
 
@@ -85,23 +203,98 @@ class SimpleListing(BaseModel):
         table_name = "simplelistingview"
 
 
+# When a listing was last checked for changes and when it is next due, along with how often checks have found a change
+class ListingCheck(BaseModel):
+    listing = ForeignKeyField(Listing, primary_key=True, on_delete="CASCADE")
+    first_seen = DateTimeField()
+    last_checked = DateTimeField()
+    next_check = DateTimeField(index=True)
+    checks = IntegerField(default=0)
+    changes = IntegerField(default=0)
+
+
 class Query(BaseModel):
     lower_price = IntegerField(null=True)
     upper_price = IntegerField(null=True)
     beds = TextField(null=True)
+    # Watermark from the last complete sweep of the range, being the count the site gave and the number of listings we
+    # had in the range at the end
+    swept_at = DateTimeField(null=True)
+    swept_count = IntegerField(null=True)
+    found_count = IntegerField(null=True)
+    # Count the site last gave for the range, whether or not it was swept
+    listing_count = IntegerField(null=True)
+    counted_at = DateTimeField(null=True)
+
+    class Meta:
+        indexes = ((("beds", "lower_price", "upper_price"), True),)
 
     def __str__(self):
         return f"{self.beds} | {self.lower_price} - {self.upper_price}"
 
 
-db.create_tables([Address, Listing, ListingHistory, AddressHistory], safe=True)
+# Result of geocoding a normalised address. Entries without coordinates record a failed lookup and why, so it isn't
+# retried until the entry expires.
+class GeocodeCache(BaseModel):
+    address = TextField(primary_key=True)
+    latitude = FloatField(null=True)
+    longitude = FloatField(null=True)
+    source = TextField()
+    reason = TextField(null=True)
+    expires_at = DateTimeField()
+
+
+# Work shared between scraper processes, which is leased to one process at a time. Times are from the database's clock,
+# so that processes on different hosts agree on when a lease has expired.
+class Job(BaseModel):
+    id = AutoField(primary_key=True)
+    kind = TextField()
+    key = TextField()
+    status = TextField(default="pending")
+    attempts = IntegerField(default=0)
+    available_at = DateTimeField()
+    lease_owner = TextField(null=True)
+    lease_expires = DateTimeField(null=True)
+    last_error = TextField(null=True)
+
+
+# A run of search. A run that was interrupted is resumed by the next one, rather than started again.
+class SearchRun(BaseModel):
+    id = AutoField(primary_key=True)
+    started_at = DateTimeField()
+    finished_at = DateTimeField(null=True)
+
+
+# How far a run has got through a range, being the last page that was saved and whether the range is done
+class RangeProgress(BaseModel):
+    run = ForeignKeyField(SearchRun, on_delete="CASCADE")
+    query = ForeignKeyField(Query, on_delete="CASCADE")
+    page = IntegerField(default=0)
+    done = BooleanField(default=False)
+
+    class Meta:
+        primary_key = CompositeKey("run", "query")
+
+
+# Listings on the pages of a range that have been saved, so a resumed sweep still knows which listings have gone
+class RangeSeen(BaseModel):
+    run = ForeignKeyField(SearchRun, on_delete="CASCADE")
+    query = ForeignKeyField(Query, on_delete="CASCADE")
+    listing = TextField()
+
+    class Meta:
+        primary_key = CompositeKey("run", "query", "listing")
+
+
+# Listings a run planned to check for changes, until their changes are saved
+class PendingRefresh(BaseModel):
+    run = ForeignKeyField(SearchRun, on_delete="CASCADE")
+    listing = TextField()
+
+    class Meta:
+        primary_key = CompositeKey("run", "listing")
+
 
-# Try to read from the address view to check if the db setup has run
-try:
-    SimpleAddress.select().get()
-except ProgrammingError:
-    setup_file = Path(__file__).parent / "resources" / "first_time_setup.sql"
-    cursor = db.cursor()
-    with open(setup_file) as f:
-        command = f.read()
-    cursor.execute(command)
+class SchemaMigration(BaseModel):
+    name = TextField(primary_key=True)
+    applied_at = DateTimeField()
@@ -0,0 +1,12 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class Page:
+    """
+    The parts of an HTTP response that the sites care about.
+    """
+
+    status: int
+    url: str
+    text: str
@@ -0,0 +1,190 @@
+import gzip
+import hashlib
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+from threading import Lock, get_ident
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from rent_scraper.logger import logger
+from rent_scraper.page import Page
+
+# Directory to keep fetched pages in. The cache is disabled unless this is set.
+PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR")
+PAGE_CACHE_MAX_MB = int(os.getenv("PAGE_CACHE_MAX_MB", 2048))
+# Serve every page from the cache however old it is, and never go to the site. Pages that aren't cached fail to load.
+PAGE_CACHE_REPLAY = os.getenv("PAGE_CACHE_REPLAY", "0") != "0"
+
+# Seconds each class of page is served from the cache for. Search results change quickly and are relied on to spot
+# changes, so they are only reused within a run, e.g. for the count check and the first page of a range.
+TTLS = {
+    "search": int(os.getenv("PAGE_CACHE_TTL_SEARCH", 300)),
+    "listing": int(os.getenv("PAGE_CACHE_TTL_LISTING", 3600)),
+    "other": 0,
+}
+URL_CLASSES: List[Tuple[str, re.Pattern]] = [
+    ("search", re.compile(r"^https?://[^/]+/rent/\?")),
+    ("listing", re.compile(r"^https?://[^/]+/[\w-]*\d+$")),
+]
+# Only pages that can be parsed are worth keeping
+CACHEABLE_STATUS = [200, 404, 410]
+TRACKING_PARAMS = re.compile(r"^(utm_\w+|fbclid|gclid)$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS page
+(
+    url         TEXT PRIMARY KEY,
+    url_class   TEXT    NOT NULL,
+    digest      TEXT    NOT NULL,
+    status      INTEGER NOT NULL,
+    final_url   TEXT    NOT NULL,
+    size        INTEGER NOT NULL,
+    fetched_at  REAL    NOT NULL,
+    accessed_at REAL    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS page_digest ON page (digest);
+CREATE INDEX IF NOT EXISTS page_accessed_at ON page (accessed_at);
+"""
+# Number of cache hits whose access times are held in memory before being written to the index
+ACCESS_BATCH_SIZE = 1000
+
+
+def normalise_url(url: str) -> str:
+    """
+    :return: The URL with the scheme and host in lower case, the query sorted and tracking parameters and the fragment
+    removed, so that the same page always has the same key.
+    """
+    parts = urlsplit(url)
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True))
+    query = [(key, value) for key, value in query if not TRACKING_PARAMS.match(key)]
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", urlencode(query), ""))
+
+
+def url_class(url: str) -> str:
+    for name, pattern in URL_CLASSES:
+        if pattern.match(url):
+            return name
+    return "other"
+
+
+class PageCache:
+    """
+    Compressed, content-addressed store of fetched pages. Each page body is gzipped and stored under the hash of its
+    contents, so pages that are identical are only stored once, and an SQLite index maps each normalised URL to its
+    latest body. Once the bodies take up too much space, the least recently used pages are evicted.
+
+    When each page was last used is only written to the index in batches, along with the next page stored, rather than
+    on every hit. Access times that haven't been written when the process exits are lost, which only makes eviction a
+    little less accurate.
+    """
+
+    def __init__(self, directory: str | Path, max_mb: int = PAGE_CACHE_MAX_MB, replay: bool = PAGE_CACHE_REPLAY):
+        self.directory = Path(directory)
+        self.max_bytes = max_mb * 1024 * 1024
+        self.replay = replay
+        (self.directory / "pages").mkdir(parents=True, exist_ok=True)
+        self._lock = Lock()
+        self._index = sqlite3.connect(self.directory / "index.sqlite", check_same_thread=False)
+        self._index.executescript(SCHEMA)
+        # When each page was last used, keyed by normalised URL, until they are written to the index
+        self._accessed: Dict[str, float] = {}
+        self._size = self._index.execute("SELECT COALESCE(SUM(size), 0) FROM page").fetchone()[0]
+
+    def get(self, url: str) -> Page | None:
+        """
+        :param url: URL of the page.
+        :return: The cached page, or None if it isn't cached or is older than the TTL for its class of URL.
+        """
+        key = normalise_url(url)
+        with self._lock:
+            row = self._index.execute(
+                "SELECT digest, status, final_url, fetched_at, url_class FROM page WHERE url = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            digest, status, final_url, fetched_at, name = row
+            if not self.replay and time.time() - fetched_at > TTLS.get(name, 0):
+                return None
+            self._accessed[key] = time.time()
+            if len(self._accessed) >= ACCESS_BATCH_SIZE:
+                self._write_accessed()
+                self._index.commit()
+        try:
+            text = gzip.decompress(self._path(digest).read_bytes()).decode()
+        except (OSError, EOFError) as e:
+            logger.warning(f"Page cache: Could not read {url}: {type(e).__name__}: {e}")
+            return None
+        return Page(status, final_url, text)
+
+    def put(self, url: str, page: Page) -> None:
+        """
+        Stores a page, replacing any earlier copy of it, unless it's a class of page that isn't worth keeping.
+        """
+        name = url_class(url)
+        if page.status not in CACHEABLE_STATUS or (not self.replay and TTLS.get(name, 0) <= 0):
+            return
+        body = page.text.encode()
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._path(digest)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            # Written under a temporary name, so a crash can't leave a partial body under the real one
+            temporary = path.with_suffix(f".{os.getpid()}.{get_ident()}.tmp")
+            temporary.write_bytes(gzip.compress(body, compresslevel=6))
+            temporary.replace(path)
+
+        key = normalise_url(url)
+        now = time.time()
+        with self._lock:
+            old = self._index.execute("SELECT digest, size FROM page WHERE url = ?", (key,)).fetchone()
+            size = path.stat().st_size
+            self._accessed.pop(key, None)
+            self._index.execute(
+                "INSERT OR REPLACE INTO page VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, name, digest, page.status, page.url, size, now, now),
+            )
+            self._size += size - (old[1] if old else 0)
+            if old is not None and old[0] != digest:
+                self._delete_unused(old[0])
+            # So that eviction goes by when each page was really last used
+            self._write_accessed()
+            self._evict()
+            self._index.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            pages = self._index.execute("SELECT COUNT(*) FROM page").fetchone()[0]
+            return {"pages": pages, "bytes": self._size}
+
+    def _path(self, digest: str) -> Path:
+        return self.directory / "pages" / digest[:2] / f"{digest}.gz"
+
+    def _evict(self) -> None:
+        # Must be called while holding the lock
+        while self._size > self.max_bytes:
+            row = self._index.execute("SELECT url, digest, size FROM page ORDER BY accessed_at LIMIT 1").fetchone()
+            if row is None:
+                return
+            url, digest, size = row
+            self._index.execute("DELETE FROM page WHERE url = ?", (url,))
+            self._size -= size
+            self._delete_unused(digest)
+
+    def _write_accessed(self) -> None:
+        # Must be called while holding the lock, and the caller commits
+        if self._accessed:
+            self._index.executemany(
+                "UPDATE page SET accessed_at = ? WHERE url = ?", [(at, key) for key, at in self._accessed.items()]
+            )
+            self._accessed.clear()
+
+    def _delete_unused(self, digest: str) -> None:
+        # Bodies are shared between identical pages, so only delete one once nothing points to it
+        if self._index.execute("SELECT 1 FROM page WHERE digest = ? LIMIT 1", (digest,)).fetchone() is None:
+            self._path(digest).unlink(missing_ok=True)
+
+
+page_cache = PageCache(PAGE_CACHE_DIR) if PAGE_CACHE_DIR else None
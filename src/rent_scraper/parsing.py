@@ -0,0 +1,71 @@
+import importlib.util
+import os
+import re
+from dataclasses import dataclass
+from typing import List
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from rent_scraper.logger import logger
+
+# Which library parses pages: "selectolax", "lxml" or "html.parser". By default the fastest that is installed is used.
+HTML_PARSER = os.getenv("HTML_PARSER", "auto")
+
+# Fastest first. Only html.parser is always available, as it's part of the standard library.
+BACKENDS = ["selectolax", "lxml", "html.parser"]
+PARSER = "html.parser"
+
+
+@dataclass(frozen=True)
+class Keep:
+    """
+    The parts of a page that are needed, so that the rest doesn't have to be built into a tree: the elements with a
+    matching data-testid, along with everything inside them.
+    """
+
+    testid: re.Pattern
+    # The same elements, as a CSS selector for selectolax. Must not match anything inside the elements it matches.
+    css: str
+
+
+def available_backends() -> List[str]:
+    return [backend for backend in BACKENDS if backend == "html.parser" or importlib.util.find_spec(backend)]
+
+
+def resolve(name: str) -> str:
+    """
+    :param name: A backend, or "auto" for the fastest one installed.
+    :return: The backend to use, falling back to html.parser if the one asked for isn't installed.
+    """
+    available = available_backends()
+    if name == "auto":
+        return available[0]
+    if name not in available:
+        logger.warning(f"HTML parser {name} is not installed, using html.parser instead")
+        return "html.parser"
+    return name
+
+
+def parse(html: str, keep: Keep | None = None, backend: str | None = None) -> BeautifulSoup:
+    """
+    Parses a page, or only the parts of it that are needed.
+
+    :param html: The page.
+    :param keep: The parts of the page to parse, otherwise the whole page is.
+    :param backend: Library to parse with, otherwise the one chosen by HTML_PARSER.
+    :return: The parsed page.
+    """
+    backend = backend or BACKEND
+    if keep is None:
+        # selectolax can't build a BeautifulSoup tree, so whole pages go to the next best
+        return BeautifulSoup(html, "lxml" if backend != "html.parser" and "lxml" in available_backends() else PARSER)
+    if backend == "selectolax":
+        from selectolax.lexbor import LexborHTMLParser
+
+        # The parts are small, so it hardly matters what turns them into a tree
+        fragments = "".join(node.html for node in LexborHTMLParser(html).css(keep.css))
+        return BeautifulSoup(fragments, PARSER)
+    return BeautifulSoup(html, backend, parse_only=SoupStrainer(attrs={"data-testid": keep.testid}))
+
+
+BACKEND = resolve(HTML_PARSER)
@@ -0,0 +1,256 @@
+import datetime
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Iterable, List
+
+from peewee import ValuesList
+
+from rent_scraper.geocoding import address_key
+from rent_scraper.known_listings import known_listings
+from rent_scraper.logger import logger
+from rent_scraper.metrics import metrics
+from rent_scraper.model import (
+    db,
+    connection,
+    Address,
+    AddressHistory,
+    Listing,
+    ListingCheck,
+    ListingHistory,
+    SimpleAddress,
+    SimpleListing,
+)
+from rent_scraper.refresh import next_interval
+
+# Arbitrary key for the advisory lock held while creating addresses
+ADDRESS_LOCK = 8_271_001
+# Number of address IDs kept in memory
+ADDRESS_CACHE_SIZE = int(os.getenv("ADDRESS_CACHE_SIZE", 50000))
+
+
+class AddressIds:
+    """
+    LRU cache of the ID of each address key, so that addresses which have been seen before don't need a query to find.
+    Addresses are never given a different ID, so entries don't go stale, unless dedupe_addresses merges them.
+    """
+
+    def __init__(self, size: int = ADDRESS_CACHE_SIZE) -> None:
+        self.size = size
+        self._ids: OrderedDict[str, int] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, keys: Iterable[str]) -> Dict[str, int]:
+        """
+        :return: The IDs of the keys that are cached.
+        """
+        found = {}
+        with self._lock:
+            for key in keys:
+                if (address_id := self._ids.get(key)) is not None:
+                    self._ids.move_to_end(key)
+                    found[key] = address_id
+        metrics.increment("address_ids.hits", len(found))
+        return found
+
+    def put(self, ids: Dict[str, int]) -> None:
+        with self._lock:
+            self._ids.update(ids)
+            for key in ids:
+                self._ids.move_to_end(key)
+            while len(self._ids) > self.size:
+                self._ids.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ids.clear()
+
+
+address_ids = AddressIds()
+
+
+def save_listings(new_listings: Dict[str, Dict[str, int | str]]) -> List[str]:
+    """
+    Saves a batch of new listings, along with any addresses that don't exist yet, in a single transaction.
+
+    :param new_listings: Details of each listing, keyed by listing ID.
+    :return: The IDs of the listings that were created. Listings that already existed are left untouched.
+    """
+    if not new_listings:
+        return []
+
+    now = datetime.datetime.now()
+    keys = {listing_id: address_key(details["address"]) for listing_id, details in new_listings.items()}
+    address_details = {keys[listing_id]: details for listing_id, details in new_listings.items()}
+    with metrics.timer("db.save_listings"), db.atomic():
+        ids = address_ids.get(address_details)
+        ids.update(_address_ids([key for key in address_details if key not in ids]))
+
+        missing = [key for key in address_details if key not in ids]
+        if missing:
+            # Only one transaction at a time can create addresses, so two workers can't both create the same one. The
+            # lock is released when the transaction ends. Another worker may have created some while we waited.
+            db.execute_sql("SELECT pg_advisory_xact_lock(%s)", (ADDRESS_LOCK,))
+            ids.update(_address_ids(missing))
+            missing = [key for key in missing if key not in ids]
+        if missing:
+            created = Address.insert_many(
+                [{"address": address_details[key]["address"], "key": key} for key in missing]
+            ).returning(Address.id, Address.key)
+            ids.update({address.key: address.id for address in created.execute()})
+            AddressHistory.insert_many(
+                [
+                    {
+                        "address": ids[key],
+                        "beds": address_details[key]["beds"],
+                        "baths": address_details[key]["baths"],
+                        "cars": address_details[key]["cars"],
+                        "valid_from": now,
+                    }
+                    for key in missing
+                ]
+            ).execute()
+            logger.debug(f"Saved {len(missing)} new addresses")
+
+        created = (
+            Listing.insert_many([{"id": listing_id, "address": ids[keys[listing_id]]} for listing_id in new_listings])
+            .on_conflict_ignore()
+            .returning(Listing.id)
+        )
+        created_ids = [listing.id for listing in created.execute()]
+        if created_ids:
+            ListingHistory.insert_many(
+                [
+                    {"listing": listing_id, "price": new_listings[listing_id]["price"], "valid_from": now}
+                    for listing_id in created_ids
+                ]
+            ).execute()
+            # Having just been found, there's no need to check them again until they're due
+            ListingCheck.insert_many(
+                [
+                    {
+                        "listing": listing_id,
+                        "first_seen": now,
+                        "last_checked": now,
+                        "next_check": now
+                        + next_interval(datetime.timedelta(0), new_listings[listing_id]["price"], 0, 0),
+                    }
+                    for listing_id in created_ids
+                ]
+            ).execute()
+
+    # Only once committed, so a rolled back address is never cached
+    address_ids.put(ids)
+    for listing_id in created_ids:
+        details = new_listings[listing_id]
+        known_listings.update(listing_id, details["price"], details["beds"], True)
+
+    metrics.increment("listings.new", len(created_ids))
+    logger.debug(f"Saved {len(created_ids)} new listings")
+    return created_ids
+
+
+def _address_ids(keys: List[str]) -> Dict[str, int]:
+    if not keys:
+        return {}
+    return {
+        key: address_id
+        for address_id, key in Address.select(Address.id, Address.key).where(Address.key << keys).tuples()
+    }
+
+
+@connection()
+def get_listings(listing_ids: List[str]) -> Dict[str, SimpleListing]:
+    """
+    Gets the current state of many listings in a single query.
+
+    :param listing_ids: IDs of the listings to get.
+    :return: The listings that exist, keyed by ID.
+    """
+    if not listing_ids:
+        return {}
+    return {listing.id: listing for listing in SimpleListing.select().where(SimpleListing.id << listing_ids)}
+
+
+def close_listings(listing_ids: List[str]) -> int:
+    """
+    Marks many listings as no longer available in a single statement, by closing off their current history rows.
+
+    :param listing_ids: IDs of the listings to close.
+    :return: The number of listings that were closed.
+    """
+    if not listing_ids:
+        return 0
+    with metrics.timer("db.close_listings"):
+        closed = (
+            ListingHistory.update(valid_until=datetime.datetime.now())
+            .where(ListingHistory.listing << listing_ids, ListingHistory.valid_until.is_null())
+            .execute()
+        )
+    for listing_id in listing_ids:
+        known_listings.set_unavailable(listing_id)
+    metrics.increment("listings.closed", closed)
+    logger.debug(f"Closed {closed} listings")
+    return closed
+
+
+def save_changes(listings: Iterable[SimpleListing]) -> int:
+    """
+    Writes the changes made to many listings and their addresses in a few set-based statements, rather than saving
+    each one. Only the fields that were changed are written, so listings where nothing changed cost nothing. Changes
+    are still written through the views, so the history rows are the same as saving the listings one by one.
+
+    :param listings: Listings that may have been changed.
+    :return: The number of listings that had changes written.
+    """
+    dirty = []
+    closed = []
+    # Listings whose price changed or that are available again, with their price and availability
+    updates = {}
+    features = {}
+    for listing in listings:
+        # Only an address that has been loaded can have been changed, so don't load the others
+        address = listing.__rel__.get("address")
+        address_changed = address is not None and address.is_dirty()
+        if not listing.is_dirty() and not address_changed:
+            continue
+        dirty.append(listing)
+        if "available" in listing._dirty and not listing.available:
+            closed.append(listing.id)
+        elif "price" in listing._dirty or "available" in listing._dirty:
+            updates[listing.id] = (listing.price, listing.available)
+        if address_changed:
+            # Listings can share an address, in which case the last one wins as it would have when saved one by one
+            features[address.id] = (address.beds, address.baths, address.cars)
+    if not dirty:
+        return 0
+
+    with metrics.timer("db.save_changes"), db.atomic():
+        if updates:
+            values = ValuesList(
+                [(listing_id, *update) for listing_id, update in updates.items()],
+                columns=("id", "price", "available"),
+                alias="v",
+            )
+            SimpleListing.update(price=values.c.price, available=values.c.available).from_(values).where(
+                SimpleListing.id == values.c.id
+            ).execute()
+        if features:
+            values = ValuesList(
+                [(address_id, *counts) for address_id, counts in features.items()],
+                columns=("id", "beds", "baths", "cars"),
+                alias="v",
+            )
+            # The view's ID is an integer, though the model reads it as text
+            SimpleAddress.update(beds=values.c.beds, baths=values.c.baths, cars=values.c.cars).from_(values).where(
+                SimpleAddress.id == values.c.id.cast("integer")
+            ).execute()
+        close_listings(closed)
+
+    # Only once committed, so the changes are still there to be saved again if it was rolled back
+    for listing in dirty:
+        listing._dirty.clear()
+        if (address := listing.__rel__.get("address")) is not None:
+            address._dirty.clear()
+    logger.debug(f"Saved changes to {len(dirty)} listings")
+    return len(dirty)
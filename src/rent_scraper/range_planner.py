@@ -0,0 +1,198 @@
+import datetime
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from selenium.common import WebDriverException
+from tqdm import tqdm
+
+from rent_scraper.known_listings import known_listings
+from rent_scraper.logger import logger
+from rent_scraper.model import db, Query
+from rent_scraper.sites.site import Site
+from rent_scraper.util import THREADS
+
+# Ranges from before they were kept in the database, only used to seed the first plan
+RANGE_FILE = Path(__file__).parent / "resources" / "ranges.json"
+
+BED_SEARCHES = ["0", "1", "2", "3", "4", "5-any"]
+MAX_PRICE = 50000
+# The site won't show more results than this for a single search
+RESULT_CAP = 1000
+# Ranges are split to hold about this many listings, leaving room to grow before they reach the cap
+RANGE_TARGET_COUNT = int(os.getenv("RANGE_TARGET_COUNT", 700))
+# Ranges are split again once they pass this
+SPLIT_COUNT = RESULT_CAP * 9 // 10
+# Counts older than this are probed again before planning
+RANGE_MAX_AGE_HOURS = float(os.getenv("RANGE_MAX_AGE_HOURS", 24))
+
+
+class RangePlanner:
+    """
+    Keeps the price ranges searched for each bed count under the site's result cap.
+
+    Each range is stored with the count the site last gave for it, which searching keeps up to date. Only ranges
+    without a recent count are probed, in parallel across the browser pool. Ranges that have grown too big are split
+    where the prices of the listings we already have divide them evenly, rather than down the middle, and neighbouring
+    ranges that have shrunk are merged.
+    """
+
+    def __init__(self, site: Site, threads: int = THREADS) -> None:
+        self.site = site
+        self.threads = threads
+
+    def plan(self) -> List[Query]:
+        """
+        :return: The ranges to search, in order of bed count then price.
+        """
+        known_listings.load()
+        ranges = {beds: self._load(beds) for beds in BED_SEARCHES}
+
+        cutoff = datetime.datetime.now() - datetime.timedelta(hours=RANGE_MAX_AGE_HOURS)
+        self._probe([query for queries in ranges.values() for query in queries if self._is_stale(query, cutoff)])
+
+        # Each round splits every range that is too big at once, so the new ranges can be probed together
+        while True:
+            splits = {}
+            for queries in ranges.values():
+                for query in queries:
+                    if query.listing_count is not None and query.listing_count > SPLIT_COUNT:
+                        if query.upper_price - query.lower_price > 2:
+                            splits[query] = self._split(query)
+                        else:
+                            logger.warning(f"Range planner: {query} has {query.listing_count} listings but can't split")
+            if not splits:
+                break
+            for beds, queries in ranges.items():
+                ranges[beds] = [part for query in queries for part in splits.get(query, [query])]
+            self._probe([part for parts in splits.values() for part in parts])
+
+        for beds, queries in ranges.items():
+            ranges[beds] = self._merge(queries)
+
+        planned = [query for queries in ranges.values() for query in queries]
+        logger.info(f"Range planner: {len(planned)} ranges")
+        return planned
+
+    @staticmethod
+    def _load(beds: str) -> List[Query]:
+        queries = list(Query.select().where(Query.beds == beds).order_by(Query.lower_price))
+        if queries:
+            return queries
+
+        bounds = [(0, MAX_PRICE)]
+        if os.path.exists(RANGE_FILE):
+            with open(RANGE_FILE) as f:
+                serialised = json.load(f)
+            bounds = sorted((q["lower_price"], q["upper_price"]) for q in serialised if q["beds"] == beds) or bounds
+        return [Query.create(lower_price=lower, upper_price=upper, beds=beds) for lower, upper in bounds]
+
+    @staticmethod
+    def _is_stale(query: Query, cutoff: datetime.datetime) -> bool:
+        return query.counted_at is None or query.counted_at < cutoff
+
+    def _probe(self, queries: List[Query]) -> None:
+        """
+        Gets the count of each range from the site, several at a time.
+        """
+        if not queries:
+            return
+
+        def count(query: Query) -> int | None:
+            try:
+                return self.site.count_listings(query)
+            except WebDriverException as e:
+                logger.warning(f"Range planner: Couldn't count {query}: {type(e).__name__}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            counts = list(tqdm(executor.map(count, queries), total=len(queries), desc="Counting", leave=False))
+
+        now = datetime.datetime.now()
+        for query, listing_count in zip(queries, counts):
+            if listing_count is not None:
+                query.listing_count = listing_count
+                query.counted_at = now
+                query.save()
+
+    def _split(self, query: Query) -> List[Query]:
+        """
+        Splits a range into enough parts to get each under the target count. The split points are taken from the
+        prices of the listings we have in the range, falling back to even widths when there aren't enough.
+        """
+        parts = math.ceil(query.listing_count / RANGE_TARGET_COUNT)
+        prices = sorted(known_listings.in_range(query).values())
+        points = set()
+        if len(prices) >= parts:
+            for i in range(1, parts):
+                # Prices are usually round numbers, so ending a range one below is less likely to land on a listing
+                point = prices[len(prices) * i // parts] - 1
+                if query.lower_price + 1 < point < query.upper_price - 1:
+                    points.add(point)
+        if not points:
+            width = query.upper_price - query.lower_price
+            points = {query.lower_price + width * i // parts for i in range(1, parts)}
+        points = sorted(points)
+
+        bounds = list(zip([query.lower_price] + points, points + [query.upper_price]))
+        logger.info(f"Range planner: Splitting {query} with {query.listing_count} listings into {len(bounds)}")
+        return self._replace([query], bounds)
+
+    def _merge(self, queries: List[Query]) -> List[Query]:
+        """
+        Merges runs of neighbouring ranges that together are no bigger than the target count.
+        """
+        merged = []
+        run = []
+
+        def flush() -> None:
+            if len(run) > 1:
+                logger.info(f"Range planner: Merging {len(run)} ranges from {run[0]} to {run[-1]}")
+                merged.extend(self._replace(run, [(run[0].lower_price, run[-1].upper_price)]))
+            else:
+                merged.extend(run)
+            run.clear()
+
+        for query in queries:
+            if query.listing_count is None:
+                # Can't tell whether it's safe to merge without a count
+                flush()
+                merged.append(query)
+            elif (
+                run
+                and run[-1].upper_price == query.lower_price
+                and sum(q.listing_count for q in run) + query.listing_count <= RANGE_TARGET_COUNT
+            ):
+                run.append(query)
+            else:
+                flush()
+                run.append(query)
+        flush()
+        return merged
+
+    @staticmethod
+    def _replace(old: List[Query], bounds: List[Tuple[int, int]]) -> List[Query]:
+        """
+        Swaps ranges for new ones covering the same prices. A merged range takes the total of the old counts, while
+        split ranges are left to be probed.
+        """
+        beds = old[0].beds
+        counts: Dict[Tuple[int, int], int] = {}
+        if len(bounds) == 1:
+            counts[bounds[0]] = sum(query.listing_count for query in old)
+        with db.atomic():
+            for query in old:
+                query.delete_instance()
+            return [
+                Query.create(
+                    lower_price=lower,
+                    upper_price=upper,
+                    beds=beds,
+                    listing_count=counts.get((lower, upper)),
+                    counted_at=min(query.counted_at for query in old) if (lower, upper) in counts else None,
+                )
+                for lower, upper in bounds
+            ]
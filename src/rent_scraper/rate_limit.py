@@ -0,0 +1,164 @@
+import asyncio
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from typing import Dict
+from urllib.parse import urlsplit
+
+from rent_scraper.logger import logger
+
+# Requests per second each host starts at, and the most it can be raised to while the host keeps up
+RATE_LIMIT = float(os.getenv("RATE_LIMIT", 2))
+RATE_LIMIT_MAX = float(os.getenv("RATE_LIMIT_MAX", 10))
+RATE_LIMIT_MIN = 0.1
+# How many requests can be made at once after a host has been quiet
+BURST = 5
+# Number of times a failed HTTP request is retried
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 3))
+# Number of failures in a row that stops all requests to a host, and for how many seconds
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", 60))
+# Statuses that mean the request should be tried again later
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Statuses that mean the host wants us to slow down
+THROTTLE_STATUSES = {429, 503}
+
+
+def backoff(attempt: int, base: float = 1, cap: float = 60) -> float:
+    """
+    :param attempt: Number of attempts made so far, starting at 0.
+    :return: Seconds to wait before the next attempt, exponential with full jitter so that retries from many workers
+    don't line up.
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    :param value: A Retry-After header, which is either a number of seconds or an HTTP date.
+    :return: Seconds to wait, or None if there was no usable header.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class HostLimiter:
+    """
+    Token bucket for a single host, whose rate adapts to how the host responds. The rate creeps up while requests
+    succeed, and is halved whenever the host throttles us or slows down noticeably. Too many failures in a row open the
+    circuit breaker, which stops all requests to the host for a while.
+
+    Whether the host has slowed down is judged against the usual latency of the same kind of client, as a browser
+    loading a whole page always takes far longer than fetching it over HTTP.
+    """
+
+    def __init__(self, host: str, rate: float = RATE_LIMIT, max_rate: float = RATE_LIMIT_MAX) -> None:
+        self.host = host
+        self.rate = rate
+        self.max_rate = max_rate
+        self.tokens = float(BURST)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.failures = 0
+        # Moving average of the latency of each kind of client
+        self.latency: Dict[str, float] = {}
+        self._lock = Lock()
+
+    def reserve(self) -> float:
+        """
+        Takes a token, going into debt if there are none left so that callers queue up in order.
+
+        :return: Seconds to wait before making the request.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(BURST, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, self.blocked_until - now, -self.tokens / self.rate)
+
+    def record(self, status: int | None, latency: float, retry_after: str | None = None, client: str = "http") -> None:
+        """
+        Adapts the rate to the result of a request.
+
+        :param status: Status of the response, or None if there wasn't one.
+        :param latency: Seconds the request took.
+        :param retry_after: Retry-After header of the response.
+        :param client: Kind of client that made the request, e.g. "http" or "browser".
+        """
+        with self._lock:
+            now = time.monotonic()
+            if status is None or status in RETRY_STATUSES:
+                self.failures += 1
+            else:
+                self.failures = 0
+
+            if status in THROTTLE_STATUSES:
+                self._slow_down(f"got {status}")
+                if (delay := parse_retry_after(retry_after)) is not None:
+                    self.blocked_until = max(self.blocked_until, now + delay)
+            elif status is not None and status not in RETRY_STATUSES:
+                usual = self.latency.get(client)
+                if usual is not None and latency > usual * 3:
+                    self._slow_down(f"took {latency:.1f}s")
+                else:
+                    # Additive increase, so it takes a while to climb back to where it was throttled
+                    self.rate = min(self.max_rate, self.rate + 0.05)
+                self.latency[client] = latency if usual is None else usual * 0.9 + latency * 0.1
+
+            if self.failures >= BREAKER_THRESHOLD:
+                logger.warning(f"Rate limit: {self.failures} failures in a row from {self.host}, pausing it")
+                self.blocked_until = max(self.blocked_until, now + BREAKER_COOLDOWN)
+                # Half open, so one more failure after the pause opens it again
+                self.failures = BREAKER_THRESHOLD - 1
+
+    def _slow_down(self, reason: str) -> None:
+        self.rate = max(RATE_LIMIT_MIN, self.rate / 2)
+        logger.debug(f"Rate limit: {self.host} {reason}, slowing to {self.rate:.2f} requests/s")
+
+
+class RateLimiter:
+    """
+    Hands out a HostLimiter per host, so that every outbound request to a host shares the same limit, whether it is
+    made by a browser or over HTTP.
+    """
+
+    def __init__(self) -> None:
+        self._hosts: Dict[str, HostLimiter] = {}
+        self._lock = Lock()
+
+    def host(self, url: str) -> HostLimiter:
+        host = urlsplit(url).hostname or ""
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = HostLimiter(host)
+            return self._hosts[host]
+
+    def wait(self, url: str) -> None:
+        """
+        Blocks until a request can be made to the URL's host.
+        """
+        if (delay := self.host(url).reserve()) > 0:
+            time.sleep(delay)
+
+    async def wait_async(self, url: str) -> None:
+        if (delay := self.host(url).reserve()) > 0:
+            await asyncio.sleep(delay)
+
+    def record(
+        self, url: str, status: int | None, latency: float, retry_after: str | None = None, client: str = "http"
+    ) -> None:
+        self.host(url).record(status, latency, retry_after, client)
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,154 @@
+import asyncio
+import datetime
+import os
+from threading import Lock
+from typing import List, Set
+
+from peewee import JOIN, fn, ModelSelect
+
+from rent_scraper.engine import AsyncEngine
+from rent_scraper.logger import logger
+from rent_scraper.metrics import metrics
+from rent_scraper.model import connection, ListingCheck, ListingHistory, SimpleListing
+from rent_scraper.sites.site import Site
+
+# Maximum number of listings checked for changes in a run
+REFRESH_BUDGET = int(os.getenv("REFRESH_BUDGET", 2000))
+# How long to leave a typical listing between checks
+REFRESH_INTERVAL_HOURS = float(os.getenv("REFRESH_INTERVAL_HOURS", 24))
+
+MIN_INTERVAL = datetime.timedelta(hours=6)
+MAX_INTERVAL = datetime.timedelta(days=14)
+# Listings younger than this are unlikely to have been let yet, and older than this are likely to have been
+NEW_LISTING_AGE = datetime.timedelta(days=2)
+STALE_LISTING_AGE = datetime.timedelta(days=21)
+# Cheaper listings are let faster
+CHEAP_PRICE = 500
+EXPENSIVE_PRICE = 1000
+
+
+def next_interval(age: datetime.timedelta, price: int, checks: int, changes: int) -> datetime.timedelta:
+    """
+    Works out how long to leave a listing before checking it again.
+
+    :param age: How long the listing has been known about.
+    :param price: Current weekly price of the listing.
+    :param checks: How many times the listing has been checked.
+    :param changes: How many of those checks found a change.
+    :return: Time until the listing is next due.
+    """
+    factor = 1.0
+    if age < NEW_LISTING_AGE:
+        factor *= 3
+    elif age > STALE_LISTING_AGE:
+        factor *= 0.5
+
+    if price < CHEAP_PRICE:
+        factor *= 0.75
+    elif price > EXPENSIVE_PRICE:
+        factor *= 1.5
+
+    # Smoothed so a listing with no history is treated as changing on half of its checks
+    change_rate = (changes + 1) / (checks + 2)
+    factor *= 0.5 / change_rate
+
+    interval = datetime.timedelta(hours=REFRESH_INTERVAL_HOURS * factor)
+    return min(max(interval, MIN_INTERVAL), MAX_INTERVAL)
+
+
+class RefreshScheduler:
+    """
+    Decides which listings get checked for changes each run. At the start of a run the most overdue listings are
+    planned, up to the budget, and each query then takes the planned listings in its range. Listings that have never
+    been checked come first.
+    """
+
+    def __init__(self, budget: int = REFRESH_BUDGET) -> None:
+        self.budget = budget
+        self._planned: Set[str] = set()
+        self._lock = Lock()
+
+    def plan(self) -> Set[str]:
+        """
+        Picks the listings to check this run.
+
+        :return: The IDs of the listings picked.
+        """
+        now = datetime.datetime.now()
+        due = (
+            SimpleListing.select(SimpleListing.id)
+            .join(ListingCheck, JOIN.LEFT_OUTER, on=(ListingCheck.listing == SimpleListing.id))
+            .where(SimpleListing.available, ListingCheck.next_check.is_null() | (ListingCheck.next_check <= now))
+            .order_by(ListingCheck.next_check.asc(nulls="first"), SimpleListing.id)
+            .limit(self.budget)
+        )
+        self._planned = {listing_id for listing_id, in due.tuples()}
+        logger.info(f"Refresh: {len(self._planned)} listings due to be checked")
+        return set(self._planned)
+
+    def restore(self, listing_ids: Set[str]) -> None:
+        """
+        Picks up the listings an interrupted run planned to check but didn't, instead of planning afresh.
+
+        :param listing_ids: IDs of the listings left to check.
+        """
+        self._planned = set(listing_ids)
+        logger.info(f"Refresh: {len(self._planned)} listings still to be checked")
+
+    def take(self, listings: ModelSelect) -> List[SimpleListing]:
+        """
+        Takes the planned listings from a selection of listings, so they are only checked once.
+
+        :param listings: Selection of listings e.g. those in a query's range.
+        :return: The planned listings among them.
+        """
+        with self._lock:
+            planned = list(self._planned)
+        if not planned:
+            return []
+        due = list(listings.where(SimpleListing.id << planned))
+        with self._lock:
+            # Only keep the ones no other range took in the meantime
+            due = [listing for listing in due if listing.id in self._planned]
+            self._planned.difference_update(listing.id for listing in due)
+        return due
+
+    async def refresh(self, site: Site, listing: SimpleListing, engine: AsyncEngine) -> bool:
+        """
+        Checks a listing for changes and schedules its next check.
+
+        :return: True if the listing changed.
+        """
+        with metrics.timer("refresh"):
+            changed = await site.update_listing_async(listing, engine)
+        metrics.increment("refresh.changed" if changed else "refresh.unchanged")
+        await asyncio.to_thread(self.record, listing.id, listing.price, changed)
+        return changed
+
+    @connection()
+    def record(self, listing_id: str, price: int, changed: bool) -> None:
+        """
+        Records that a listing was checked and works out when it is next due.
+
+        :param listing_id:
+        :param price: Price of the listing after the check.
+        :param changed: Whether the check found a change.
+        """
+        now = datetime.datetime.now()
+        check = ListingCheck.get_or_none(ListingCheck.listing == listing_id)
+        if check is None:
+            first_seen = (
+                ListingHistory.select(fn.MIN(ListingHistory.valid_from))
+                .where(ListingHistory.listing == listing_id)
+                .scalar()
+            )
+            check = ListingCheck(listing=listing_id, first_seen=first_seen or now)
+            insert = True
+        else:
+            insert = False
+
+        check.checks += 1
+        check.changes += int(changed)
+        check.last_checked = now
+        check.next_check = now + next_interval(now - check.first_seen, price, check.checks, check.changes)
+        check.save(force_insert=insert)
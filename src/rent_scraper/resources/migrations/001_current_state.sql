@@ -0,0 +1,125 @@
+-- =====================================================
+-- Keep the current state of each listing and address in its own table, rather than finding the latest history row with
+-- ROW_NUMBER() every time the views are read. The state tables are kept in sync by triggers on the history tables, so
+-- they stay correct however the history is written, including through the INSTEAD OF triggers on the views.
+-- =====================================================
+
+LOCK TABLE listinghistory, addresshistory IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE TABLE listingstate
+(
+    listing_id TEXT PRIMARY KEY REFERENCES listing (id) ON DELETE CASCADE,
+    price      INTEGER NOT NULL,
+    available  BOOLEAN NOT NULL
+);
+
+INSERT INTO listingstate (listing_id, price, available)
+SELECT DISTINCT ON (listing_id) listing_id, price, valid_until IS NULL
+FROM listinghistory
+ORDER BY listing_id, valid_from DESC;
+
+-- Covers the price range searches, which only ever look at available listings
+CREATE INDEX idx_listingstate_available_price ON listingstate (available, price) INCLUDE (listing_id);
+
+CREATE OR REPLACE FUNCTION refresh_listing_state()
+    RETURNS TRIGGER AS
+$$
+DECLARE
+    target TEXT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        target := OLD.listing_id;
+    ELSE
+        target := NEW.listing_id;
+    END IF;
+
+    INSERT INTO listingstate (listing_id, price, available)
+    SELECT listing_id, price, valid_until IS NULL
+    FROM listinghistory
+    WHERE listing_id = target
+    ORDER BY valid_from DESC
+    LIMIT 1
+    ON CONFLICT (listing_id) DO UPDATE SET price = EXCLUDED.price, available = EXCLUDED.available;
+
+    IF NOT FOUND THEN
+--      All the history has been deleted
+        DELETE FROM listingstate WHERE listing_id = target;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER sync_listing_state
+    AFTER INSERT OR UPDATE OR DELETE
+    ON listinghistory
+    FOR EACH ROW
+EXECUTE FUNCTION refresh_listing_state();
+
+CREATE OR REPLACE VIEW public.simplelistingview(id, address_id, price, available) AS
+SELECT l.id,
+       l.address_id,
+       ls.price,
+       ls.available
+FROM listing l
+         JOIN listingstate ls ON ls.listing_id = l.id;
+
+-- =====================================================
+-- Same as above but with addresses instead
+-- =====================================================
+
+CREATE TABLE addressstate
+(
+    address_id INTEGER PRIMARY KEY REFERENCES address (id) ON DELETE CASCADE,
+    beds       INTEGER NOT NULL,
+    baths      INTEGER NOT NULL,
+    cars       INTEGER NOT NULL
+);
+
+INSERT INTO addressstate (address_id, beds, baths, cars)
+SELECT DISTINCT ON (address_id) address_id, beds, baths, cars
+FROM addresshistory
+ORDER BY address_id, valid_from DESC;
+
+CREATE INDEX idx_addressstate_beds ON addressstate (beds) INCLUDE (address_id);
+
+CREATE OR REPLACE FUNCTION refresh_address_state()
+    RETURNS TRIGGER AS
+$$
+DECLARE
+    target INTEGER;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        target := OLD.address_id;
+    ELSE
+        target := NEW.address_id;
+    END IF;
+
+    INSERT INTO addressstate (address_id, beds, baths, cars)
+    SELECT address_id, beds, baths, cars
+    FROM addresshistory
+    WHERE address_id = target
+    ORDER BY valid_from DESC
+    LIMIT 1
+    ON CONFLICT (address_id) DO UPDATE SET beds = EXCLUDED.beds, baths = EXCLUDED.baths, cars = EXCLUDED.cars;
+
+    IF NOT FOUND THEN
+        DELETE FROM addressstate WHERE address_id = target;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER sync_address_state
+    AFTER INSERT OR UPDATE OR DELETE
+    ON addresshistory
+    FOR EACH ROW
+EXECUTE FUNCTION refresh_address_state();
+
+CREATE OR REPLACE VIEW public.simpleaddressview(id, address, beds, baths, cars) AS
+SELECT a.id,
+       a.address,
+       ads.beds,
+       ads.baths,
+       ads.cars
+FROM address a
+         JOIN addressstate ads ON ads.address_id = a.id;
@@ -0,0 +1,8 @@
+-- =====================================================
+-- The last count the site gave for each range, used by the range planner to tell when a range needs splitting or
+-- merging without probing it again
+-- =====================================================
+
+ALTER TABLE query
+    ADD COLUMN IF NOT EXISTS listing_count INTEGER,
+    ADD COLUMN IF NOT EXISTS counted_at    TIMESTAMP;
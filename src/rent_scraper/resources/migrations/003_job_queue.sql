@@ -0,0 +1,9 @@
+-- =====================================================
+-- Indexes for the job queue. Only one unfinished job can exist for the same piece of work, so enqueueing it again
+-- while it is still pending or leased does nothing.
+-- =====================================================
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_job_unfinished ON job (kind, key) WHERE status IN ('pending', 'leased');
+
+-- Covers claiming, which looks for the oldest available job of a kind
+CREATE INDEX IF NOT EXISTS idx_job_claim ON job (kind, status, available_at);
@@ -0,0 +1,10 @@
+-- =====================================================
+-- Normalised form of each address, so the same address written two ways is only stored once and can be found by an
+-- index lookup. Existing addresses are given their key, and any duplicates merged, by dedupe_addresses, which migrate
+-- runs after this.
+-- =====================================================
+
+ALTER TABLE address
+    ADD COLUMN IF NOT EXISTS key TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_address_key ON address (key);
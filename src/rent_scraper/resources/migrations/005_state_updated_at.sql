@@ -0,0 +1,73 @@
+-- =====================================================
+-- When the current state of each listing and address last changed, so processes that keep the state in memory can
+-- read just what has changed since they last looked, rather than every listing.
+-- =====================================================
+
+ALTER TABLE listingstate
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT clock_timestamp();
+
+ALTER TABLE addressstate
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT clock_timestamp();
+
+CREATE INDEX IF NOT EXISTS idx_listingstate_updated_at ON listingstate (updated_at);
+CREATE INDEX IF NOT EXISTS idx_addressstate_updated_at ON addressstate (updated_at);
+
+CREATE OR REPLACE FUNCTION refresh_listing_state()
+    RETURNS TRIGGER AS
+$$
+DECLARE
+    target TEXT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        target := OLD.listing_id;
+    ELSE
+        target := NEW.listing_id;
+    END IF;
+
+    INSERT INTO listingstate (listing_id, price, available)
+    SELECT listing_id, price, valid_until IS NULL
+    FROM listinghistory
+    WHERE listing_id = target
+    ORDER BY valid_from DESC
+    LIMIT 1
+    ON CONFLICT (listing_id) DO UPDATE SET price      = EXCLUDED.price,
+                                           available  = EXCLUDED.available,
+                                           updated_at = clock_timestamp();
+
+    IF NOT FOUND THEN
+--      All the history has been deleted
+        DELETE FROM listingstate WHERE listing_id = target;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION refresh_address_state()
+    RETURNS TRIGGER AS
+$$
+DECLARE
+    target INTEGER;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        target := OLD.address_id;
+    ELSE
+        target := NEW.address_id;
+    END IF;
+
+    INSERT INTO addressstate (address_id, beds, baths, cars)
+    SELECT address_id, beds, baths, cars
+    FROM addresshistory
+    WHERE address_id = target
+    ORDER BY valid_from DESC
+    LIMIT 1
+    ON CONFLICT (address_id) DO UPDATE SET beds       = EXCLUDED.beds,
+                                           baths      = EXCLUDED.baths,
+                                           cars       = EXCLUDED.cars,
+                                           updated_at = clock_timestamp();
+
+    IF NOT FOUND THEN
+        DELETE FROM addressstate WHERE address_id = target;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -1,71 +1,319 @@
-import json
+import contextvars
+import dataclasses
+import datetime
 import os
 import re
-from concurrent.futures import ThreadPoolExecutor
-from pathlib import Path
-from typing import Tuple, List, Callable
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from threading import Lock
+from typing import Tuple, List, Callable, Dict, Iterable, Set
 
-from selenium.common import TimeoutException
+from peewee import ModelSelect
+from selenium.common import TimeoutException, WebDriverException
 from selenium.webdriver.support.wait import WebDriverWait
 from tqdm import tqdm
 
+from rent_scraper.checkpoint import Checkpoint
+from rent_scraper.engine import AsyncEngine
+from rent_scraper.geocoding import geocoder
+from rent_scraper.known_listings import known_listings
 from rent_scraper.logger import logger, configure_logging
-from rent_scraper.model import Listing, Query, Address, SimpleListing, SimpleAddress
+from rent_scraper.metrics import metrics
+from rent_scraper.model import db, connection, Listing, Query, Address, SimpleListing, SimpleAddress, init_db
+from rent_scraper.persistence import close_listings, save_changes
+from rent_scraper.range_planner import RangePlanner
+from rent_scraper.refresh import RefreshScheduler
 from rent_scraper.sites.domain import Domain
-from rent_scraper.util import THREADS, provide_browser
+from rent_scraper.util import THREADS, provide_browser, pool, resolve_profile
 
-RANGE_FILE = Path(__file__).parent / "resources" / "ranges.json"
+# Listings that go missing from a sweep within this fraction of their price of either end of the range could have
+# moved to a neighbouring range, so they are checked rather than closed
+BOUNDARY_MARGIN = 0.1
+
+# Number of ranges swept at once
+RANGE_WORKERS = int(os.getenv("RANGE_WORKERS", THREADS))
+
+# Browser profile addresses are looked up on Google Maps with. Maps only puts the coordinates in the URL once its own
+# scripts have run, so by default nothing is blocked.
+MAPS_PROFILE = resolve_profile(os.getenv("MAPS_BROWSER_PROFILE", "full"))
 
 domain = Domain()
 
 
 def search():
     """
-    Get a range.
-    Check availability of each listing in this range (?)
+    Sweeps every range, several at a time. For each range:
+    Check availability of the listings in this range that are due a check.
     Check count of range and compare against expected.
     Begin searching range until count matches expectations.
-    Repeat ad infinitum
+    Addresses of the listings found are geocoded in the background while the other ranges carry on.
+
+    Progress is checkpointed as it goes, so if the last run was interrupted, this one carries on where it stopped.
     """
 
     configure_logging()
-    ranges = get_ranges()
-
-    for query in tqdm(ranges, desc="Queries", unit="query"):
-        logger.info(f"Starting query: {query}")
-        get_available = get_query_function(query)
-
-        listings = set(get_available())
-        with ThreadPoolExecutor(max_workers=THREADS) as executor:
-            list(tqdm(executor.map(domain.update_listing, listings), total=len(listings), desc="Updating", leave=False))
-
-        listings = set(get_available())
-        expected_count = len(listings)
-        with provide_browser() as browser:
-            true_count = domain.get_listing_count(query, browser)
-            if expected_count > true_count:
-                logger.error(
-                    f"Beds {query.beds}: {query.lower_price} - {query.upper_price} was expecting {expected_count} but found {true_count}"
-                )
-                return
-
-            page = 1
-            on_page = {None}
-            progress = tqdm(total=true_count // 20, desc="Searching listings", leave=False)
+    init_db()
+    checkpoint = Checkpoint.start()
+    ranges = RangePlanner(domain).plan()
+    engine = AsyncEngine()
+    known_listings.load()
+    scheduler = RefreshScheduler()
+    checkpoint.plan_refresh(scheduler)
+    done = checkpoint.done()
+    reconciler = Reconciler()
+
+    geocoding = set()
+    geocoding_lock = Lock()
+
+    @connection()
+    def sweep(query: Query, geocoder: ThreadPoolExecutor) -> None:
+        listings = sweep_range(query, engine, scheduler, checkpoint, reconciler)
+        geocode(query, Address.select().join(Listing).where(Listing.id << list(listings)), geocoder)
+
+    def geocode(query: Query, addresses: ModelSelect, geocoder: ThreadPoolExecutor) -> None:
+        addresses = list(addresses.where(Address.latitude.is_null()))
+        with geocoding_lock:
+            # Several listings can share an address, possibly in different ranges
+            addresses = [address for address in addresses if address.id not in geocoding]
+            geocoding.update(address.id for address in addresses)
+        for address in addresses:
+            # Geocoding is counted against the range that found the address
+            with metrics.query(query):
+                context = contextvars.copy_context()
+            geocoder.submit(context.run, populate_coordinates, address).add_done_callback(log_failure)
+
+    with (
+        ThreadPoolExecutor(max_workers=max(THREADS, 1), thread_name_prefix="geocode") as geocoder,
+        ThreadPoolExecutor(max_workers=max(RANGE_WORKERS, 1), thread_name_prefix="range") as executor,
+    ):
+        for query in ranges:
+            if query.id in done:
+                # Addresses found before the run was interrupted may not have been geocoded
+                in_range = get_query_function(query)().select(SimpleListing.address)
+                geocode(query, Address.select().where(Address.id << in_range), geocoder)
+        futures = {executor.submit(sweep, query, geocoder): query for query in ranges if query.id not in done}
+        failed = 0
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Queries", unit="query"):
             try:
-                while true_count != len(listings) and len(on_page) != 0:
-                    on_page = set(domain.get_page(page, query, browser))
-                    listings.update(on_page)
-                    page += 1
-                    progress.update()
-            except TimeoutException:
-                logger.warn(f"{query} timed out on page {page}. Skipping the rest of the query for now...")
-            progress.close()
+                future.result()
+            except Exception as e:
+                failed += 1
+                logger.error(f"{futures[future]}: {type(e).__name__}: {e}")
+        logger.info(f"Finishing geocoding of {len(geocoding)} addresses")
+
+    if failed:
+        # Left unfinished, so the next run picks up the ranges that failed rather than starting again. Nothing is
+        # closed, as the listings missing from one range could be in a range that failed.
+        logger.warning(f"Checkpoint: {failed} ranges failed, leaving the run to be resumed")
+    else:
+        # Ranges swept before the run was resumed weren't seen here, so only what was on their pages is known
+        ambiguous = reconciler.finish(checkpoint.seen(), every_range=not done)
+        refresh(
+            engine,
+            scheduler,
+            SimpleListing.select().where(SimpleListing.id << ambiguous, SimpleListing.available) if ambiguous else [],
+        )
+        checkpoint.finish()
+    engine.close()
+    logger.info(f"Browser pool: {pool.stats()}")
+    metrics.write({"browser_pool": dataclasses.asdict(pool.stats()), "db_pool": db.stats()})
+
+
+def sweep_range(
+    query: Query,
+    engine: AsyncEngine,
+    scheduler: RefreshScheduler,
+    checkpoint: Checkpoint | None = None,
+    reconciler: "Reconciler | None" = None,
+) -> Set[str]:
+    """
+    Brings a single range up to date.
+
+    :param query: The range to sweep.
+    :param engine: Engine to fetch pages on.
+    :param scheduler: Scheduler that decides which listings in the range are checked for changes.
+    :param checkpoint: Where to record progress, and resume from if the range was part way through.
+    :param reconciler: Where to record which listings were missing from the range, to be closed at the end of the run.
+    :return: The IDs of the listings in the range.
+    """
+    with metrics.query(query), metrics.timer("sweep"):
+        return _sweep_range(query, engine, scheduler, checkpoint, reconciler)
+
+
+def _sweep_range(
+    query: Query,
+    engine: AsyncEngine,
+    scheduler: RefreshScheduler,
+    checkpoint: Checkpoint | None,
+    reconciler: "Reconciler | None",
+) -> Set[str]:
+    logger.info(f"Starting query: {query}")
+    get_available = get_query_function(query)
+
+    refresh(engine, scheduler, scheduler.take(get_available()), checkpoint)
+
+    true_count = domain.count_listings(query)
+    query.listing_count = true_count
+    query.counted_at = datetime.datetime.now()
+    query.save()
+
+    # Prices at the start, to tell whether the listings on a page have changed since the last sweep
+    start_prices = known_listings.in_range(query)
+    listings = set(start_prices)
+    if len(listings) > true_count:
+        # Some of the listings we have must have gone, which a full sweep will find
+        logger.info(f"{query}: Expecting {len(listings)} but found {true_count}, sweeping the whole range")
+
+    page, seen = checkpoint.progress(query) if checkpoint is not None else (0, set())
+    if page:
+        logger.info(f"{query}: Resuming from page {page + 1}")
+    listings.update(seen)
+    page += 1
+    complete = False
+    stopped_early = False
+    try:
+        # The first page is loaded even when the count is what we expect, as a listing that has gone and a new one in
+        # its place leave the count the same. The watermark decides whether the rest can be skipped.
+        while True:
+            on_page = engine.run(domain.get_page_async(page, query, engine))
+            seen.update(listing.id for listing in on_page)
+            listings.update(listing.id for listing in on_page)
+            if checkpoint is not None:
+                checkpoint.save_page(query, page, [listing.id for listing in on_page])
+            page += 1
+            # Every listing the site has in the range has been on a page
+            if len(seen) >= true_count:
+                complete = True
+                break
+            if not on_page:
+                # Listings are missing, either because their cards couldn't be read or because they left the range
+                # while it was being swept, so the sweep isn't recorded as complete for the watermark to trust
+                logger.info(f"{query}: Only found {len(seen)} of {true_count} listings by page {page - 1}")
+                break
+            if watermark_reached(query, on_page, start_prices, true_count - len(listings)):
+                logger.info(f"{query}: Nothing changed past page {page - 1} since {query.swept_at}, stopping early")
+                stopped_early = True
+                break
+    except TimeoutException:
+        logger.warn(f"{query} timed out on page {page}. Skipping the rest of the query for now...")
+
+    if reconciler is not None:
+        reconciler.swept(query, start_prices, seen, complete and len(seen) == true_count, complete or stopped_early)
+
+    if complete:
+        query.swept_at = datetime.datetime.now()
+        query.swept_count = true_count
+        query.found_count = len(listings)
+        query.save()
+    if checkpoint is not None:
+        checkpoint.range_done(query)
+    return listings
+
+
+def refresh(
+    engine: AsyncEngine,
+    scheduler: RefreshScheduler,
+    listings: Iterable[SimpleListing],
+    checkpoint: Checkpoint | None = None,
+) -> None:
+    # Changes are made to the listings in memory, so they have to be the same objects when they're saved
+    listings = list(listings)
+    engine.run(engine.map(lambda listing: scheduler.refresh(domain, listing, engine), listings, desc="Updating"))
+    save_changes(listings)
+    if checkpoint is not None:
+        checkpoint.refreshed(listing.id for listing in listings)
+
+
+def log_failure(future: Future) -> None:
+    if (e := future.exception()) is not None:
+        logger.error(f"{type(e).__name__}: {e}")
+
+
+def watermark_reached(
+    query: Query, on_page: List[SimpleListing], start_prices: Dict[str, int], missing_count: int
+) -> bool:
+    """
+    Checks whether the rest of a range can be skipped. Pages are sorted by when listings were last updated, so once a
+    page only has listings that were already in the range with the same price, the following pages haven't changed
+    either. This is only trusted if the count is off by the same amount as at the end of the last complete sweep,
+    otherwise something has changed that we haven't found yet.
+
+    :param query: The range being searched.
+    :param on_page: Listings on the latest page.
+    :param start_prices: Prices of the listings in the range before the search started.
+    :param missing_count: How many listings the site has in the range that we don't.
+    :return: True if searching can stop.
+    """
+    if query.swept_at is None:
+        return False
+    if any(start_prices.get(listing.id) != listing.price for listing in on_page):
+        return False
+    return missing_count == query.swept_count - query.found_count
+
 
-        listing_ids = [x.id for x in listings]
-        addresses = list(Address.select().join(Listing).where(Listing.id << listing_ids, Address.latitude.is_null()))
-        with ThreadPoolExecutor(max_workers=THREADS) as executor:
-            list(tqdm(executor.map(populate_coordinates, addresses), total=len(addresses), desc="Mapping", leave=False))
+class Reconciler:
+    """
+    Closes the listings that have gone, once every range has been swept. A listing missing from the range it is indexed
+    in isn't necessarily gone: it can have changed price into another range, or be listed with a different number of
+    beds than the one stored for its address, which is shared by every listing there. So only listings missing from
+    every range of the run are taken to be gone.
+    """
+
+    def __init__(self) -> None:
+        # Listings missing from a range that was seen in full, and the range they were missing from
+        self._missing: Dict[str, Tuple[Query, int]] = {}
+        self._seen: Set[str] = set()
+        self._every_range_seen = True
+        self._lock = Lock()
+
+    def swept(
+        self, query: Query, start_prices: Dict[str, int], seen: Set[str], complete: bool, covered: bool | None = None
+    ) -> None:
+        """
+        :param query: The range that was swept.
+        :param start_prices: Prices of the listings in the range before the sweep started.
+        :param seen: IDs of the listings that were on the pages of the sweep.
+        :param complete: Whether every listing the site has in the range was seen, so that any missing have gone.
+        :param covered: Whether the range can be trusted not to hide listings missing from other ranges. Defaults to
+        complete. A range that stopped early at its watermark is covered, as the pages it skipped have the same
+        listings as at its last complete sweep, while one that timed out or ran out of pages isn't.
+        """
+        with self._lock:
+            self._seen.update(seen)
+            if not (complete if covered is None else covered):
+                self._every_range_seen = False
+            if not complete:
+                return
+            for listing_id, price in start_prices.items():
+                if listing_id not in seen:
+                    self._missing[listing_id] = (query, price)
+
+    def finish(self, seen_elsewhere: Iterable[str] = (), every_range: bool = True) -> List[str]:
+        """
+        Closes the listings that weren't seen in any range. Listings priced close to either end of their range might
+        have changed price into a neighbouring range after it was swept, so those are left to be checked individually.
+        If any range wasn't covered, a listing could be somewhere that wasn't looked at, so none are closed and they
+        are all left to be checked.
+
+        :param seen_elsewhere: IDs of listings seen in ranges that weren't swept here, e.g. before a run was resumed.
+        :param every_range: Whether every range of the run was swept here.
+        :return: The IDs of the listings that still need checking.
+        """
+        seen = self._seen.union(seen_elsewhere)
+        closed, ambiguous = [], []
+        for listing_id, (query, price) in self._missing.items():
+            if listing_id in seen:
+                continue
+            margin = price * BOUNDARY_MARGIN
+            near_boundary = price - query.lower_price <= margin or query.upper_price - price <= margin
+            if near_boundary or not every_range or not self._every_range_seen:
+                ambiguous.append(listing_id)
+            else:
+                closed.append(listing_id)
+
+        if closed or ambiguous:
+            close_listings(closed)
+            logger.info(f"Closed {len(closed)} listings that have gone, {len(ambiguous)} need checking")
+        return ambiguous
 
 
 def get_query_function(query: Query) -> Callable:
@@ -87,90 +335,44 @@ def get_query_function(query: Query) -> Callable:
 
 
 def populate_coordinates(address: Address):
-    lat, lon = coords_from_maps(address)
-
-    if lat is None or lon is None:
-        pass
-    elif lon < 110 or lon > 155 or lat < -45 or lat > -10:
-        # Outside bounding box for Australia
-        lat = None
-        lon = None
+    # The geocoder only holds a connection while it uses the database, rather than for the whole lookup on Maps
+    try:
+        lat, lon = geocoder.lookup(address.address, coords_from_maps, source="google maps")
+    except WebDriverException as e:
+        # Left without coordinates to be tried again next time
+        logger.error(f"Google Maps: Lookup failed for {address.address}: {type(e).__name__}")
+        return
 
     address.latitude = lat
     address.longitude = lon
     address.updated = True
 
-    address.save()
+    with connection():
+        address.save()
 
 
-def coords_from_maps(address: Address) -> tuple[float, float]:
-    address_str = address.address
+def coords_from_maps(address_str: str) -> tuple[float, float] | tuple[None, None]:
     if "/" in address_str:
         address_str = address_str[address_str.index("/") + 1 :]
     address_str = address_str.replace(" ", "+")
 
     whole_url_match = re.compile(r"^.+-\d{2}\.\d+,\d{3}\.\d+.+$")
-    try:
-        with provide_browser() as browser:
-            browser.get("https://www.google.com/maps/place/" + address_str)
+    with provide_browser(MAPS_PROFILE) as browser:
+        browser.get("https://www.google.com/maps/place/" + address_str)
+        try:
             WebDriverWait(browser, 10).until(lambda browser: re.match(whole_url_match, browser.current_url))
-            if "place//" in browser.current_url:
-                # Failed to find an actual address, will deal with them later
-                raise TimeoutException
-            matches = re.findall(r"-\d{2}\.\d+,\d{3}\.\d+", browser.current_url)
-        coords = matches[0]
-        lat, lon = coords.split(",")
-        return float(lat), float(lon)
-    except TimeoutException:
-        logger.error(f"Google Maps: Could not find any coordinates for {address.address}")
-        return None, None
-
-
-def get_ranges() -> List[Query]:
-    if os.path.exists(RANGE_FILE):
-        # Return ranges from file if they exist
-        with open(RANGE_FILE) as f:
-            serialised = json.load(f)
-            queries = []
-            for q in serialised:
-                queries.append(Query(**q))
-            return queries
-    logger.info("Finding ranges")
-
-    bed_searches = ["0", "1", "2", "3", "4", "5-any"]
-    good_ranges = {x: [] for x in bed_searches}
-
-    with provide_browser() as browser:
-        for beds in bed_searches:
-            range_stack = [(0, 50000)]
-
-            while range_stack:
-                cur_range = range_stack.pop()
-                count = domain.get_listing_count(
-                    Query(lower_price=cur_range[0], upper_price=cur_range[1], beds=beds), browser
-                )
-                if count > 1000:
-                    range_stack.extend(bisect(cur_range))
-                else:
-                    good_ranges[beds].append(cur_range)
-
-    queries = []
-    with open(RANGE_FILE, "w+") as f:
-        serialised = []
-        for beds in good_ranges:
-            for cur_range in good_ranges[beds]:
-                query = Query(lower_price=cur_range[0], upper_price=cur_range[1], beds=beds)
-                serialised.append(query.__dict__["__data__"])
-                queries.append(query)
-        json.dump(serialised, f)
-
-    logger.info(f"Found {len(queries)} ranges")
-    return queries
-
-
-def bisect(cur_range: Tuple[int, int]) -> List[Tuple[int, int]]:
-    midpoint = (cur_range[0] + cur_range[1]) // 2
-    return [(cur_range[0], midpoint), (midpoint, cur_range[1])]
+        except TimeoutException:
+            # Maps never settled on a place, so it doesn't know the address. Returned rather than raised, so that
+            # it's cached as not found instead of being retried every run as if the browser had failed.
+            logger.warning(f"Google Maps: Could not find any coordinates for {address_str}")
+            return None, None
+        if "place//" in browser.current_url:
+            logger.warning(f"Google Maps: Could not find any coordinates for {address_str}")
+            return None, None
+        matches = re.findall(r"-\d{2}\.\d+,\d{3}\.\d+", browser.current_url)
+    coords = matches[0]
+    lat, lon = coords.split(",")
+    return float(lat), float(lon)
 
 
 if __name__ == "__main__":
@@ -1,100 +1,314 @@
-import datetime
+import asyncio
+import json
+import os
 import re
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 from bs4 import BeautifulSoup, Tag
 from selenium import webdriver
-from selenium.common import NoSuchElementException
+from selenium.common import NoSuchElementException, TimeoutException
 from selenium.webdriver.chrome.webdriver import WebDriver
 from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.wait import WebDriverWait
 
+from rent_scraper.browser_pool import ReplayMiss, check_replay
+from rent_scraper.engine import AsyncEngine
+from rent_scraper.known_listings import known_listings
 from rent_scraper.logger import logger
-from rent_scraper.model import Listing, Address, Query, SimpleListing, AddressHistory, ListingHistory
+from rent_scraper.metrics import metrics
+from rent_scraper.model import connection, Listing, Query, SimpleListing
+from rent_scraper.page_cache import page_cache
+from rent_scraper.parsing import Keep, parse
+from rent_scraper.persistence import save_changes, save_listings, get_listings
 from rent_scraper.sites.site import Site
-from rent_scraper.util import provide_browser, THREADS
-
-PARSER = "html.parser"
+from rent_scraper.util import BROWSER_WAIT, provide_browser, fetch, Page
+
+# Where the site is fetched from, which can be pointed at a stand-in for benchmarking
+DOMAIN_URL = os.getenv("DOMAIN_URL", "https://www.domain.com.au").rstrip("/")
+
+# Only the result count and the listing cards are read from search pages, so the rest of the page isn't parsed
+SEARCH_PAGE = Keep(
+    re.compile(r"^(summary|listing-(?!card-).+)$"),
+    'h1[data-testid="summary"], [data-testid^="listing-"]:not([data-testid^="listing-card-"])',
+)
+
+PRICE_SELECTOR = 'div[data-testid="listing-details__listing-summary-title-name"]'
+FEATURES_SELECTOR = 'div[data-testid="property-features-wrapper"]'
+FEATURE_SELECTOR = 'span[data-testid="property-features-feature"]'
+LISTING_TAG_SELECTOR = 'span[data-testid="listing-details__listing-tag"]'
+CARD_PRICE_SELECTOR = 'p[data-testid="listing-card-price"]'
+CARD_ADDRESS_SELECTOR = 'h2[data-testid="address-wrapper"]'
+SUMMARY_SELECTOR = 'h1[data-testid="summary"]'
+# Found in the HTML of any search results page, to tell them apart from block or challenge pages without parsing them
+SUMMARY_MARKER = 'data-testid="summary"'
+# The data Next.js embeds in the page for the client to hydrate from, which has the details even if the markup changes
+NEXT_DATA_SELECTOR = "script#__NEXT_DATA__"
+CARD_WRAPPER = re.compile(r"^listing-card-wrapper")
+
+# Status codes where the page returned is the real listing page (or the "not found" version of it). Anything else is
+# most likely a block or challenge page that only a real browser can get through.
+PARSEABLE_STATUS = [200, 404, 410]
+# Status codes that on their own mean the listing is gone
+NOT_FOUND_STATUS = [404, 410]
 
 
 class Domain(Site):
-    def __init__(self):
-        super().__init__()
+    http_first = True
+
+    def __init__(self, http_first: bool | None = None):
+        super().__init__(http_first)
+
+    def get_page(self, page_num: int, query: Query, browser: webdriver.Chrome) -> List[SimpleListing]:
+        html = self._load(self._get_search_link(query, page_num), browser)
+        with metrics.timer("parse.search"):
+            cards = self._cards_from_soup(parse(html, SEARCH_PAGE))
+        unchanged, cards = self._skip_unchanged(cards)
+
+        known = get_listings([listing_id for listing_id, _ in cards])
+        # We're done with the search page, so the same browser can be used for any listings that need their page loaded
+        fetched = {
+            listing_id: self._listing_details(listing_id, browser)
+            for listing_id, details in cards
+            if listing_id not in known and details is None
+        }
+
+        return unchanged + self._save_cards(cards, known, fetched)
+
+    async def get_page_async(self, page_num: int, query: Query, engine: AsyncEngine) -> List[SimpleListing]:
+        page = await engine.fetch(self._get_search_link(query, page_num))
+        cards = await engine.parse(self._cards_from_page, page)
+        if cards is None:
+            # Search pages can't be read without a browser, which blocks, so keep it off the event loop
+            logger.debug(f"{query} - HTTP: Could not read page {page_num}, falling back to browser")
+            return await asyncio.to_thread(self._get_page_with_browser, page_num, query)
+        unchanged, cards = self._skip_unchanged(cards)
+
+        known = await asyncio.to_thread(get_listings, [listing_id for listing_id, _ in cards])
+        incomplete = [listing_id for listing_id, details in cards if listing_id not in known and details is None]
+        details = await asyncio.gather(*[self._listing_details_async(listing_id, engine) for listing_id in incomplete])
+        fetched = dict(zip(incomplete, details))
+
+        return unchanged + await asyncio.to_thread(self._save_cards, cards, known, fetched)
+
+    def _get_page_with_browser(self, page_num: int, query: Query) -> List[SimpleListing]:
+        # No connection is held while the browser loads pages, as the database calls check out their own
+        check_replay(self._get_search_link(query, page_num))
+        with provide_browser() as browser:
+            return self.get_page(page_num, query, browser)
 
-    def get_page(self, page_num: int, query: Query, browser: webdriver.Chrome) -> List[Listing]:
-        listings = []
+    @staticmethod
+    def _skip_unchanged(
+        cards: List[Tuple[str, Dict[str, int | str] | None]],
+    ) -> Tuple[List[SimpleListing], List[Tuple[str, Dict[str, int | str] | None]]]:
+        """
+        Separates out the cards for listings we already know about, which still have the same price, as they don't
+        need to touch the database at all.
 
-        search_link = self._get_search_link(query, page_num)
-        browser.get(search_link)
-        soup = BeautifulSoup(browser.page_source, PARSER)
-        cards = soup.find_all(attrs={"data-testid": re.compile(r"^listing-card-wrapper")})
+        :return: Listings for the unchanged cards, and the cards that are new or have changed.
+        """
+        known_listings.load()
+        unchanged = []
+        remaining = []
+        for listing_id, details in cards:
+            if details is not None and known_listings.is_unchanged(listing_id, details["price"]):
+                unchanged.append(SimpleListing(id=listing_id, price=details["price"], available=True))
+            else:
+                remaining.append((listing_id, details))
+        return unchanged, remaining
+
+    @staticmethod
+    @connection()
+    def _save_cards(
+        cards: List[Tuple[str, Dict[str, int | str] | None]],
+        known: Dict[str, SimpleListing],
+        fetched: Dict[str, Dict[str, int | str] | None],
+    ) -> List[SimpleListing]:
+        """
+        Creates the listings on a page that don't exist yet, using the details from the listing page for any cards that
+        were incomplete, and updates the price of existing listings that have changed.
 
-        with ThreadPoolExecutor(max_workers=THREADS) as executor:
-            future_to_card = {executor.submit(self._create_listing, card): card for card in cards}
-            for future in as_completed(future_to_card):
-                result = future.result()
-                if result is not None:
-                    listings.append(result)
+        :return: All the listings from the cards.
+        """
+        new_listings = {}
+        # Existing listings that have changed, with their beds from the card
+        changed = {}
+        for listing_id, details in cards:
+            if details is None:
+                details = fetched.get(listing_id)
+            if details is None:
+                continue
+
+            if (listing := known.get(listing_id)) is None:
+                new_listings[listing_id] = details
+            elif not listing.available or listing.price != details["price"]:
+                # Being in the search results means the listing is available, whatever we last thought
+                listing.price = details["price"]
+                listing.available = True
+                changed[listing_id] = details["beds"]
+
+        save_changes([known[listing_id] for listing_id in changed])
+        for listing_id, beds in changed.items():
+            known_listings.update(listing_id, known[listing_id].price, beds, True)
+        save_listings(new_listings)
+        return list(known.values()) + list(get_listings(list(new_listings)).values())
+
+    def _cards_from_page(self, page: Page | None) -> List[Tuple[str, Dict[str, int | str] | None]] | None:
+        """
+        Reads the listing cards from a search results page fetched over HTTP.
 
-        return listings
+        :param page: The fetched page.
+        :return: A (listing_id, details) tuple for each card, or None if the page isn't a results page, or its cards
+        couldn't be read.
+        """
+        if page is None or page.status != 200:
+            return None
+        with metrics.timer("parse.search"):
+            soup = parse(page.text, SEARCH_PAGE)
+            if len(soup.find_all(attrs={"data-testid": "summary"})) == 0:
+                return None
+            cards = self._cards_from_soup(soup)
+            # The page says there are results but none were found, so the cards have probably changed their markup or
+            # are rendered by script. Reading it as empty would end the range early.
+            if not cards and (self._count_from_soup(soup) or 0) > 0:
+                logger.warning(f"No listing cards on {page.url}, though it has results")
+                return None
+            return cards
+
+    def _cards_from_soup(self, soup: BeautifulSoup) -> List[Tuple[str, Dict[str, int | str] | None]]:
+        # Details are None where the card is missing something, in which case the listing page is needed
+        return [
+            (card.parent.attrs["data-testid"][8:], self.details_from_card(card))
+            for card in soup.find_all(attrs={"data-testid": CARD_WRAPPER})
+        ]
+
+    @staticmethod
+    def _load(url: str, browser: WebDriver) -> str:
+        """
+        :return: The HTML of the page, from the page cache if it has it, otherwise loaded in the browser.
+        :raises TimeoutException: If the result count never appeared on the page, as it is then most likely a block or
+        challenge page, or hasn't finished rendering, and reading it would find no listings.
+        """
+        if page_cache is not None and (page := page_cache.get(url)) is not None and page.status == 200:
+            # A cached page without a result count would be read as having no listings, so is loaded again instead
+            if SUMMARY_MARKER in page.text:
+                return page.text
+        browser.get(url)
+        if not Domain._wait_for(browser, SUMMARY_SELECTOR):
+            raise TimeoutException(f"No result count on {url} after {BROWSER_WAIT} seconds")
+        return Domain._cache(url, browser)
+
+    @staticmethod
+    def _cache(url: str, browser: WebDriver) -> str:
+        """
+        Stores the current page in the page cache. Must only be called once what is read from the page has appeared,
+        so that a page that hadn't finished rendering, or a block page, isn't served from the cache later.
 
-    def _create_listing(self, card: Tag) -> SimpleListing | None:
-        listing_id = card.parent.attrs["data-testid"][8:]
-        if (listing := SimpleListing.get_or_none(SimpleListing.id == listing_id)) is not None:
-            return listing
+        :return: The HTML of the page.
+        """
+        html = browser.page_source
+        if page_cache is not None:
+            page_cache.put(url, Page(200, browser.current_url, html))
+        return html
 
-        with provide_browser() as browser:
-            details = self.details_from_page(browser, listing_id)
-        if details is None:
-            return None
-        address = details["address"]
-
-        if not re.search(r"\d.+\d{4}$", address):
-            # The only numbers in the address are the postcode, meaning it isn't a legit address
-            pass
-
-        if (address_obj := Address.get_or_none(address=address)) is None:
-            address_obj = Address.create(address=address)
-            AddressHistory.create(
-                address=address_obj,
-                beds=details["beds"],
-                baths=details["baths"],
-                cars=details["cars"],
-                valid_from=datetime.datetime.now(),
-            )
-            logger.debug(f"Saved new address: {address}")
+    @staticmethod
+    def _wait_for(browser: WebDriver, selector: str) -> bool:
+        """
+        Waits for an element to appear on the current page, as the browser only waits for the document to be parsed.
 
-        listing_obj = Listing.create(id=listing_id, address=address_obj)
-        ListingHistory.create(listing=listing_obj, price=details["price"], valid_from=datetime.datetime.now())
-        logger.debug(f"New listing {listing_id} created for {address}")
-        return SimpleListing.get_by_id(listing_id)
+        :param selector: CSS selector of the element.
+        :return: False if it didn't appear within BROWSER_WAIT seconds.
+        """
+        try:
+            WebDriverWait(browser, BROWSER_WAIT).until(
+                expected_conditions.presence_of_element_located((By.CSS_SELECTOR, selector))
+            )
+        except TimeoutException:
+            return False
+        return True
+
+    def _listing_details(self, listing_id: str, browser: WebDriver) -> Dict[str, int | str] | None:
+        logger.debug(f"{listing_id} - Card incomplete, loading listing page")
+        if self.http_first and (result := self.listing_from_http(listing_id)) is not None and result[1] is not None:
+            return result[1]
+        return self.details_from_page(browser, listing_id)
+
+    async def _listing_details_async(self, listing_id: str, engine: AsyncEngine) -> Dict[str, int | str] | None:
+        logger.debug(f"{listing_id} - Card incomplete, loading listing page")
+        page = await engine.fetch(self.get_listing_link(listing_id))
+        if (result := await engine.parse(self._listing_from_page, listing_id, page)) is not None and result[1]:
+            return result[1]
+        return await asyncio.to_thread(self._details_from_browser, listing_id)
+
+    def _details_from_browser(self, listing_id: str) -> Dict[str, int | str] | None:
+        self._check_replay_listing(listing_id)
+        with provide_browser() as browser:
+            return self.details_from_page(browser, listing_id)
 
     def listing_available(self, listing: Listing | SimpleListing, browser: WebDriver) -> bool:
         link = self.get_listing_link(listing.id)
         browser.get(link)
 
-        available = True
-        try:
-            # If the property page exists, the "heading" on the page will be the address, which should be in the browser title
-            tags = browser.find_elements(By.TAG_NAME, "h1")
-            assert len(tags) == 1
-            full_address = tags[0].text.replace(",", "")
-            assert full_address in browser.title.replace(",", "")
-            # Some properties will be redirected to a "property profile" page if they aren't for rent
-            assert "property-profile" not in browser.current_url
-        except AssertionError:
-            available = False
-
-        browser.implicitly_wait(0)
-        try:
-            # Sometimes the listing page still exists but has a tag indicating it is under contract or leased
-            browser.find_element(By.CSS_SELECTOR, 'span[data-testid="listing-details__listing-tag"]')
-            available = False
-        except NoSuchElementException:
-            pass
-        browser.implicitly_wait(1)
+        # Every listing page has a heading, even the "not found" page, so once it's there the page can be read
+        if self._wait_for(browser, "h1"):
+            self._cache(link, browser)
+        headings = [tag.text for tag in browser.find_elements(By.TAG_NAME, "h1")]
+        # Sometimes the listing page still exists but has a tag indicating it is under contract or leased
+        has_tag = len(browser.find_elements(By.CSS_SELECTOR, LISTING_TAG_SELECTOR)) > 0
+
+        return self._is_available(headings, browser.title, browser.current_url, has_tag)
+
+    def listing_from_http(self, listing_id: str) -> Tuple[bool, Dict[str, int | str] | None] | None:
+        """
+        Fetches a listing page over plain HTTP and reads its availability and details from the HTML, without needing a
+        browser.
+
+        :param listing_id: ID of the listing to fetch.
+        :return: A tuple (available, details), where details is None if the listing is unavailable. Returns None if
+        the page could not be fetched or parsed, in which case the browser should be used instead.
+        """
+        return self._listing_from_page(listing_id, fetch(self.get_listing_link(listing_id)))
 
-        return available
+    def _listing_from_page(self, listing_id: str, page: Page | None) -> Tuple[bool, Dict[str, int | str] | None] | None:
+        if page is None or page.status not in PARSEABLE_STATUS:
+            logger.debug(f"{listing_id} - HTTP: Unusable response, falling back to browser")
+            return None
+        if page.status in NOT_FOUND_STATUS:
+            return False, None
+
+        with metrics.timer("parse.listing"):
+            soup = parse(page.text)
+            headings = [tag.get_text(" ", strip=True) for tag in soup.find_all("h1")]
+            if soup.title is None or not self._is_listing_page(headings, soup.title.get_text()):
+                # Only trusted to say the listing is gone once it's known to be a listing page, as a block or challenge
+                # page can come back with a 200 and would otherwise close a listing that is still up
+                logger.debug(f"{listing_id} - HTTP: Not a listing page, falling back to browser")
+                return None
+
+            has_tag = soup.select_one(LISTING_TAG_SELECTOR) is not None
+            if not self._is_available(headings, soup.title.get_text(), page.url, has_tag):
+                return False, None
+
+            details = self.details_from_html(soup) or self.details_from_json(soup)
+            if details is None:
+                logger.debug(f"{listing_id} - HTTP: Could not read details, falling back to browser")
+                return None
+            return True, details
+
+    @staticmethod
+    def _is_listing_page(headings: List[str], title: str) -> bool:
+        # If the property page exists, the "heading" on the page will be the address, which should be in the page title
+        return len(headings) == 1 and headings[0].replace(",", "") in title.replace(",", "")
+
+    @staticmethod
+    def _is_available(headings: List[str], title: str, url: str, has_tag: bool) -> bool:
+        if not Domain._is_listing_page(headings, title):
+            return False
+        # Some properties will be redirected to a "property profile" page if they aren't for rent
+        if "property-profile" in url:
+            return False
+        # Sometimes the listing page still exists but has a tag indicating it is under contract or leased
+        return not has_tag
 
     def _get_search_link(self, query: Query, page_number: int) -> str:
         if query.lower_price is not None and query.upper_price is not None:
@@ -107,53 +321,116 @@ class Domain(Site):
             beds = ""
         # "ssubs" removes surrounding suburbs when the suburb is specified
         # The sort is provided to avoid being given a "featured" property at the top of the search
-        return f"https://www.domain.com.au/rent/?{price}{beds}page={page_number}&excludedeposittaken=1&ssubs=0&sort=dateupdated-desc"
+        return f"{DOMAIN_URL}/rent/?{price}{beds}page={page_number}&excludedeposittaken=1&ssubs=0&sort=dateupdated-desc"
 
     def get_listing_link(self, listing_id: str) -> str:
-        return f"https://www.domain.com.au/{listing_id}"
+        return f"{DOMAIN_URL}/{listing_id}"
 
     def page_exists(self, driver, location: str) -> bool:
-        driver.get(f"https://www.domain.com.au/rent/{location}/?excludedeposittaken=1&page=1&ssubs=0")
-        soup = BeautifulSoup(driver.page_source, PARSER)
+        driver.get(f"{DOMAIN_URL}/rent/{location}/?excludedeposittaken=1&page=1&ssubs=0")
+        self._wait_for(driver, SUMMARY_SELECTOR)
+        soup = parse(driver.page_source, SEARCH_PAGE)
         summary = soup.find_all(attrs={"data-testid": "summary"})
         return len(summary) > 0
 
     def get_listing_count(self, query: Query, browser: WebDriver) -> int:
-        link = self._get_search_link(query, 1)
-        browser.get(link)
-        count_text = browser.find_element(By.CSS_SELECTOR, 'h1[data-testid="summary"]').text
-        count = int(re.findall(r"^\d+", count_text)[0])
+        soup = parse(self._load(self._get_search_link(query, 1), browser), SEARCH_PAGE)
+        if (count := self._count_from_soup(soup)) is None:
+            raise NoSuchElementException(f"No result count on the page for {query}")
         return count
 
-    def update_listing(self, listing: SimpleListing) -> None:
+    def listing_count_from_http(self, query: Query) -> int | None:
+        page = fetch(self._get_search_link(query, 1))
+        if page is None or page.status != 200:
+            return None
+        return self._count_from_soup(parse(page.text, SEARCH_PAGE))
+
+    @staticmethod
+    def _count_from_soup(soup: BeautifulSoup) -> int | None:
+        summary = soup.select_one(SUMMARY_SELECTOR)
+        if summary is None or not (count := re.findall(r"^\d+", summary.get_text(" ", strip=True))):
+            return None
+        return int(count[0])
+
+    def update_listing(self, listing: SimpleListing) -> bool:
         """
         Updates the listing price and address details in-place.
         This takes advantage of the "history" tables to retain old details as well.
 
         :param listing:
-        :param browser:
-        :return:
+        :return: True if the listing was no longer available or any of its details changed.
+        """
+        result = self.listing_from_http(listing.id) if self.http_first else None
+        if result is None:
+            result = self._listing_from_browser(listing)
+        changed = self._apply_update(listing, *result)
+        save_changes([listing])
+        return changed
+
+    async def update_listing_async(self, listing: SimpleListing, engine: AsyncEngine) -> bool:
         """
+        Same as update_listing, but fetches the page on the engine so that many listings can be updated at once. The
+        changes are only made in memory, for save_changes to write in a batch.
+
+        :param listing:
+        :param engine:
+        :return: True if the listing was no longer available or any of its details changed.
+        """
+        result = None
+        if self.http_first:
+            page = await engine.fetch(self.get_listing_link(listing.id))
+            result = await engine.parse(self._listing_from_page, listing.id, page)
+        if result is None:
+            result = await asyncio.to_thread(self._listing_from_browser, listing)
+        return await asyncio.to_thread(self._apply_update, listing, *result)
+
+    def _listing_from_browser(self, listing: SimpleListing) -> Tuple[bool, Dict[str, int | str] | None]:
+        if page_cache is not None and (page := page_cache.get(self.get_listing_link(listing.id))) is not None:
+            # Pages loaded by a browser are cached too, so there may be no need to start one
+            if (result := self._listing_from_page(listing.id, page)) is not None:
+                return result
+        self._check_replay_listing(listing.id)
         with provide_browser() as browser:
             if not self.listing_available(listing, browser):
-                listing.available = False
-                listing.save()
-                return
-            details = self.details_from_page(browser)
+                return False, None
+            return True, self.details_from_page(browser)
+
+    def _check_replay_listing(self, listing_id: str) -> None:
+        # Listing pages are always loaded in the browser rather than read from the cache, so can't be while replaying
+        if page_cache is not None and page_cache.replay:
+            raise ReplayMiss(f"{self.get_listing_link(listing_id)} can't be read from the page cache")
+
+    @staticmethod
+    @connection()
+    def _apply_update(listing: SimpleListing, available: bool, details: Dict[str, int | str] | None) -> bool:
+        """
+        Changes the listing in memory to match what was found. Only fields that are different are set, so that
+        save_changes can tell which listings need writing.
 
+        :return: True if the listing was no longer available or any of its details changed.
+        """
+        if not available:
+            listing.available = False
+            known_listings.set_unavailable(listing.id)
+            return True
         if details is None:
-            return
+            return False
+        changed = False
         if details["price"] != listing.price:
             listing.price = details["price"]
+            changed = True
         if details["beds"] != listing.address.beds:
             listing.address.beds = details["beds"]
+            changed = True
         if details["baths"] != listing.address.baths:
             listing.address.baths = details["baths"]
+            changed = True
         if details["cars"] != listing.address.cars:
             listing.address.cars = details["cars"]
+            changed = True
 
-        listing.save()
-        listing.address.save()
+        known_listings.update(listing.id, listing.price, listing.address.beds, True)
+        return changed
 
     def details_from_page(self, browser, listing_id="") -> Dict[str, int | str] | None:
         """
@@ -167,31 +444,113 @@ class Domain(Site):
         if listing_id != "":
             browser.get(self.get_listing_link(listing_id))
 
-        details = {}
+        if not self._wait_for(browser, PRICE_SELECTOR):
+            logger.warning(f"{listing_id} returned an error")
+            return None
+        # The features can show up after the price, so are waited for too, but a listing without any is still read
+        self._wait_for(browser, FEATURES_SELECTOR)
+        if listing_id != "":
+            self._cache(self.get_listing_link(listing_id), browser)
+        with metrics.timer("parse.listing"):
+            price_text = browser.find_element(By.CSS_SELECTOR, PRICE_SELECTOR).text
+            wrappers = browser.find_elements(By.CSS_SELECTOR, FEATURES_SELECTOR)
+            features = [
+                feature.text
+                for wrapper in wrappers[:1]
+                for feature in wrapper.find_elements(By.CSS_SELECTOR, FEATURE_SELECTOR)
+            ]
+
+            tags = browser.find_elements(By.TAG_NAME, "h1")
+            assert len(tags) == 1
+            address = tags[0].text.replace("\n", " ")
+
+            return self._parse_details(price_text, features, address)
+
+    def details_from_html(self, soup: BeautifulSoup) -> Dict[str, int | str] | None:
+        """
+        Same as details_from_page, but reads from an already downloaded listing page.
+
+        :param soup: Parsed HTML of the listing page.
+        :return:
+        """
+        price = soup.select_one(PRICE_SELECTOR)
+        features_wrapper = soup.select_one(FEATURES_SELECTOR)
+        tags = soup.find_all("h1")
+        if price is None or features_wrapper is None or len(tags) != 1:
+            return None
+
+        # Join with newlines to match the text of the rendered elements that Selenium gives back
+        features = [feature.get_text("\n", strip=True) for feature in features_wrapper.select(FEATURE_SELECTOR)]
+        address = tags[0].get_text(" ", strip=True)
+
+        return self._parse_details(price.get_text(" ", strip=True), features, address)
+
+    def details_from_json(self, soup: BeautifulSoup) -> Dict[str, int | str] | None:
+        """
+        Same as details_from_html, but reads from the listing summary in the page data embedded in the listing page.
 
+        :param soup: Parsed HTML of the listing page.
+        :return: The details, or None if the page has no page data or the summary is missing any of them.
+        """
+        script = soup.select_one(NEXT_DATA_SELECTOR)
+        if script is None or script.string is None:
+            return None
         try:
-            price_text = browser.find_element(
-                By.CSS_SELECTOR, 'div[data-testid="listing-details__listing-summary-title-name"]'
-            ).text
-        except NoSuchElementException:
-            logger.warning(f"{listing_id} returned an error")
+            summary = json.loads(script.string)["props"]["pageProps"]["componentProps"]["listingSummary"]
+            price_text = summary["title"]
+            address = summary["address"]
+            features = [
+                f"{summary[key]} {label}"
+                for key, label in [("beds", "Beds"), ("baths", "Baths"), ("parking", "Parking")]
+                if summary.get(key) is not None
+            ]
+        except (ValueError, KeyError, TypeError):
+            return None
+        if not isinstance(price_text, str) or not isinstance(address, str):
+            return None
+
+        return self._parse_details(price_text, features, address)
+
+    def details_from_card(self, card: Tag) -> Dict[str, int | str] | None:
+        """
+        Reads the same details as details_from_page from a card on the search results page, which saves loading the
+        listing page itself.
+
+        :param card: The listing-card-wrapper element for the listing.
+        :return: The details, or None if the card is missing any of them.
+        """
+        price = card.select_one(CARD_PRICE_SELECTOR)
+        address = card.select_one(CARD_ADDRESS_SELECTOR)
+        features = [feature.get_text("\n", strip=True) for feature in card.select(FEATURE_SELECTOR)]
+        if price is None or address is None:
             return None
+        # A count that isn't on the card would be read as 0, so the listing page is needed instead. Cards show a count
+        # of none as "−" rather than leaving it out.
+        labels = " ".join(features).lower()
+        if "bed" not in labels or "bath" not in labels or ("car" not in labels and "park" not in labels):
+            return None
+
+        return self._parse_details(price.get_text(" ", strip=True), features, address.get_text(" ", strip=True))
+
+    @staticmethod
+    def _parse_details(price_text: str, features: List[str], address: str) -> Dict[str, int | str] | None:
+        details = {}
+
         price_list = re.findall(r"\$\d{0,2},?\d+", price_text)
         if price_list:
             price = int(price_list[0].replace(",", "").replace("$", ""))
             details["price"] = price
         else:
             return None
-        features_wrapper = browser.find_element(By.CSS_SELECTOR, 'div[data-testid="property-features-wrapper"]')
-        features = features_wrapper.find_elements(By.CSS_SELECTOR, 'span[data-testid="property-features-feature"]')
 
         for feature in features:
             try:
-                text = feature.text.lower()
+                text = feature.lower()
                 if "m²" in text or "ha" in text:
                     # We currently aren't recording area
                     continue
-                num = text.split("\n")[0]
+                # Listing pages separate the count and label with a newline, but cards can use a space
+                num = text.split()[0]
                 num = 0 if num == "−" else int(num)
                 if "bed" in text:
                     details["beds"] = num
@@ -206,8 +565,6 @@ class Domain(Site):
             if element not in details:
                 details[element] = 0
 
-        tags = browser.find_elements(By.TAG_NAME, "h1")
-        assert len(tags) == 1
-        details["address"] = tags[0].text.replace("\n", " ")
+        details["address"] = address
 
         return details
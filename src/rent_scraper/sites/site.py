@@ -1,14 +1,20 @@
 from typing import List
 
-from bs4 import Tag
 from selenium.webdriver.chrome.webdriver import WebDriver
 
+from rent_scraper.browser_pool import check_replay
+from rent_scraper.engine import AsyncEngine
 from rent_scraper.model import Listing, Query
+from rent_scraper.util import provide_browser
 
 
 class Site:
-    def __init__(self):
-        pass
+    # Whether listing pages should be fetched over plain HTTP first, only falling back to a browser when that fails
+    http_first: bool = False
+
+    def __init__(self, http_first: bool | None = None):
+        if http_first is not None:
+            self.http_first = http_first
 
     def search(self, browser, query: Query) -> List[Listing]:
         listings = []
@@ -32,15 +38,40 @@ class Site:
     def get_page(self, page_num: int, query: Query, browser) -> List[Listing]:
         raise NotImplementedError
 
-    def _create_listing(self, page_element: Tag) -> Listing:
+    async def get_page_async(self, page_num: int, query: Query, engine: AsyncEngine) -> List[Listing]:
         raise NotImplementedError
 
     def listing_available(self, listing: Listing, browser: WebDriver) -> bool:
         raise NotImplementedError
 
+    def update_listing(self, listing: Listing) -> bool:
+        raise NotImplementedError
+
+    async def update_listing_async(self, listing: Listing, engine: AsyncEngine) -> bool:
+        raise NotImplementedError
+
     def page_exists(self, driver, location: str) -> bool:
         raise NotImplementedError
 
+    def count_listings(self, query: Query) -> int:
+        """
+        Gets the number of listings found with the given query, only starting a browser if it can't be read over HTTP.
+
+        :param query: Query to search for
+        :return:
+        """
+        if self.http_first and (count := self.listing_count_from_http(query)) is not None:
+            return count
+        check_replay(self._get_search_link(query, 1))
+        with provide_browser() as browser:
+            return self.get_listing_count(query, browser)
+
+    def listing_count_from_http(self, query: Query) -> int | None:
+        """
+        :return: The number of listings found with the given query, or None if it couldn't be read without a browser.
+        """
+        return None
+
     def get_listing_count(self, query: Query, browser: WebDriver) -> int:
         """
         Get the number of listings found with the given query
@@ -1,24 +1,105 @@
 import os
+import time
 from contextlib import contextmanager
-from queue import Queue
 
-from selenium import webdriver
+import requests
+from requests.adapters import HTTPAdapter
+from selenium.common import TimeoutException, WebDriverException
 from selenium.webdriver.chrome.options import Options
 from selenium_stealth import stealth
 
+from rent_scraper.browser_pool import PROFILES, Browser, BrowserPool, BrowserProfile, ReplayMiss
+from rent_scraper.logger import logger
+from rent_scraper.metrics import metrics
+from rent_scraper.page import Page
+from rent_scraper.page_cache import page_cache
+from rent_scraper.rate_limit import HTTP_RETRIES, RETRY_STATUSES, backoff, rate_limiter
+
 THREADS = int(os.getenv("THREADS", 1))
+# Timeout in seconds for plain HTTP requests, much shorter than the browser page load timeout as there is no rendering
+HTTP_TIMEOUT = int(os.getenv("HTTP_TIMEOUT", 30))
+# Browser profile pages are scraped with: "lean" to load only what is read from pages, or "full" to load everything
+BROWSER_PROFILE = os.getenv("BROWSER_PROFILE", "full")
+# Seconds to wait for the elements read from a page to appear, after the page has loaded
+BROWSER_WAIT = float(os.getenv("BROWSER_WAIT", 5))
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/124.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9",
+}
 
 
 @contextmanager
-def provide_browser():
-    browser = pool.get()
+def provide_browser(profile: BrowserProfile | None = None):
+    """
+    Checks a browser out of the pool for the duration of the block.
+
+    :param profile: What the browser should load, otherwise the profile chosen by BROWSER_PROFILE.
+    """
+    with metrics.timer("browser.checkout"):
+        pooled = pool.checkout()
+    healthy = True
     try:
-        yield browser
+        pooled.browser.use(profile or SCRAPE_PROFILE)
+        yield pooled.browser
+    except WebDriverException as e:
+        # Page load timeouts and pages missing from a replayed cache are expected, but anything else may mean the
+        # browser has crashed or wedged
+        healthy = isinstance(e, (TimeoutException, ReplayMiss))
+        raise
     finally:
-        pool.put(browser)
+        pool.checkin(pooled, healthy)
+
+
+def new_session() -> requests.Session:
+    """
+    Creates a requests session with a connection pool large enough to be shared by every worker thread
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=THREADS, pool_maxsize=THREADS)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(HEADERS)
+    return session
+
 
+def fetch(url: str) -> Page | None:
+    """
+    Fetches a page over plain HTTP using the shared session, retrying failures with backoff. Pages are served from the
+    page cache when it has a fresh enough copy.
 
-def new_browser(headless=True) -> webdriver.Chrome:
+    :param url: URL of the page to fetch.
+    :return: The page, or None if the request could not be completed.
+    """
+    if page_cache is not None and ((page := page_cache.get(url)) is not None or page_cache.replay):
+        metrics.increment("page_cache.hits" if page is not None else "page_cache.misses")
+        return page
+    for attempt in range(HTTP_RETRIES + 1):
+        rate_limiter.wait(url)
+        start = time.monotonic()
+        try:
+            with metrics.timer("http.fetch"):
+                response = session.get(url, timeout=HTTP_TIMEOUT)
+        except requests.RequestException as e:
+            rate_limiter.record(url, None, time.monotonic() - start)
+            logger.debug(f"{url} - HTTP fetch failed: {type(e).__name__}: {e}")
+        else:
+            rate_limiter.record(
+                url, response.status_code, time.monotonic() - start, response.headers.get("Retry-After")
+            )
+            if response.status_code not in RETRY_STATUSES or attempt == HTTP_RETRIES:
+                page = Page(response.status_code, response.url, response.text)
+                if page_cache is not None:
+                    page_cache.put(url, page)
+                return page
+            logger.debug(f"{url} - HTTP fetch got {response.status_code}, retrying")
+        if attempt < HTTP_RETRIES:
+            time.sleep(backoff(attempt))
+    return None
+
+
+def new_browser(headless=True) -> Browser:
     """
     Creates a new Chrome browser instance with the selenium_stealth additions
     """
@@ -26,6 +107,9 @@ def new_browser(headless=True) -> webdriver.Chrome:
 
     if headless:
         options.add_argument("--headless=new")
+    # Page loads return once the document is parsed, and the profile the browser is used with decides whether to wait
+    # for the rest
+    options.page_load_strategy = "eager"
 
     # Flags needed to run in Docker
     options.add_argument("--no-sandbox")
@@ -33,7 +117,7 @@ def new_browser(headless=True) -> webdriver.Chrome:
 
     options.add_experimental_option("excludeSwitches", ["enable-automation"])
     options.add_experimental_option("useAutomationExtension", False)
-    driver = webdriver.Chrome(options=options)
+    driver = Browser(options=options)
 
     stealth(
         driver,
@@ -47,12 +131,29 @@ def new_browser(headless=True) -> webdriver.Chrome:
 
     driver.set_page_load_timeout(120)
     driver.set_script_timeout(60)
-    driver.implicitly_wait(1)
     driver.set_window_size(1024, 768)
 
     return driver
 
 
-pool = Queue()
-for _ in range(THREADS):
-    pool.put(new_browser())
+def resolve_profile(name: str) -> BrowserProfile:
+    """
+    :return: The browser profile with the name, falling back to the full profile if there isn't one.
+    """
+    if name not in PROFILES:
+        logger.warning(f"Browser profile {name} does not exist, using full instead")
+        return PROFILES["full"]
+    return PROFILES[name]
+
+
+SCRAPE_PROFILE = resolve_profile(BROWSER_PROFILE)
+session = new_session()
+
+pool = BrowserPool(
+    new_browser,
+    max_size=THREADS,
+    min_size=int(os.getenv("BROWSER_MIN", 0)),
+    idle_timeout=int(os.getenv("BROWSER_IDLE_TIMEOUT", 300)),
+    max_page_loads=int(os.getenv("BROWSER_MAX_PAGE_LOADS", 500)),
+    max_rss_mb=int(os.getenv("BROWSER_MAX_RSS_MB", 1024)),
+)
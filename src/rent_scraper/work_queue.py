@@ -0,0 +1,145 @@
+import datetime
+import os
+import socket
+from threading import Event, Thread
+from typing import Iterable, List
+
+from peewee import fn
+
+from rent_scraper.logger import logger
+from rent_scraper.model import db, Job
+
+SWEEP = "sweep"
+REFRESH = "refresh"
+GEOCODE = "geocode"
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+# Seconds a claimed job is held for before another process can take it over. Held jobs are renewed well before then.
+LEASE_SECONDS = int(os.getenv("LEASE_SECONDS", 300))
+# Number of times a job is tried before it is given up on
+MAX_ATTEMPTS = int(os.getenv("MAX_ATTEMPTS", 3))
+
+# Identifies this process in the leases it holds
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"
+
+
+def lease_length() -> datetime.timedelta:
+    return datetime.timedelta(seconds=LEASE_SECONDS)
+
+
+def enqueue(kind: str, keys: Iterable[str]) -> int:
+    """
+    Adds jobs to the queue. Keys that already have an unfinished job of the same kind are skipped.
+
+    :param kind: Kind of job e.g. SWEEP.
+    :param keys: What each job is for, such as a listing ID.
+    :return: The number of jobs added.
+    """
+    rows = [{"kind": kind, "key": str(key), "available_at": fn.NOW()} for key in keys]
+    if not rows:
+        return 0
+    with db.atomic():
+        added = Job.insert_many(rows).on_conflict_ignore().as_rowcount().execute()
+    logger.debug(f"Queued {added} {kind} jobs")
+    return added
+
+
+def claim(kind: str, limit: int = 1) -> List[Job]:
+    """
+    Leases the oldest available jobs of a kind to this process. Jobs leased to other processes are skipped rather than
+    waited on, so any number of processes can claim at once without getting the same job. Jobs whose lease has
+    expired, because the process holding them died, are taken over.
+
+    :param kind: Kind of job to claim.
+    :param limit: Maximum number of jobs to claim.
+    :return: The claimed jobs.
+    """
+    with db.atomic():
+        # Jobs that have expired on their last attempt would otherwise be stuck leased forever
+        Job.update(status=FAILED, lease_owner=None, last_error="Lease expired").where(
+            Job.kind == kind, Job.status == LEASED, Job.lease_expires < fn.NOW(), Job.attempts >= MAX_ATTEMPTS
+        ).execute()
+
+        claimable = (
+            Job.select(Job.id)
+            .where(
+                Job.kind == kind,
+                ((Job.status == PENDING) & (Job.available_at <= fn.NOW()))
+                | ((Job.status == LEASED) & (Job.lease_expires < fn.NOW())),
+            )
+            .order_by(Job.available_at, Job.id)
+            .limit(limit)
+            .for_update("FOR UPDATE SKIP LOCKED")
+        )
+        return list(
+            Job.update(
+                status=LEASED,
+                lease_owner=WORKER_ID,
+                lease_expires=fn.NOW() + lease_length(),
+                attempts=Job.attempts + 1,
+            )
+            .where(Job.id << claimable)
+            .returning(Job)
+            .execute()
+        )
+
+
+def complete(job: Job) -> None:
+    Job.update(status=DONE, lease_owner=None, lease_expires=None).where(
+        Job.id == job.id, Job.lease_owner == WORKER_ID
+    ).execute()
+
+
+def fail(job: Job, error: Exception) -> None:
+    """
+    Releases a job that went wrong, so it can be tried again after a delay that grows with each attempt, unless it is
+    out of attempts.
+    """
+    message = f"{type(error).__name__}: {error}"
+    if job.attempts >= MAX_ATTEMPTS:
+        logger.error(f"Giving up on {job.kind} job {job.key} after {job.attempts} attempts: {message}")
+        update = {Job.status: FAILED}
+    else:
+        logger.warning(f"{job.kind} job {job.key} failed on attempt {job.attempts}: {message}")
+        update = {Job.status: PENDING, Job.available_at: fn.NOW() + datetime.timedelta(minutes=2**job.attempts)}
+    Job.update({**update, Job.lease_owner: None, Job.lease_expires: None, Job.last_error: message}).where(
+        Job.id == job.id, Job.lease_owner == WORKER_ID
+    ).execute()
+
+
+def unfinished(kind: str | None = None) -> bool:
+    """
+    :param kind: Only look at jobs of this kind, otherwise any kind.
+    :return: True if any job is still pending or leased, by any process.
+    """
+    query = Job.select().where(Job.status << [PENDING, LEASED])
+    if kind is not None:
+        query = query.where(Job.kind == kind)
+    return query.exists()
+
+
+class Heartbeat(Thread):
+    """
+    Renews the leases of every job held by this process until stopped, so that long running jobs aren't taken over
+    while they are still being worked on.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(name="heartbeat", daemon=True)
+        self._stopped = Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(LEASE_SECONDS / 3):
+            try:
+                Job.update(lease_expires=fn.NOW() + lease_length()).where(
+                    Job.status == LEASED, Job.lease_owner == WORKER_ID
+                ).execute()
+            except Exception as e:
+                logger.warning(f"Heartbeat failed: {type(e).__name__}: {e}")
+
+    def stop(self) -> None:
+        self._stopped.set()
@@ -0,0 +1,152 @@
+import dataclasses
+import time
+from threading import Thread
+from typing import List
+
+from rent_scraper.engine import AsyncEngine
+from rent_scraper.known_listings import known_listings
+from rent_scraper.logger import logger, configure_logging
+from rent_scraper.metrics import metrics
+from rent_scraper.model import db, init_db, Address, Job, Listing, Query, SimpleListing
+from rent_scraper.range_planner import RangePlanner
+from rent_scraper.refresh import RefreshScheduler
+from rent_scraper.search import Reconciler, domain, populate_coordinates, refresh, sweep_range
+from rent_scraper.util import THREADS, pool
+from rent_scraper import work_queue
+from rent_scraper.work_queue import SWEEP, REFRESH, GEOCODE
+
+# Arbitrary key for the advisory lock held while planning a run, so only one worker plans at a time
+PLAN_LOCK = 8_271_002
+# Number of refresh jobs claimed at once, as they are fetched concurrently
+REFRESH_BATCH = 50
+# Seconds to wait for other workers when there is nothing to claim
+IDLE_WAIT = 5
+
+
+class Worker:
+    """
+    Works through the job queue until it's empty. Any number of workers, in any number of processes or on any number
+    of hosts, can share the queue.
+
+    When the queue is empty, one worker plans the next run and queues it: a sweep of every range and a refresh of
+    every listing that is due. Refreshes are claimed first, as they make the sweeps more accurate. Geocoding is queued
+    by the sweeps as they find new addresses.
+    """
+
+    def __init__(self, engine: AsyncEngine) -> None:
+        self.engine = engine
+        # Nothing is planned, so this only records the checks made
+        self.scheduler = RefreshScheduler()
+
+    def run(self) -> None:
+        while True:
+            if self.work():
+                continue
+            if not work_queue.unfinished():
+                return
+            # The rest of the jobs are leased to other workers, which may die and leave them to be taken over
+            time.sleep(IDLE_WAIT)
+
+    def work(self) -> bool:
+        """
+        Claims and works on the next available jobs.
+
+        :return: False if there was nothing to claim.
+        """
+        if jobs := work_queue.claim(REFRESH, REFRESH_BATCH):
+            self._run(jobs, self._refresh)
+        elif jobs := work_queue.claim(SWEEP):
+            self._run(jobs, self._sweep)
+        elif jobs := work_queue.claim(GEOCODE):
+            self._run(jobs, self._geocode)
+        return bool(jobs)
+
+    @staticmethod
+    def _run(jobs: List[Job], handler) -> None:
+        try:
+            handler(jobs)
+        except Exception as e:
+            for job in jobs:
+                work_queue.fail(job, e)
+        else:
+            for job in jobs:
+                work_queue.complete(job)
+
+    def _refresh(self, jobs: List[Job]) -> None:
+        listings = list(SimpleListing.select().where(SimpleListing.id << [job.key for job in jobs]))
+        refresh(self.engine, self.scheduler, listings)
+
+    def _sweep(self, jobs: List[Job]) -> None:
+        for job in jobs:
+            query = Query.get_or_none(Query.id == int(job.key))
+            if query is None:
+                # Replaced by the range planner since it was queued
+                continue
+            # Other workers may have closed, reopened or repriced listings since the index was loaded, which would
+            # otherwise be skipped as unchanged
+            known_listings.load_changes()
+            reconciler = Reconciler()
+            listings = sweep_range(query, self.engine, self.scheduler, reconciler=reconciler)
+            # Other workers sweep the other ranges, so a listing missing from this one could be in any of them. They
+            # are checked individually instead of being closed.
+            work_queue.enqueue(REFRESH, reconciler.finish(every_range=False))
+            addresses = (
+                Address.select(Address.id).join(Listing).where(Listing.id << list(listings), Address.latitude.is_null())
+            )
+            work_queue.enqueue(GEOCODE, {address.id for address in addresses})
+
+    @staticmethod
+    def _geocode(jobs: List[Job]) -> None:
+        for job in jobs:
+            populate_coordinates(Address.get_by_id(int(job.key)))
+
+
+def plan_run() -> None:
+    """
+    Queues the next run, unless there is still work queued or another worker is already planning.
+    """
+    if not db.execute_sql("SELECT pg_try_advisory_lock(%s)", (PLAN_LOCK,)).fetchone()[0]:
+        return
+    try:
+        if work_queue.unfinished():
+            return
+        ranges = RangePlanner(domain).plan()
+        work_queue.enqueue(REFRESH, RefreshScheduler().plan())
+        work_queue.enqueue(SWEEP, [query.id for query in ranges])
+    finally:
+        db.execute_sql("SELECT pg_advisory_unlock(%s)", (PLAN_LOCK,))
+
+
+def worker():
+    """
+    Runs workers on the job queue until it is empty, planning a new run first if there isn't one queued.
+    """
+    configure_logging()
+    init_db()
+    known_listings.load()
+    plan_run()
+
+    engine = AsyncEngine()
+    heartbeat = work_queue.Heartbeat()
+    heartbeat.start()
+
+    def run() -> None:
+        try:
+            Worker(engine).run()
+        finally:
+            db.close()
+
+    threads = [Thread(target=run, name=f"worker-{i}") for i in range(max(THREADS, 1))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    heartbeat.stop()
+    engine.close()
+    logger.info(f"Browser pool: {pool.stats()}")
+    metrics.write({"browser_pool": dataclasses.asdict(pool.stats()), "db_pool": db.stats()})
+
+
+if __name__ == "__main__":
+    worker()
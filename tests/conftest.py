@@ -0,0 +1,29 @@
+import os
+
+import pytest
+
+from rent_scraper import persistence
+from rent_scraper.known_listings import KnownListings
+
+# Tests that need a database only run when one is given, as every table in it is emptied between tests
+TEST_DB_NAME = os.getenv("TEST_DB_NAME")
+
+
+@pytest.fixture
+def database(monkeypatch):
+    if not TEST_DB_NAME:
+        pytest.skip("TEST_DB_NAME is not set")
+
+    from rent_scraper.migrate import run_migrations, TABLES
+    from rent_scraper.model import db, init_db
+
+    init_db(TEST_DB_NAME)
+    with db.connection_context():
+        run_migrations()
+        tables = ", ".join(model._meta.table_name for model in TABLES if model.__name__ != "SchemaMigration")
+        db.execute_sql(f"TRUNCATE {tables}, listingstate, addressstate RESTART IDENTITY CASCADE")
+        # Each test starts with nothing cached from the last
+        monkeypatch.setattr(persistence, "known_listings", KnownListings())
+        persistence.address_ids.clear()
+        yield db
+    db.close_all()
@@ -0,0 +1,48 @@
+import time
+
+from rent_scraper.browser_pool import BrowserPool
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.page_loads = 0
+        self.quit_called = False
+
+    def execute_script(self, script):
+        return 1
+
+    def quit(self):
+        self.quit_called = True
+
+
+def test_memory_checked_every_so_many_loads(monkeypatch):
+    checks = []
+    monkeypatch.setattr(BrowserPool, "_rss_mb", staticmethod(lambda pooled: checks.append(pooled) or 0))
+    pool = BrowserPool(FakeBrowser, max_size=1, rss_check_loads=10)
+    for _ in range(30):
+        pooled = pool.checkout()
+        pooled.browser.page_loads += 1
+        pool.checkin(pooled)
+    assert len(checks) == 3
+
+
+def test_restarted_when_using_too_much_memory(monkeypatch):
+    monkeypatch.setattr(BrowserPool, "_rss_mb", staticmethod(lambda pooled: 2048))
+    pool = BrowserPool(FakeBrowser, max_size=1, max_rss_mb=1024, rss_check_loads=1)
+    pooled = pool.checkout()
+    pooled.browser.page_loads += 1
+    pool.checkin(pooled)
+    assert pooled.browser.quit_called
+    assert pool.stats().restarts == 1
+    assert pool.checkout().browser is not pooled.browser
+
+
+def test_idle_browsers_shut_down_on_checkin():
+    pool = BrowserPool(FakeBrowser, max_size=2, idle_timeout=60)
+    first, second = pool.checkout(), pool.checkout()
+    pool.checkin(first)
+    first.last_used = time.monotonic() - 120
+    pool.checkin(second)
+    assert first.browser.quit_called
+    assert not second.browser.quit_called
+    assert pool.stats().size == 1
@@ -0,0 +1,64 @@
+import datetime
+
+from rent_scraper.checkpoint import Checkpoint, RESUME_MAX_AGE_HOURS
+from rent_scraper.model import Query, RangeSeen, SearchRun
+
+
+def test_resume_unfinished_run(database):
+    query = Query.create(lower_price=0, upper_price=500, beds="2")
+    checkpoint = Checkpoint.start()
+    assert not checkpoint.resumed
+    checkpoint.save_page(query, 1, ["a", "b"])
+    checkpoint.save_page(query, 2, ["c"])
+
+    resumed = Checkpoint.start()
+    assert resumed.resumed and resumed.run.id == checkpoint.run.id
+    assert resumed.progress(query) == (2, {"a", "b", "c"})
+    assert resumed.done() == set()
+
+
+def test_range_done_keeps_seen(database):
+    first = Query.create(lower_price=0, upper_price=500, beds="2")
+    second = Query.create(lower_price=500, upper_price=1000, beds="2")
+    checkpoint = Checkpoint.start()
+    checkpoint.save_page(first, 1, ["a"])
+    checkpoint.range_done(first)
+    checkpoint.save_page(second, 1, ["b"])
+
+    assert checkpoint.done() == {first.id}
+    # Still needed to tell which listings have gone once every range is done
+    assert checkpoint.seen() == {"a", "b"}
+
+
+def test_finished_run_is_not_resumed(database):
+    query = Query.create(lower_price=0, upper_price=500, beds="2")
+    checkpoint = Checkpoint.start()
+    checkpoint.save_page(query, 1, ["a"])
+    checkpoint.finish()
+
+    assert RangeSeen.select().count() == 0
+    new = Checkpoint.start()
+    assert not new.resumed and new.run.id != checkpoint.run.id
+    assert new.progress(query) == (0, set())
+
+
+def test_old_runs_are_abandoned(database):
+    now = datetime.datetime.now()
+    old = SearchRun.create(started_at=now - datetime.timedelta(hours=RESUME_MAX_AGE_HOURS + 1))
+    SearchRun.create(started_at=now - datetime.timedelta(hours=RESUME_MAX_AGE_HOURS + 2))
+    RangeSeen.create(run=old, query=Query.create(lower_price=0, upper_price=500, beds="2"), listing="a")
+
+    checkpoint = Checkpoint.start()
+    assert not checkpoint.resumed
+    assert [run.id for run in SearchRun.select()] == [checkpoint.run.id]
+    assert RangeSeen.select().count() == 0
+
+
+def test_only_latest_run_is_resumed(database):
+    now = datetime.datetime.now()
+    SearchRun.create(started_at=now - datetime.timedelta(hours=2))
+    latest = SearchRun.create(started_at=now - datetime.timedelta(hours=1))
+
+    checkpoint = Checkpoint.start()
+    assert checkpoint.resumed and checkpoint.run.id == latest.id
+    assert SearchRun.select().count() == 1
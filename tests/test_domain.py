@@ -0,0 +1,181 @@
+from pathlib import Path
+
+import pytest
+
+from rent_scraper.page import Page
+from rent_scraper.parsing import parse, BACKENDS, available_backends
+from rent_scraper.sites.domain import Domain, DOMAIN_URL, SEARCH_PAGE
+
+FIXTURES = Path(__file__).parent / "fixtures" / "domain"
+LISTING_ID = "12-34-smith-street-fitzroy-vic-3065-2019000123"
+
+
+def fixture(name: str) -> str:
+    return (FIXTURES / name).read_text()
+
+
+def page(name: str, status: int = 200, url: str = f"{DOMAIN_URL}/{LISTING_ID}") -> Page:
+    return Page(status, url, fixture(name))
+
+
+@pytest.fixture
+def domain() -> Domain:
+    return Domain()
+
+
+def test_available_listing(domain):
+    assert domain._listing_from_page(LISTING_ID, page("listing_available.html")) == (
+        True,
+        {"price": 650, "beds": 2, "baths": 1, "cars": 0, "address": "12/34 Smith Street, Fitzroy VIC 3065"},
+    )
+
+
+def test_leased_listing(domain):
+    assert domain._listing_from_page(LISTING_ID, page("listing_leased.html")) == (False, None)
+
+
+def test_property_profile_redirect(domain):
+    redirected = page(
+        "listing_available.html", url=f"{DOMAIN_URL}/property-profile/12-34-smith-street-fitzroy-vic-3065"
+    )
+    assert domain._listing_from_page(LISTING_ID, redirected) == (False, None)
+
+
+@pytest.mark.parametrize("status", [404, 410])
+def test_not_found(domain, status):
+    assert domain._listing_from_page(LISTING_ID, page("listing_not_found.html", status)) == (False, None)
+
+
+def test_challenge_page_falls_back_to_browser(domain):
+    # A 200 that isn't a listing page mustn't be taken to mean the listing is gone
+    assert domain._listing_from_page(LISTING_ID, page("challenge.html")) is None
+
+
+@pytest.mark.parametrize("status", [403, 429, 500, 503])
+def test_blocked_falls_back_to_browser(domain, status):
+    assert domain._listing_from_page(LISTING_ID, page("listing_available.html", status)) is None
+
+
+def test_no_response_falls_back_to_browser(domain):
+    assert domain._listing_from_page(LISTING_ID, None) is None
+
+
+def test_page_data(domain):
+    assert domain._listing_from_page(LISTING_ID, page("listing_page_data.html")) == (
+        True,
+        {"price": 780, "beds": 3, "baths": 2, "cars": 1, "address": "7 Park Avenue, Braddon ACT 2612"},
+    )
+
+
+def test_unreadable_listing_falls_back_to_browser(domain):
+    # A listing page, but with neither the details nor the page data to read them from
+    html = fixture("listing_page_data.html").replace('id="__NEXT_DATA__"', 'id="other"')
+    assert domain._listing_from_page(LISTING_ID, Page(200, f"{DOMAIN_URL}/{LISTING_ID}", html)) is None
+
+
+def test_details_from_html(domain):
+    assert domain.details_from_html(parse(fixture("listing_available.html"))) == {
+        "price": 650,
+        "beds": 2,
+        "baths": 1,
+        "cars": 0,
+        "address": "12/34 Smith Street, Fitzroy VIC 3065",
+    }
+    assert domain.details_from_html(parse(fixture("listing_page_data.html"))) is None
+    assert domain.details_from_html(parse(fixture("challenge.html"))) is None
+
+
+def test_details_from_json(domain):
+    assert domain.details_from_json(parse(fixture("listing_available.html"))) is None
+    assert domain.details_from_json(parse(fixture("listing_page_data.html").replace('"title"', '"heading"'))) is None
+
+
+@pytest.mark.parametrize(
+    "headings, title, url, has_tag, available",
+    [
+        (
+            ["5 Beach Road, Battery Point TAS 7004"],
+            "5 Beach Road Battery Point TAS 7004 | Domain",
+            "/5-beach",
+            False,
+            True,
+        ),
+        (
+            ["5 Beach Road, Battery Point TAS 7004"],
+            "5 Beach Road Battery Point TAS 7004 | Domain",
+            "/5-beach",
+            True,
+            False,
+        ),
+        (["5 Beach Road"], "5 Beach Road | Domain", "/property-profile/5-beach-road", False, False),
+        (["Sorry, we couldn't find that page"], "Page not found | Domain", "/5-beach", False, False),
+        (["5 Beach Road", "Similar properties"], "5 Beach Road | Domain", "/5-beach", False, False),
+        ([], "Domain", "/5-beach", False, False),
+    ],
+)
+def test_is_available(headings, title, url, has_tag, available):
+    assert Domain._is_available(headings, title, url, has_tag) == available
+
+
+@pytest.mark.parametrize(
+    "price_text, features, details",
+    [
+        ("$650 per week", ["2\nBeds", "1\nBath", "−\nParking"], {"price": 650, "beds": 2, "baths": 1, "cars": 0}),
+        ("$1,200 pw", ["4 Beds", "2 Baths", "2 Parking"], {"price": 1200, "beds": 4, "baths": 2, "cars": 2}),
+        ("From $480 - $520", ["1 Bed"], {"price": 480, "beds": 1, "baths": 0, "cars": 0}),
+        ("$700", ["3\nBeds", "640m²", "1.2ha"], {"price": 700, "beds": 3, "baths": 0, "cars": 0}),
+    ],
+)
+def test_parse_details(price_text, features, details):
+    assert Domain._parse_details(price_text, features, "An address") == {**details, "address": "An address"}
+
+
+def test_parse_details_without_price():
+    assert Domain._parse_details("Contact agent", ["2 Beds"], "An address") is None
+
+
+@pytest.mark.parametrize("backend", [backend for backend in BACKENDS if backend in available_backends()])
+def test_details_from_card(domain, backend):
+    cards = domain._cards_from_soup(parse(fixture("search_page.html"), SEARCH_PAGE, backend))
+    assert cards == [
+        (
+            LISTING_ID,
+            {"price": 650, "beds": 2, "baths": 1, "cars": 0, "address": "12/34 Smith Street, Fitzroy VIC 3065"},
+        ),
+        # No price on the card, so the listing page has to be read instead
+        ("5-beach-road-battery-point-tas-7004-2019000456", None),
+    ]
+
+
+@pytest.mark.parametrize("label", ["Bath", "Parking"])
+def test_card_missing_count(domain, label):
+    # Reading the count as 0 would be wrong, so the listing page is read instead
+    html = fixture("search_page.html").replace(f"<span>{label}</span>", "<span>Land size</span>")
+    cards = domain._cards_from_soup(parse(html, SEARCH_PAGE))
+    assert cards[0] == (LISTING_ID, None)
+
+
+def test_cards_from_page(domain):
+    results = page("search_page.html", url=f"{DOMAIN_URL}/rent/?page=1")
+    assert [listing_id for listing_id, _ in domain._cards_from_page(results)] == [
+        LISTING_ID,
+        "5-beach-road-battery-point-tas-7004-2019000456",
+    ]
+    assert domain._cards_from_page(page("challenge.html")) is None
+
+
+def test_cards_missing_falls_back_to_browser(domain):
+    # Says there are results, but the cards are in markup we don't recognise
+    html = fixture("search_page.html").replace('data-testid="listing-card-wrapper', 'data-testid="card')
+    assert domain._cards_from_page(Page(200, f"{DOMAIN_URL}/rent/?page=1", html)) is None
+
+
+def test_no_results(domain):
+    html = fixture("search_page.html").replace("312 Properties", "0 Properties")
+    html = html.replace('data-testid="listing-card-wrapper', 'data-testid="card')
+    assert domain._cards_from_page(Page(200, f"{DOMAIN_URL}/rent/?page=1", html)) == []
+
+
+def test_count(domain):
+    assert domain._count_from_soup(parse(fixture("search_page.html"), SEARCH_PAGE)) == 312
+    assert domain._count_from_soup(parse(fixture("challenge.html"), SEARCH_PAGE)) is None
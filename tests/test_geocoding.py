@@ -0,0 +1,76 @@
+import pytest
+
+from rent_scraper.geocoding import address_key, normalise_address, without_unit
+
+
+def test_units_share_their_building():
+    expected = "15 smith st, carlton vic 3053"
+    assert normalise_address("2/15 Smith Street, Carlton VIC 3053") == expected
+    assert normalise_address("Unit 2/15 Smith Street, Carlton VIC 3053") == expected
+    assert normalise_address("Unit 2 15 Smith Street, Carlton VIC 3053") == expected
+    assert normalise_address("Apt 2, 15 Smith Street, Carlton VIC 3053") == expected
+
+
+def test_numbered_streets_keep_their_house_number():
+    assert normalise_address("5 10th Street, Mildura VIC 3500") == "5 10th st, mildura vic 3500"
+    assert normalise_address("7 10th Street, Mildura VIC 3500") == "7 10th st, mildura vic 3500"
+    assert normalise_address("12 3rd Avenue, Sunshine VIC 3020") == "12 3rd ave, sunshine vic 3020"
+
+
+@pytest.mark.parametrize(
+    "address",
+    [
+        "3 15 Smith St, Carlton VIC 3053",
+        "3, 15 Smith St, Carlton VIC 3053",
+        "Unit 3 15 Smith Street, Carlton VIC 3053",
+        "G02/15 Smith Street, Carlton VIC 3053",
+    ],
+)
+def test_spaced_units_share_their_building(address):
+    assert normalise_address(address) == "15 smith st, carlton vic 3053"
+    assert normalise_address(address) == normalise_address(address_key(address))
+
+
+def test_without_unit():
+    assert without_unit("Unit 3, 15 Smith Street, Carlton VIC 3053") == "15 Smith Street, Carlton VIC 3053"
+    assert without_unit("5 10th Street, Mildura VIC 3500") == "5 10th Street, Mildura VIC 3500"
+
+
+def test_units_on_numbered_streets():
+    assert normalise_address("3/5 10th Street, Mildura VIC 3500") == "5 10th st, mildura vic 3500"
+    assert normalise_address("Unit 3 5 10th Street, Mildura VIC 3500") == "5 10th st, mildura vic 3500"
+
+
+@pytest.mark.parametrize(
+    "address",
+    [
+        "3/15 Smith Street, Carlton VIC 3053",
+        "3 / 15 Smith St, Carlton VIC 3053",
+        "Unit 3/15 Smith Street, Carlton VIC 3053",
+        "Unit 3 15 Smith Street, Carlton VIC 3053",
+        "3 15 Smith Street, Carlton VIC 3053",
+        "3, 15 Smith Street, Carlton VIC 3053",
+        "Apt 3, 15 Smith Street, Carlton VIC 3053",
+    ],
+)
+def test_address_key_units(address):
+    assert address_key(address) == "3/15 smith st, carlton vic 3053"
+
+
+@pytest.mark.parametrize(
+    "address, key",
+    [
+        ("12 3rd Avenue, Sunshine VIC 3020", "12 3rd ave, sunshine vic 3020"),
+        ("5 10th Street, Mildura VIC 3500", "5 10th st, mildura vic 3500"),
+        ("3/5 10th Street, Mildura VIC 3500", "3/5 10th st, mildura vic 3500"),
+        ("3 12a Smith Street, Carlton VIC 3053", "3/12a smith st, carlton vic 3053"),
+        ("3 12-14 Smith Street, Carlton VIC 3053", "3/12-14 smith st, carlton vic 3053"),
+        ("Level 3 100 George Street, Sydney NSW 2000", "level 3/100 george st, sydney nsw 2000"),
+        ("Level 3, 100 George Street, Sydney NSW 2000", "level 3/100 george st, sydney nsw 2000"),
+        ("Shop 2 15 Main Street, Bendigo VIC 3550", "shop 2/15 main st, bendigo vic 3550"),
+        ("Shop 2/15 Main Street, Bendigo VIC 3550", "shop 2/15 main st, bendigo vic 3550"),
+        ("15 Main Street, Bendigo VIC 3550", "15 main st, bendigo vic 3550"),
+    ],
+)
+def test_address_key(address, key):
+    assert address_key(address) == key
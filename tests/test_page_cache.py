@@ -0,0 +1,96 @@
+import gzip
+import sqlite3
+import time
+from pathlib import Path
+
+import pytest
+
+from rent_scraper import browser_pool, page_cache
+from rent_scraper.browser_pool import ReplayMiss, check_replay
+from rent_scraper.page import Page
+from rent_scraper.page_cache import PageCache
+from rent_scraper.sites import domain
+from rent_scraper.sites.domain import Domain
+
+URL = "https://www.domain.com.au/12-34-smith-street-fitzroy-vic-3065-2019000123"
+SEARCH_URL = "https://www.domain.com.au/rent/?page=1"
+FIXTURES = Path(__file__).parent / "fixtures" / "domain"
+
+
+def test_latest_version_is_served(tmp_path):
+    cache = PageCache(tmp_path)
+    cache.put(URL, Page(200, URL, "first"))
+    cache.put(URL, Page(200, URL, "second"))
+    assert cache.get(URL).text == "second"
+
+
+def test_replaced_page_is_deleted(tmp_path):
+    cache = PageCache(tmp_path)
+    cache.put(URL, Page(200, URL, "first"))
+    cache.put(URL, Page(404, URL, "gone"))
+    assert cache.get(URL).status == 404
+    assert cache.stats() == {"pages": 1, "bytes": len(gzip.compress(b"gone"))}
+    assert len(list((tmp_path / "pages").glob("*/*.gz"))) == 1
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = PageCache(tmp_path)
+    cache.put(URL, Page(200, URL, "page 0"))
+    # Room for two pages
+    cache.max_bytes = cache.stats()["bytes"] * 2
+    cache.put(f"{URL}1", Page(200, f"{URL}1", "page 1"))
+    # Only held in memory until the next page is stored, but still counts
+    assert cache.get(URL).text == "page 0"
+    cache.put(f"{URL}2", Page(200, f"{URL}2", "page 2"))
+    assert cache.get(f"{URL}1") is None
+    assert cache.get(URL).text == "page 0"
+
+
+def test_access_times_are_batched(tmp_path, monkeypatch):
+    monkeypatch.setattr(page_cache, "ACCESS_BATCH_SIZE", 2)
+    cache = PageCache(tmp_path)
+    cache.put(URL, Page(200, URL, "first"))
+    cache.put(f"{URL}1", Page(200, f"{URL}1", "second"))
+    monkeypatch.setattr(time, "time", lambda: 1e9 + 10)
+    monkeypatch.setattr(page_cache, "TTLS", {"listing": 1e10})
+
+    def accessed_at():
+        return dict(sqlite3.connect(tmp_path / "index.sqlite").execute("SELECT url, accessed_at FROM page"))
+
+    cache.get(URL)
+    assert 1e9 + 10 not in accessed_at().values()
+    cache.get(f"{URL}1")
+    assert list(accessed_at().values()) == [1e9 + 10, 1e9 + 10]
+
+
+def test_expired(tmp_path, monkeypatch):
+    cache = PageCache(tmp_path)
+    cache.put(URL, Page(200, URL, "first"))
+    monkeypatch.setattr(time, "time", lambda: 1e12)
+    assert cache.get(URL) is None
+    assert PageCache(tmp_path, replay=True).get(URL).text == "first"
+
+
+def test_replay_miss_before_checkout(tmp_path, monkeypatch):
+    cache = PageCache(tmp_path, replay=True)
+    cache.put(URL, Page(200, URL, "first"))
+    monkeypatch.setattr(browser_pool, "page_cache", cache)
+    check_replay(URL)
+    with pytest.raises(ReplayMiss):
+        check_replay(f"{URL}4")
+
+
+def test_only_results_pages_are_replayed(tmp_path, monkeypatch):
+    class ReplayBrowser:
+        def get(self, url):
+            raise ReplayMiss(f"{url} is not in the page cache")
+
+    cache = PageCache(tmp_path, replay=True)
+    monkeypatch.setattr(domain, "page_cache", cache)
+    # A block page the browser loaded would be read as a page without any listings
+    cache.put(SEARCH_URL, Page(200, SEARCH_URL, (FIXTURES / "challenge.html").read_text()))
+    with pytest.raises(ReplayMiss):
+        Domain._load(SEARCH_URL, ReplayBrowser())
+    results = (FIXTURES / "search_page.html").read_text()
+    cache.put(SEARCH_URL, Page(200, SEARCH_URL, results))
+    assert Domain._load(SEARCH_URL, ReplayBrowser()) == results
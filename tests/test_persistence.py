@@ -0,0 +1,70 @@
+import pytest
+
+from rent_scraper import persistence
+from rent_scraper.model import Address, ListingCheck, SimpleListing
+from rent_scraper.persistence import save_changes, save_listings
+
+DETAILS = {"address": "2/15 Smith Street, Carlton VIC 3053", "price": 500, "beds": 2, "baths": 1, "cars": 0}
+
+
+def test_save_listings(database):
+    created = save_listings({"a": DETAILS, "b": {**DETAILS, "address": "Unit 2, 15 Smith St, Carlton VIC 3053"}})
+    assert sorted(created) == ["a", "b"]
+    # The same unit written two ways is one address
+    assert Address.select().count() == 1
+    listing = SimpleListing.get_by_id("a")
+    assert (listing.price, listing.available, listing.address.beds) == (500, True, 2)
+    assert ListingCheck.select().count() == 2
+    assert persistence.known_listings.is_unchanged("a", 500)
+
+
+def test_save_listings_leaves_existing(database):
+    save_listings({"a": DETAILS})
+    assert save_listings({"a": {**DETAILS, "price": 600}, "b": DETAILS}) == ["b"]
+    assert SimpleListing.get_by_id("a").price == 500
+
+
+def test_save_changes(database):
+    save_listings({"a": DETAILS, "b": {**DETAILS, "address": "16 Smith Street, Carlton VIC 3053"}, "c": DETAILS})
+    listings = {listing.id: listing for listing in SimpleListing.select()}
+    listings["a"].price = 550
+    listings["b"].address.baths = 2
+    listings["c"].available = False
+    assert save_changes(listings.values()) == 3
+
+    assert SimpleListing.get_by_id("a").price == 550
+    assert SimpleListing.get_by_id("b").address.baths == 2
+    assert not SimpleListing.get_by_id("c").available
+    assert not any(listing.is_dirty() for listing in listings.values())
+
+
+def test_save_changes_skips_unchanged(database):
+    save_listings({"a": DETAILS})
+    listing = SimpleListing.get_by_id("a")
+    # Its address is loaded but unchanged, so there is nothing to write either
+    assert listing.address.beds == 2
+    assert save_changes([listing]) == 0
+
+
+def test_save_changes_kept_after_rollback(database, monkeypatch):
+    save_listings({"a": DETAILS, "b": DETAILS})
+    a, b = SimpleListing.get_by_id("a"), SimpleListing.get_by_id("b")
+    a.price = 550
+    a.address.cars = 1
+    b.available = False
+
+    def fail(listing_ids):
+        raise RuntimeError("Lost the connection")
+
+    close_listings = persistence.close_listings
+    monkeypatch.setattr(persistence, "close_listings", fail)
+    with pytest.raises(RuntimeError):
+        save_changes([a, b])
+    assert SimpleListing.get_by_id("a").price == 500
+    assert SimpleListing.get_by_id("a").address.cars == 0
+    assert a.is_dirty() and a.address.is_dirty() and b.is_dirty()
+
+    monkeypatch.setattr(persistence, "close_listings", close_listings)
+    assert save_changes([a, b]) == 2
+    assert SimpleListing.get_by_id("a").price == 550
+    assert SimpleListing.get_by_id("a").address.cars == 1
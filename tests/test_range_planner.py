@@ -0,0 +1,86 @@
+import pytest
+
+from rent_scraper import range_planner
+from rent_scraper.known_listings import KnownListings
+from rent_scraper.model import Query
+from rent_scraper.range_planner import RangePlanner
+
+
+@pytest.fixture
+def planner(monkeypatch):
+    # Builds the new ranges without saving them
+    def replace(old, bounds):
+        count = sum(query.listing_count for query in old) if len(bounds) == 1 else None
+        return [
+            Query(lower_price=lower, upper_price=upper, beds=old[0].beds, listing_count=count)
+            for lower, upper in bounds
+        ]
+
+    monkeypatch.setattr(RangePlanner, "_replace", staticmethod(replace))
+    monkeypatch.setattr(range_planner, "known_listings", KnownListings())
+    return RangePlanner(site=None)
+
+
+def bounds(queries):
+    return [(query.lower_price, query.upper_price) for query in queries]
+
+
+def test_split_at_known_prices(planner):
+    # Most listings are cheap, so the split is well below the middle of the range
+    for i in range(100):
+        range_planner.known_listings.update(f"cheap{i}", 400 + i, 2, True)
+    for i in range(20):
+        range_planner.known_listings.update(f"dear{i}", 900 + i, 2, True)
+    query = Query(lower_price=0, upper_price=1000, beds="2", listing_count=1000)
+    assert bounds(planner._split(query)) == [(0, 459), (459, 1000)]
+
+
+def test_split_evenly_without_known_prices(planner):
+    query = Query(lower_price=0, upper_price=900, beds="2", listing_count=1500)
+    assert bounds(planner._split(query)) == [(0, 300), (300, 600), (600, 900)]
+
+
+def test_split_point_not_on_a_bound(planner):
+    # Every known listing is at the bottom of the range, so splitting at their price would leave an empty range
+    for i in range(10):
+        range_planner.known_listings.update(f"a{i}", 101, 2, True)
+    query = Query(lower_price=100, upper_price=300, beds="2", listing_count=800)
+    assert bounds(planner._split(query)) == [(100, 200), (200, 300)]
+
+
+def test_split_ignores_other_beds_and_unavailable(planner):
+    for i in range(10):
+        range_planner.known_listings.update(f"other{i}", 150, 3, True)
+        range_planner.known_listings.update(f"closed{i}", 150, 2, False)
+    query = Query(lower_price=100, upper_price=300, beds="2", listing_count=800)
+    assert bounds(planner._split(query)) == [(100, 200), (200, 300)]
+
+
+def test_merge(planner):
+    queries = [
+        Query(lower_price=0, upper_price=100, beds="2", listing_count=300),
+        Query(lower_price=100, upper_price=200, beds="2", listing_count=300),
+        Query(lower_price=200, upper_price=300, beds="2", listing_count=300),
+        Query(lower_price=300, upper_price=400, beds="2", listing_count=100),
+    ]
+    merged = planner._merge(queries)
+    assert bounds(merged) == [(0, 200), (200, 400)]
+    assert [query.listing_count for query in merged] == [600, 400]
+
+
+def test_merge_stops_at_unknown_count(planner):
+    queries = [
+        Query(lower_price=0, upper_price=100, beds="2", listing_count=10),
+        Query(lower_price=100, upper_price=200, beds="2", listing_count=None),
+        Query(lower_price=200, upper_price=300, beds="2", listing_count=10),
+        Query(lower_price=300, upper_price=400, beds="2", listing_count=10),
+    ]
+    assert bounds(planner._merge(queries)) == [(0, 100), (100, 200), (200, 400)]
+
+
+def test_merge_only_neighbours(planner):
+    queries = [
+        Query(lower_price=0, upper_price=100, beds="2", listing_count=10),
+        Query(lower_price=150, upper_price=200, beds="2", listing_count=10),
+    ]
+    assert bounds(planner._merge(queries)) == [(0, 100), (150, 200)]
@@ -0,0 +1,31 @@
+from rent_scraper.rate_limit import HostLimiter
+
+
+def test_browser_loads_dont_slow_http():
+    limiter = HostLimiter("example.com", rate=2)
+    for _ in range(5):
+        limiter.record(200, 0.1)
+    rate = limiter.rate
+    # A page load in the browser takes far longer than a fetch, but isn't the host slowing down
+    limiter.record(200, 3, client="browser")
+    assert limiter.rate >= rate
+    limiter.record(200, 0.1)
+    assert limiter.rate >= rate
+
+
+def test_slow_down_against_own_baseline():
+    limiter = HostLimiter("example.com", rate=2)
+    limiter.record(200, 3, client="browser")
+    limiter.record(200, 0.1)
+    rate = limiter.rate
+    limiter.record(200, 1)
+    assert limiter.rate == rate / 2
+    limiter.record(200, 20, client="browser")
+    assert limiter.rate == rate / 4
+
+
+def test_browser_failures_open_breaker():
+    limiter = HostLimiter("example.com")
+    for _ in range(5):
+        limiter.record(None, 1, client="browser")
+    assert limiter.reserve() > 0
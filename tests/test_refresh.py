@@ -0,0 +1,47 @@
+import datetime
+
+import pytest
+
+from rent_scraper.persistence import save_listings
+from rent_scraper.model import SimpleListing
+from rent_scraper.refresh import next_interval, RefreshScheduler, MAX_INTERVAL, MIN_INTERVAL
+
+DAY = datetime.timedelta(days=1)
+
+
+def test_typical_listing_is_left_a_day():
+    # A week old, mid priced and changing on half of its checks
+    assert next_interval(7 * DAY, 700, 2, 1) == DAY
+
+
+@pytest.mark.parametrize(
+    "age, price, checks, changes, hours",
+    [
+        (datetime.timedelta(hours=1), 700, 0, 0, 72),
+        (30 * DAY, 700, 0, 0, 12),
+        (7 * DAY, 400, 0, 0, 18),
+        (7 * DAY, 1200, 0, 0, 36),
+        (7 * DAY, 700, 6, 0, 96),
+        (7 * DAY, 700, 6, 6, 24 * 0.5 / (7 / 8)),
+    ],
+)
+def test_next_interval(age, price, checks, changes, hours):
+    assert next_interval(age, price, checks, changes) == datetime.timedelta(hours=hours)
+
+
+def test_next_interval_is_clamped():
+    # New, expensive and never changing
+    assert next_interval(datetime.timedelta(0), 2000, 100, 0) == MAX_INTERVAL
+    # Stale, cheap and always changing
+    assert next_interval(60 * DAY, 300, 100, 100) == MIN_INTERVAL
+
+
+def test_take_only_once(database):
+    details = {"address": "1 Smith Street, Carlton VIC 3053", "price": 500, "beds": 2, "baths": 1, "cars": 0}
+    save_listings({"a": details, "b": {**details, "price": 700}, "c": {**details, "price": 900}})
+    scheduler = RefreshScheduler()
+    scheduler.restore({"a", "b"})
+
+    cheap = SimpleListing.select().where(SimpleListing.price < 800)
+    assert sorted(listing.id for listing in scheduler.take(cheap)) == ["a", "b"]
+    assert scheduler.take(SimpleListing.select()) == []
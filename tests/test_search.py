@@ -0,0 +1,94 @@
+import datetime
+
+import pytest
+
+from rent_scraper import search
+from rent_scraper.model import Query, SimpleListing
+from rent_scraper.search import Reconciler, watermark_reached
+
+
+@pytest.fixture
+def closed(monkeypatch):
+    closed = []
+    monkeypatch.setattr(search, "close_listings", lambda listing_ids: closed.extend(listing_ids))
+    return closed
+
+
+def test_reconcile_complete_range(closed):
+    reconciler = Reconciler()
+    reconciler.swept(Query(lower_price=400, upper_price=600), {"gone": 500, "here": 500}, {"here"}, complete=True)
+    assert reconciler.finish() == []
+    assert closed == ["gone"]
+
+
+def test_reconcile_with_early_stopped_range(closed):
+    reconciler = Reconciler()
+    reconciler.swept(Query(lower_price=400, upper_price=600), {"gone": 500}, set(), complete=True)
+    # The pages it skipped are the same as at its last sweep, so it can't be hiding the missing listing
+    reconciler.swept(Query(lower_price=600, upper_price=800), {"other": 700}, set(), complete=False, covered=True)
+    assert reconciler.finish() == []
+    assert closed == ["gone"]
+
+
+def test_reconcile_with_incomplete_range(closed):
+    reconciler = Reconciler()
+    reconciler.swept(Query(lower_price=400, upper_price=600), {"gone": 500}, set(), complete=True)
+    # Timed out, so the missing listing could be on a page it didn't get to
+    reconciler.swept(Query(lower_price=600, upper_price=800), {"other": 700}, set(), complete=False)
+    assert reconciler.finish() == ["gone"]
+    assert closed == []
+
+
+def test_reconcile_resumed_run(closed):
+    reconciler = Reconciler()
+    reconciler.swept(Query(lower_price=400, upper_price=600), {"gone": 500, "moved": 500}, set(), complete=True)
+    assert reconciler.finish({"moved"}, every_range=False) == ["gone"]
+    assert closed == []
+
+
+def test_reconcile_near_boundary(closed):
+    reconciler = Reconciler()
+    query = Query(lower_price=400, upper_price=600)
+    reconciler.swept(query, {"low": 420, "high": 590, "middle": 500}, set(), complete=True)
+    assert sorted(reconciler.finish()) == ["high", "low"]
+    assert closed == ["middle"]
+
+
+def test_reconcile_seen_in_another_range(closed):
+    reconciler = Reconciler()
+    # Indexed with the wrong number of beds, or repriced into another range
+    reconciler.swept(Query(lower_price=400, upper_price=600, beds="2"), {"moved": 500}, set(), complete=True)
+    reconciler.swept(Query(lower_price=400, upper_price=600, beds="3"), {}, {"moved"}, complete=True)
+    assert reconciler.finish() == []
+    assert closed == []
+
+
+def swept_query(swept_count: int = 100, found_count: int = 98) -> Query:
+    return Query(
+        lower_price=400,
+        upper_price=600,
+        swept_at=datetime.datetime(2026, 1, 1),
+        swept_count=swept_count,
+        found_count=found_count,
+    )
+
+
+def test_watermark_reached():
+    on_page = [SimpleListing(id="a", price=500), SimpleListing(id="b", price=550)]
+    # Two missing at the end of the last sweep, and still two missing now
+    assert watermark_reached(swept_query(), on_page, {"a": 500, "b": 550}, 2)
+
+
+def test_watermark_never_swept():
+    on_page = [SimpleListing(id="a", price=500)]
+    assert not watermark_reached(Query(lower_price=400, upper_price=600), on_page, {"a": 500}, 0)
+
+
+def test_watermark_new_or_repriced_listing():
+    assert not watermark_reached(swept_query(), [SimpleListing(id="new", price=500)], {"a": 500}, 2)
+    assert not watermark_reached(swept_query(), [SimpleListing(id="a", price=520)], {"a": 500}, 2)
+
+
+def test_watermark_count_changed():
+    # Something has been added or removed that we haven't found yet
+    assert not watermark_reached(swept_query(), [SimpleListing(id="a", price=500)], {"a": 500}, 3)
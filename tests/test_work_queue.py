@@ -0,0 +1,62 @@
+import datetime
+
+from rent_scraper import work_queue
+from rent_scraper.model import Job
+from rent_scraper.work_queue import claim, complete, enqueue, fail, unfinished, DONE, FAILED, LEASED, PENDING, SWEEP
+
+
+def expire(job: Job) -> None:
+    Job.update(lease_expires=datetime.datetime(2000, 1, 1)).where(Job.id == job.id).execute()
+
+
+def test_enqueue_skips_unfinished(database):
+    assert enqueue(SWEEP, ["1", "2"]) == 2
+    assert enqueue(SWEEP, ["2", "3"]) == 1
+
+
+def test_claim_once(database):
+    enqueue(SWEEP, ["1", "2"])
+    first = claim(SWEEP)
+    second = claim(SWEEP, limit=5)
+    assert [job.key for job in first] == ["1"]
+    assert [job.key for job in second] == ["2"]
+    assert first[0].status == LEASED and first[0].attempts == 1
+    assert claim(SWEEP) == []
+
+    complete(first[0])
+    complete(second[0])
+    assert Job.get_by_id(first[0].id).status == DONE
+    assert not unfinished(SWEEP)
+
+
+def test_expired_lease_is_taken_over(database):
+    enqueue(SWEEP, ["1"])
+    [job] = claim(SWEEP)
+    expire(job)
+    [taken] = claim(SWEEP)
+    assert taken.id == job.id and taken.attempts == 2
+
+
+def test_failed_job_is_retried_later(database):
+    enqueue(SWEEP, ["1"])
+    [job] = claim(SWEEP)
+    fail(job, RuntimeError("Timed out"))
+    retry = Job.get_by_id(job.id)
+    assert retry.status == PENDING and retry.last_error == "RuntimeError: Timed out"
+    # Not until its backoff is up
+    assert claim(SWEEP) == []
+    assert unfinished()
+
+
+def test_gives_up_after_max_attempts(database, monkeypatch):
+    monkeypatch.setattr(work_queue, "MAX_ATTEMPTS", 1)
+    enqueue(SWEEP, ["1", "2"])
+    first, second = claim(SWEEP, limit=2)
+    fail(first, RuntimeError("Timed out"))
+    assert Job.get_by_id(first.id).status == FAILED
+
+    # Expired on its last attempt, so it isn't tried again
+    expire(second)
+    assert claim(SWEEP) == []
+    assert Job.get_by_id(second.id).status == FAILED
+    assert not unfinished()